@@ -1,5 +1,14 @@
-import os, json, httpx
-from typing import Dict
+import os, json, time, copy, asyncio, hashlib
+import re
+from typing import Awaitable, Callable, Dict, List, Optional, Union
+
+import upstream
+from clients import openai_client, OPENAI_BASE_URL
+from audio import AudioBlob
+from ratelimit import RateLimiter
+from db import cache_get, cache_put, cache_evict
+from logs import log
+from metrics import OPENAI_TOKENS, timed
 
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 
@@ -7,6 +16,26 @@ OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 TRANSCRIBE_MODEL = os.getenv("TRANSCRIBE_MODEL", "whisper-1")
 ANALYZE_MODEL    = os.getenv("ANALYZE_MODEL", "gpt-4o-mini")
 
+# Скільки сегментів довгого голосового транскрибувати одночасно
+TRANSCRIBE_CONCURRENCY = int(os.getenv("TRANSCRIBE_CONCURRENCY", "4"))
+# 1 — хеджувати транскрипцію: дублювати запит, якщо він довший за p95 на байт аудіо (див. upstream.py).
+# Вимкнено за замовчуванням: Whisper тарифікує кожен запит, тож хедж — це оплата тієї ж транскрипції двічі.
+TRANSCRIBE_HEDGE       = os.getenv("TRANSCRIBE_HEDGE", "0")
+
+# Бюджети акаунта OpenAI для chat/completions (див. ліміти тарифу)
+OPENAI_RPM          = int(os.getenv("OPENAI_RPM", "500"))
+OPENAI_TPM          = int(os.getenv("OPENAI_TPM", "200000"))
+ANALYZE_MAX_OUTPUT_TOKENS = int(os.getenv("ANALYZE_MAX_OUTPUT_TOKENS", "1000"))
+
+chat_limiter = RateLimiter(OPENAI_RPM, OPENAI_TPM)
+
+# Кеш аналізів у SQLite: TTL у секундах і максимум записів (LRU)
+ANALYSIS_CACHE_TTL = int(os.getenv("ANALYSIS_CACHE_TTL", str(7 * 24 * 3600)))
+ANALYSIS_CACHE_MAX = int(os.getenv("ANALYSIS_CACHE_MAX", "5000"))
+ANALYSIS_CACHE_EVICT_EVERY = 50   # чистити кеш раз на N нових записів
+
+ANALYZE_SYSTEM = "Ти корисний аналітик нотаток."
+
 ANALYZE_PROMPT = """Ти асистент, який з коротких розмовних нотаток робить структуру.
 Поверни JSON формату:
 {
@@ -19,46 +48,239 @@ ANALYZE_PROMPT = """Ти асистент, який з коротких розм
 Якщо чогось немає — став порожні списки. Дати у ISO (YYYY-MM-DD), час 24-год., таймзона Europe/Kyiv.
 Стисло переформульовуй. Витягуй дедлайни з контексту (“завтра”, “до понеділка”) та нормалізуй."""
 
-async def whisper_transcribe(file_bytes: bytes, filename: str, language: str = "uk") -> str:
+CONSOLIDATE_PROMPT = """Нижче — чернетка звіту, зібрана з аналізів окремих нотаток.
+Об'єднай дублікати й близькі за змістом пункти, не додавай нового. Поверни JSON того самого формату:
+{"events": [], "tasks": [{"title":"", "due": null, "owner":"", "priority":"low|med|high"}], "risks": [], "ideas": [], "quotes": []}"""
+
+ANALYSIS_KEYS = ("events", "tasks", "risks", "ideas", "quotes")
+
+def empty_analysis() -> Dict:
+    return {k: [] for k in ANALYSIS_KEYS}
+
+def _norm(value) -> str:
+    return " ".join(str(value).casefold().split())
+
+def merge_analyses(analyses) -> Dict:
+    """
+    Локальне злиття кількох аналізів у один без виклику моделі.
+    Дедуп за нормалізованим текстом; задачі — за назвою (порожні due/owner доповнюються з дублікатів).
+    """
+    merged = empty_analysis()
+    seen = {k: {} for k in ANALYSIS_KEYS}
+    for a in analyses:
+        if not isinstance(a, dict):
+            continue
+        for k in ANALYSIS_KEYS:
+            for item in a.get(k) or []:
+                if k == "tasks":
+                    if not isinstance(item, dict):
+                        item = {"title": str(item)}
+                    key = _norm(item.get("title", ""))
+                    prev = seen[k].get(key)
+                    if prev is not None:
+                        for field in ("due", "owner"):
+                            if not prev.get(field) and item.get(field):
+                                prev[field] = item[field]
+                        continue
+                    item = dict(item)
+                else:
+                    key = _norm(item)
+                    if key in seen[k]:
+                        continue
+                seen[k][key] = item
+                merged[k].append(item)
+    return merged
+
+@timed("whisper_transcribe")
+async def whisper_transcribe(audio: Union[bytes, AudioBlob], filename: str, language: str = "uk") -> str:
     """
     Пряма робота з OGG/Opus із Telegram для whisper-1.
+    AudioBlob передається у multipart як файловий потік — тіло запиту не збирається в пам'яті.
     """
-    url = "https://api.openai.com/v1/audio/transcriptions"
+    url = f"{OPENAI_BASE_URL}/audio/transcriptions"
     headers = {"Authorization": f"Bearer {OPENAI_API_KEY}"}
-    files = {"file": (filename, file_bytes, "audio/ogg")}
+    if isinstance(audio, (bytes, bytearray)):
+        audio = AudioBlob.from_bytes(bytes(audio))
     data = {"model": TRANSCRIBE_MODEL}
     if language:
         data["language"] = language
 
-    async with httpx.AsyncClient(timeout=90) as client:
-        r = await client.post(url, headers=headers, data=data, files=files)
-        r.raise_for_status()
-        j = r.json()
-        return j.get("text") or j
+    async def send():
+        # Новий потік на кожну спробу/хедж — тіло не перечитується з уже вичитаного файлу
+        with audio.open() as fh:
+            files = {"file": (filename, fh, "audio/ogg")}
+            return await openai_client().post(url, headers=headers, data=data, files=files)
+
+    # Латентність Whisper росте з тривалістю аудіо; розмір OGG/Opus їй приблизно пропорційний
+    r = await upstream.call("transcribe", send, hedge=TRANSCRIBE_HEDGE == "1", cost=max(audio.size, 1))
+    r.raise_for_status()
+    j = r.json()
+    return j.get("text") or j
+
+async def transcribe_segments(
+    segments: List[AudioBlob],
+    filename: str,
+    language: str = "uk",
+    on_progress: Optional[Callable[[int, int], Awaitable[None]]] = None,
+) -> str:
+    """
+    Паралельна транскрипція сегментів довгого аудіо (під TRANSCRIBE_CONCURRENCY)
+    і склейка в порядку сегментів з прибиранням повторів у перекриттях.
+    """
+    if len(segments) == 1:
+        return await whisper_transcribe(segments[0], filename, language)
+
+    sem = asyncio.Semaphore(TRANSCRIBE_CONCURRENCY)
+    stem, ext = os.path.splitext(filename)
+    done = 0
 
+    async def one(n: int, seg: AudioBlob) -> str:
+        nonlocal done
+        async with sem:
+            text = await whisper_transcribe(seg, f"{stem}.part{n}{ext or '.ogg'}", language)
+        done += 1
+        if on_progress is not None:
+            try:
+                await on_progress(done, len(segments))
+            except Exception as e:
+                log("TRANSCRIBE_PROGRESS_ERROR", error=str(e))
+        return text
+
+    texts = await asyncio.gather(*(one(n, seg) for n, seg in enumerate(segments)))
+    return stitch_transcripts(texts)
+
+_WORD_RE = re.compile(r"\w+", re.UNICODE)
+
+def _norm_words(text: str) -> List[str]:
+    return [w.casefold() for w in _WORD_RE.findall(text)]
+
+def stitch_transcripts(texts: List[str], max_overlap_words: int = 30) -> str:
+    """
+    Склеює транскрипції сусідніх сегментів. Сегменти перекриваються на кілька секунд,
+    тож кінець попереднього й початок наступного часто збігаються — найдовший збіг
+    (порівняння слів без регістру й пунктуації) прибирається з початку наступного.
+    """
+    out = ""
+    for text in texts:
+        text = (text or "").strip()
+        if not out:
+            out = text
+            continue
+        if not text:
+            continue
+        prev_words = _norm_words(out)[-max_overlap_words:]
+        tokens = list(_WORD_RE.finditer(text))
+        next_words = [m.group().casefold() for m in tokens[:max_overlap_words]]
+        cut = 0
+        for k in range(min(len(prev_words), len(next_words)), 1, -1):
+            if prev_words[-k:] == next_words[:k]:
+                cut = tokens[k - 1].end()
+                break
+        rest = text[cut:].lstrip(" ,.;:-—")
+        if rest:
+            out = f"{out} {rest}"
+    return out
+
+def estimate_tokens(text: str) -> int:
+    """Груба оцінка токенів без токенізатора: ~3 символи на токен для кирилиці."""
+    return len(text) // 3 + 1
+
+# Лічильники кешу для /diag
+cache_stats = {"hits": 0, "misses": 0, "coalesced": 0}
+_inflight: Dict[str, asyncio.Future] = {}
+_puts_since_evict = 0
+
+def _analysis_key(prompt: str, label: str, text: str) -> str:
+    raw = json.dumps([ANALYZE_MODEL, ANALYZE_SYSTEM, prompt, label, text], ensure_ascii=False)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+@timed("analyze_notes_text")
 async def analyze_notes_text(concatenated_text: str) -> Dict:
-    url = "https://api.openai.com/v1/chat/completions"
+    return await _cached_completion(ANALYZE_PROMPT, "Текст нотаток:", concatenated_text)
+
+async def consolidate_analysis(merged: Dict) -> Dict:
+    """Короткий фінальний виклик: злити дублікати в уже об'єднаному JSON (інкрементальний режим)."""
+    return await _cached_completion(
+        CONSOLIDATE_PROMPT, "Чернетка JSON:", json.dumps(merged, ensure_ascii=False)
+    )
+
+async def _cached_completion(prompt: str, label: str, text: str) -> Dict:
+    """
+    Аналіз з кешем: однаковий (модель, промпт, текст) -> одна completion.
+    Паралельні ідентичні запити чекають на перший (single-flight).
+    """
+    global _puts_since_evict
+    key = _analysis_key(prompt, label, text)
+    while (pending := _inflight.get(key)) is not None:
+        cache_stats["coalesced"] += 1
+        try:
+            return copy.deepcopy(await asyncio.shield(pending))
+        except asyncio.CancelledError:
+            # Скасували лідера, а не нас — повторити: станемо лідером або дочекаємося нового
+            if not pending.cancelled() or asyncio.current_task().cancelling():
+                raise
+
+    fut = asyncio.get_running_loop().create_future()
+    _inflight[key] = fut
+    try:
+        now = int(time.time())
+        cached = await cache_get(key, now - ANALYSIS_CACHE_TTL, now)
+        if cached is not None:
+            cache_stats["hits"] += 1
+            result = json.loads(cached)
+        else:
+            cache_stats["misses"] += 1
+            result = await _complete_json(prompt, label, text)
+            await cache_put(key, json.dumps(result, ensure_ascii=False), now)
+            _puts_since_evict += 1
+            if _puts_since_evict >= ANALYSIS_CACHE_EVICT_EVERY:
+                _puts_since_evict = 0
+                await cache_evict(now - ANALYSIS_CACHE_TTL, ANALYSIS_CACHE_MAX)
+        fut.set_result(result)
+        return copy.deepcopy(result)
+    except Exception as e:
+        fut.set_exception(e)
+        fut.exception()  # позначити як отриману, якщо ніхто не чекав
+        raise
+    finally:
+        # Лідера скасовано (CancelledError — не Exception): не лишати очікувачів на вічно порожньому future
+        if not fut.done():
+            fut.cancel()
+        _inflight.pop(key, None)
+
+async def _complete_json(prompt: str, label: str, text: str) -> Dict:
+    url = f"{OPENAI_BASE_URL}/chat/completions"
     headers = {"Authorization": f"Bearer {OPENAI_API_KEY}"}
     payload = {
         "model": ANALYZE_MODEL,
         "messages": [
-            {"role": "system", "content": "Ти корисний аналітик нотаток."},
-            {"role": "user", "content": ANALYZE_PROMPT + "\n\nТекст нотаток:\n" + concatenated_text}
+            {"role": "system", "content": ANALYZE_SYSTEM},
+            {"role": "user", "content": f"{prompt}\n\n{label}\n{text}"}
         ],
         "temperature": 0.2
     }
-    async with httpx.AsyncClient(timeout=90) as client:
-        r = await client.post(url, headers=headers, json=payload)
-        r.raise_for_status()
-        content = r.json()["choices"][0]["message"]["content"]
+    need = estimate_tokens(payload["messages"][1]["content"]) + ANALYZE_MAX_OUTPUT_TOKENS
+    r = await upstream.call(
+        "chat",
+        lambda: openai_client().post(url, headers=headers, json=payload),
+        limiter=chat_limiter,
+        tokens=need,
+    )
+    r.raise_for_status()
+    body = r.json()
+    usage = body.get("usage") or {}
+    OPENAI_TOKENS.labels("prompt").inc(usage.get("prompt_tokens", 0))
+    OPENAI_TOKENS.labels("completion").inc(usage.get("completion_tokens", 0))
+    content = body["choices"][0]["message"]["content"]
     try:
         return json.loads(content)
     except Exception:
         start = content.find("{"); end = content.rfind("}")
         if start != -1 and end != -1:
             return json.loads(content[start:end+1])
-        return {"events":[], "tasks":[], "risks":[], "ideas":[], "quotes":[]}
+        return empty_analysis()
 
+@timed("render_daily_summary")
 def render_daily_summary(date_str: str, author: str, analysis: Dict) -> str:
     lines = [f"**Звіт за {date_str} ({author})**"]
     if analysis.get("events"):
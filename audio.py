@@ -0,0 +1,285 @@
+import os
+import io
+import binascii
+import tempfile
+from typing import BinaryIO, Optional
+
+import httpx
+
+# До скількох байт тримати аудіо в пам'яті; більше — у тимчасовому файлі на диску
+AUDIO_SPOOL_BYTES = int(os.getenv("AUDIO_SPOOL_BYTES", str(1024 * 1024)))
+# Telegram Bot API віддає файли до 20 МБ
+MAX_VOICE_BYTES   = int(os.getenv("MAX_VOICE_BYTES", str(20 * 1024 * 1024)))
+MAX_VOICE_SECONDS = int(os.getenv("MAX_VOICE_SECONDS", "3600"))
+
+DOWNLOAD_CHUNK = 64 * 1024
+
+
+class AudioTooLarge(Exception):
+    pass
+
+
+class AudioBlob:
+    """
+    Аудіо або в пам'яті (малі файли), або в тимчасовому файлі (великі).
+    open() щоразу повертає новий незалежний потік — щоб завантаження можна було повторити.
+    """
+
+    def __init__(self, data: Optional[bytes] = None, path: Optional[str] = None, size: int = 0):
+        self._data = data
+        self.path = path
+        self.size = size if size else (len(data) if data is not None else 0)
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> "AudioBlob":
+        return cls(data=data)
+
+    def open(self) -> BinaryIO:
+        if self._data is not None:
+            return io.BytesIO(self._data)
+        return open(self.path, "rb")
+
+    def close(self):
+        if self.path:
+            try:
+                os.unlink(self.path)
+            except FileNotFoundError:
+                pass
+            self.path = None
+        self._data = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+async def download_audio(client: httpx.AsyncClient, url: str,
+                         spool_bytes: int = AUDIO_SPOOL_BYTES,
+                         max_bytes: int = MAX_VOICE_BYTES) -> AudioBlob:
+    """
+    Потокове завантаження без r.content: до spool_bytes — у пам'ять, далі — у тимчасовий файл.
+    Більше за max_bytes -> AudioTooLarge (завантаження обривається одразу).
+    """
+    buf = bytearray()
+    spool = None
+    size = 0
+    try:
+        async with client.stream("GET", url) as r:
+            r.raise_for_status()
+            async for chunk in r.aiter_bytes(DOWNLOAD_CHUNK):
+                size += len(chunk)
+                if size > max_bytes:
+                    raise AudioTooLarge(f"audio > {max_bytes} bytes")
+                if spool is None and size <= spool_bytes:
+                    buf += chunk
+                    continue
+                if spool is None:
+                    spool = tempfile.NamedTemporaryFile(prefix="voice-", suffix=".ogg", delete=False)
+                    spool.write(buf)
+                    buf = bytearray()
+                spool.write(chunk)
+    except BaseException:
+        if spool is not None:
+            spool.close()
+            os.unlink(spool.name)
+        raise
+    if spool is not None:
+        spool.close()
+        return AudioBlob(path=spool.name, size=size)
+    return AudioBlob(data=bytes(buf), size=size)
+
+
+# ===== Нарізка довгих OGG/Opus =====
+# Без декодування: сторінки Ogg копіюються як є (з перерахунком seq/granule/CRC),
+# а «тишу» шукаємо за бітрейтом сторінки — у VBR Opus тихі кадри займають кілька байт.
+
+SEGMENT_SECONDS         = int(os.getenv("SEGMENT_SECONDS", "240"))
+SEGMENT_OVERLAP_SECONDS = float(os.getenv("SEGMENT_OVERLAP_SECONDS", "2"))
+SEGMENT_SEARCH_SECONDS  = float(os.getenv("SEGMENT_SEARCH_SECONDS", "20"))
+# Ліміт OpenAI на файл транскрипції — 25 МБ; беремо із запасом
+OPENAI_MAX_AUDIO_BYTES  = int(os.getenv("OPENAI_MAX_AUDIO_BYTES", str(24 * 1024 * 1024)))
+
+OPUS_RATE = 48000
+NO_GRANULE = 0xFFFFFFFFFFFFFFFF
+
+# CRC Ogg — це CRC-32 (поліном 0x04C11DB7) без віддзеркалення, init 0, xorout 0.
+# binascii.crc32 рахує віддзеркалений варіант на C, тож перевертаємо біти у вхідних байтах
+# і в результаті — це в рази швидше за табличний цикл на Python.
+_REV8 = bytes(int(f"{i:08b}"[::-1], 2) for i in range(256))
+
+def ogg_crc(data: bytes) -> int:
+    raw = binascii.crc32(data.translate(_REV8), 0xFFFFFFFF) ^ 0xFFFFFFFF
+    return int(f"{raw:032b}"[::-1], 2)
+
+
+class OggPage:
+    __slots__ = ("offset", "length", "flags", "granule", "seq", "body_len", "start", "end")
+
+    def __init__(self, offset, length, flags, granule, seq, body_len):
+        self.offset = offset
+        self.length = length
+        self.flags = flags
+        self.granule = granule
+        self.seq = seq
+        self.body_len = body_len
+        self.start = 0.0   # секунди від початку (заповнюється після сканування)
+        self.end = 0.0
+
+    @property
+    def continued(self) -> bool:
+        return bool(self.flags & 0x01)
+
+
+def scan_ogg_pages(fh: BinaryIO) -> list:
+    """Індекс сторінок Ogg (без тіл): зсув, довжина, прапорці, granule, розмір тіла."""
+    pages = []
+    while True:
+        offset = fh.tell()
+        header = fh.read(27)
+        if len(header) < 27:
+            break
+        if header[:4] != b"OggS":
+            raise ValueError(f"not an Ogg page at {offset}")
+        nsegs = header[26]
+        lacing = fh.read(nsegs)
+        body_len = sum(lacing)
+        fh.seek(body_len, io.SEEK_CUR)
+        pages.append(OggPage(
+            offset=offset,
+            length=27 + nsegs + body_len,
+            flags=header[5],
+            granule=int.from_bytes(header[6:14], "little"),
+            seq=int.from_bytes(header[18:22], "little"),
+            body_len=body_len,
+        ))
+    return pages
+
+
+def _rewrite_page(raw: bytes, seq: int, granule: int, flags: int) -> bytes:
+    page = bytearray(raw)
+    page[5] = flags
+    page[6:14] = granule.to_bytes(8, "little")
+    page[18:22] = seq.to_bytes(4, "little")
+    page[22:26] = b"\0\0\0\0"
+    page[22:26] = ogg_crc(bytes(page)).to_bytes(4, "little")
+    return bytes(page)
+
+
+def _opus_layout(fh: BinaryIO):
+    """(header_pages, audio_pages, pre_skip) або None, якщо це не Ogg/Opus."""
+    fh.seek(0)
+    if fh.read(4) != b"OggS":
+        return None
+    fh.seek(0)
+    pages = scan_ogg_pages(fh)
+    if not pages:
+        return None
+    first = pages[0]
+    fh.seek(first.offset + first.length - first.body_len)
+    head = fh.read(19)
+    if head[:8] != b"OpusHead":
+        return None
+    pre_skip = int.from_bytes(head[10:12], "little")
+    # Заголовкові сторінки (OpusHead, OpusTags) мають granule 0
+    n_head = 0
+    while n_head < len(pages) and pages[n_head].granule == 0:
+        n_head += 1
+    header_pages, audio_pages = pages[:n_head], pages[n_head:]
+    prev = 0
+    for p in audio_pages:
+        p.start = prev / OPUS_RATE
+        if p.granule != NO_GRANULE:
+            prev = p.granule
+        p.end = prev / OPUS_RATE
+    return header_pages, audio_pages, pre_skip
+
+
+def _choose_cuts(pages: list, segment_s: float, search_s: float) -> list:
+    """Індекси сторінок, з яких починаються сегменти (перший — 0). Ріжемо в найтихішому місці вікна."""
+    cuts = [0]
+    total = pages[-1].end
+    while total - pages[cuts[-1]].start > segment_s + search_s:
+        seg_start = pages[cuts[-1]].start
+        target = seg_start + segment_s
+        best, best_rate = None, None
+        for i in range(cuts[-1] + 1, len(pages)):
+            p = pages[i]
+            if p.start > target:
+                break
+            if p.start < target - search_s or p.continued or p.end <= p.start:
+                continue
+            rate = p.body_len / (p.end - p.start)
+            if best_rate is None or rate < best_rate:
+                best, best_rate = i, rate
+        if best is None:
+            # У вікні немає чистої межі пакета — беремо першу можливу після target
+            best = next((i for i in range(cuts[-1] + 1, len(pages))
+                         if pages[i].start >= target and not pages[i].continued), None)
+            if best is None:
+                break
+        cuts.append(best)
+    return cuts
+
+
+def _write_segment(fh: BinaryIO, header_pages: list, pages: list, base_granule: int) -> AudioBlob:
+    out = io.BytesIO()
+    for p in header_pages:
+        fh.seek(p.offset)
+        out.write(fh.read(p.length))
+    seq = len(header_pages)
+    for n, p in enumerate(pages):
+        fh.seek(p.offset)
+        raw = fh.read(p.length)
+        granule = p.granule if p.granule == NO_GRANULE else p.granule - base_granule
+        flags = (p.flags & 0x01) | (0x04 if n == len(pages) - 1 else 0)
+        out.write(_rewrite_page(raw, seq, granule, flags))
+        seq += 1
+    data = out.getvalue()
+    if len(data) <= AUDIO_SPOOL_BYTES:
+        return AudioBlob(data=data)
+    spool = tempfile.NamedTemporaryFile(prefix="voice-seg-", suffix=".ogg", delete=False)
+    with spool:
+        spool.write(data)
+    return AudioBlob(path=spool.name, size=len(data))
+
+
+def split_ogg_opus(audio: AudioBlob, segment_s: float = SEGMENT_SECONDS,
+                   overlap_s: float = SEGMENT_OVERLAP_SECONDS,
+                   search_s: float = SEGMENT_SEARCH_SECONDS) -> list:
+    """
+    Ділить довге OGG/Opus на сегменти ~segment_s секунд з перекриттям overlap_s.
+    Повертає [audio], якщо ділити не треба або формат не розпізнано.
+    Сегменти — нові AudioBlob; закривати їх (крім самого audio) має викликач.
+    """
+    with audio.open() as fh:
+        layout = _opus_layout(fh)
+        if layout is None:
+            return [audio]
+        header_pages, pages, _ = layout
+        if not pages:
+            return [audio]
+        if audio.size > OPENAI_MAX_AUDIO_BYTES:
+            # Гарантувати, що кожен сегмент влізе в ліміт розміру OpenAI
+            per_s = audio.size / max(pages[-1].end, 1)
+            segment_s = min(segment_s, OPENAI_MAX_AUDIO_BYTES * 0.9 / per_s - search_s)
+        segment_s = max(segment_s, 1.0 + overlap_s)
+        cuts = _choose_cuts(pages, segment_s, search_s)
+        if len(cuts) == 1:
+            return [audio]
+
+        segments = []
+        for n, cut in enumerate(cuts):
+            end = cuts[n + 1] if n + 1 < len(cuts) else len(pages)
+            start = cut
+            if n > 0:
+                # Перекриття: відступаємо на overlap_s назад до чистої межі пакета
+                while (start > cuts[n - 1] + 1 and
+                       (pages[cut].start - pages[start].start < overlap_s or pages[start].continued)):
+                    start -= 1
+                if pages[start].continued:
+                    start = cut
+            base = int(pages[start].start * OPUS_RATE)
+            segments.append(_write_segment(fh, header_pages, pages[start:end], base))
+    return segments
@@ -0,0 +1,116 @@
+"""
+Латентність HTTP-частини однієї голосової нотатки (getFile -> завантаження файлу -> транскрипція)
+проти фейкових Telegram/OpenAI по HTTPS: новий httpx.AsyncClient на кожен запит (як до clients.py)
+проти спільних клієнтів з keep-alive пулом (clients.telegram_client/openai_client).
+
+    python bench/bench_clients.py --notes 300 --concurrency 10
+    python bench/bench_clients.py --no-tls          # без TLS — лишається лише TCP-з'єднання
+"""
+import os
+import sys
+import time
+import json
+import asyncio
+import argparse
+
+import httpx
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))
+sys.path.insert(0, HERE)
+
+from fake_upstreams import FakeUpstreams  # noqa: E402
+
+TOKEN = "123456:bench"
+
+
+def pct(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * q))] if values else 0.0
+
+
+async def one_note(n: int, tg: httpx.AsyncClient, oa: httpx.AsyncClient, tg_url: str, oa_url: str):
+    r = await tg.post(f"{tg_url}/bot{TOKEN}/getFile", json={"file_id": f"file-{n}"})
+    r.raise_for_status()
+    path = r.json()["result"]["file_path"]
+    r = await tg.get(f"{tg_url}/file/bot{TOKEN}/{path}")
+    r.raise_for_status()
+    r = await oa.post(
+        f"{oa_url}/audio/transcriptions", headers={"Authorization": "Bearer sk-bench"},
+        data={"model": "whisper-1"}, files={"file": ("voice.ogg", r.content, "audio/ogg")},
+    )
+    r.raise_for_status()
+
+
+async def run_mode(mode: str, notes: int, concurrency: int, fakes: FakeUpstreams):
+    import clients
+
+    sem = asyncio.Semaphore(concurrency)
+    lat = []
+
+    async def per_call(n: int):
+        # Як до clients.py: кожен запит — свій клієнт, тож нове TCP(+TLS)-з'єднання
+        class Fresh:
+            async def post(self, *a, **kw):
+                async with httpx.AsyncClient(timeout=90) as c:
+                    return await c.post(*a, **kw)
+
+            async def get(self, *a, **kw):
+                async with httpx.AsyncClient(timeout=90) as c:
+                    return await c.get(*a, **kw)
+
+        await one_note(n, Fresh(), Fresh(), fakes.telegram_url, fakes.openai_url)
+
+    async def shared(n: int):
+        await one_note(n, clients.telegram_client(), clients.openai_client(), fakes.telegram_url, fakes.openai_url)
+
+    job = per_call if mode == "per_call" else shared
+
+    async def timed(n: int):
+        async with sem:
+            t = time.perf_counter()
+            await job(n)
+            lat.append(time.perf_counter() - t)
+
+    await clients.start_clients()
+    try:
+        t = time.perf_counter()
+        await asyncio.gather(*(timed(n) for n in range(notes)))
+        elapsed = time.perf_counter() - t
+    finally:
+        await clients.close_clients()
+    return {
+        "mode": mode, "notes": notes, "concurrency": concurrency, "tls": fakes.tls,
+        "per_sec": round(notes / elapsed, 1),
+        "note_p50_ms": round(pct(lat, 0.5) * 1000, 1), "note_p99_ms": round(pct(lat, 0.99) * 1000, 1),
+    }
+
+
+async def main_async(args):
+    fakes = FakeUpstreams(telegram_latency=args.telegram_latency, openai_latency=args.openai_latency,
+                          tls=not args.no_tls)
+    await fakes.start()
+    if fakes.cert_file:
+        # httpx (trust_env) довіряє самопідписаному сертифікату фейкового сервера
+        os.environ["SSL_CERT_FILE"] = fakes.cert_file
+    try:
+        # Прогрів: імпорти, перший TLS-контекст
+        await run_mode("shared", 5, 5, fakes)
+        for mode in ("per_call", "shared"):
+            print(json.dumps(await run_mode(mode, args.notes, args.concurrency, fakes), ensure_ascii=False))
+    finally:
+        await fakes.stop()
+
+
+def main_cli():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--notes", type=int, default=300)
+    ap.add_argument("--concurrency", type=int, default=10)
+    ap.add_argument("--telegram-latency", type=float, default=0.02)
+    ap.add_argument("--openai-latency", type=float, default=0.3)
+    ap.add_argument("--no-tls", action="store_true")
+    asyncio.run(main_async(ap.parse_args()))
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,92 @@
+"""
+Порівняння старого доступу до БД (новий aiosqlite.connect на кожен виклик, коміт на кожну нотатку)
+з NoteStore (один писач + пул читачів + груповий коміт).
+
+    python bench/bench_db.py --notes 2000 --concurrency 50
+"""
+import os
+import sys
+import time
+import asyncio
+import argparse
+import tempfile
+
+import aiosqlite
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import db  # noqa: E402
+
+
+def pct(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * q))] if values else 0.0
+
+
+async def legacy_add(path, user_id, chat_id, text, ts):
+    async with aiosqlite.connect(path) as conn:
+        await conn.execute(db.SQL_INSERT_NOTE, (user_id, chat_id, text, ts))
+        await conn.commit()
+
+
+async def legacy_query(path, chat_id, start, end):
+    async with aiosqlite.connect(path) as conn:
+        cur = await conn.execute(db.SQL_NOTES_CHAT_BETWEEN, (chat_id, start, end))
+        return await cur.fetchall()
+
+
+async def run(label, add, query, notes, concurrency, chats):
+    sem = asyncio.Semaphore(concurrency)
+    base = int(time.time())
+
+    async def one(i):
+        async with sem:
+            await add(str(i % 97), str(i % chats), f"нотатка {i} " + "x" * 200, base + i)
+
+    t0 = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(notes)))
+    ingest_s = time.perf_counter() - t0
+
+    lat = []
+
+    async def q(i):
+        async with sem:
+            t = time.perf_counter()
+            await query(str(i % chats), base, base + notes)
+            lat.append(time.perf_counter() - t)
+
+    await asyncio.gather(*(q(i) for i in range(500)))
+    print(f"{label:8s} ingest={notes / ingest_s:8.0f} notes/s  "
+          f"query p50={pct(lat, 0.5) * 1000:6.2f}ms p99={pct(lat, 0.99) * 1000:6.2f}ms")
+
+
+async def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--notes", type=int, default=2000)
+    ap.add_argument("--concurrency", type=int, default=50)
+    ap.add_argument("--chats", type=int, default=20)
+    args = ap.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        legacy_path = os.path.join(tmp, "legacy.db")
+        store = db.NoteStore(legacy_path)
+        await store.open()  # лише щоб створити схему
+        await store.close()
+        await run("legacy",
+                  lambda *a: legacy_add(legacy_path, *a),
+                  lambda *a: legacy_query(legacy_path, *a),
+                  args.notes, args.concurrency, args.chats)
+
+        store = db.NoteStore(os.path.join(tmp, "store.db"))
+        await store.open()
+        try:
+            await run("store",
+                      lambda u, c, t, ts: store.execute_write(db.SQL_INSERT_NOTE, (u, c, t, ts)),
+                      lambda c, s, e: store.fetchall(db.SQL_NOTES_CHAT_BETWEEN, (c, s, e)),
+                      args.notes, args.concurrency, args.chats)
+        finally:
+            await store.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,158 @@
+"""
+Латентність /find (FTS5 по notes.text) на великій БД: генерує N синтетичних нотаток українською
+(тригери заповнюють notes_fts), далі міряє db.search_notes через NoteStore для типових запитів.
+
+    python bench/bench_fts.py --notes 1000000
+    FTS_TOKENIZE=trigram python bench/bench_fts.py --notes 1000000
+    python bench/bench_fts.py --db /tmp/fts.db --reuse      # повторний прогін на вже згенерованій БД
+"""
+import os
+import sys
+import time
+import json
+import random
+import sqlite3
+import asyncio
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import db  # noqa: E402
+from search import build_match  # noqa: E402
+
+STEMS = [
+    "звіт", "клієнт", "зустріч", "проєкт", "бюджет", "договір", "реліз", "дизайн", "тест", "сервер",
+    "задач", "оплат", "рахунк", "постачальник", "склад", "доставк", "менеджер", "презентаці", "план",
+    "ризик", "дедлайн", "команд", "відпустк", "закупівл", "маркетинг", "продаж", "кампані", "аналітик",
+]
+ENDINGS = ["", "и", "у", "ом", "ів", "ами", "ах", "а", "і", "ою"]
+FILLER = [
+    "сьогодні", "завтра", "треба", "зробити", "перевірити", "обговорили", "вирішили", "нова", "версія",
+    "терміново", "після", "обіду", "з", "на", "до", "в", "по", "і", "та", "що", "ще", "раз", "все", "ок",
+]
+# Рідкісні слова: кожне трапляється приблизно в 0.01% нотаток
+RARE = [f"артефакт{i}" for i in range(100)]
+
+
+def pct(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * q))] if values else 0.0
+
+
+def gen_text(rng: random.Random) -> str:
+    words = []
+    for _ in range(rng.randint(8, 40)):
+        if rng.random() < 0.35:
+            words.append(rng.choice(STEMS) + rng.choice(ENDINGS))
+        else:
+            words.append(rng.choice(FILLER))
+    if rng.random() < 0.01:
+        words.insert(rng.randint(0, len(words)), rng.choice(RARE))
+    return " ".join(words)
+
+
+async def prepare(path: str):
+    store = db.NoteStore(path)
+    await store.open()   # міграції, у т.ч. notes_fts + тригери
+    await store.close()
+
+
+def fill(path: str, notes: int, chats: int, users: int, seed: int):
+    rng = random.Random(seed)
+    conn = sqlite3.connect(path)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=OFF")
+    base = int(time.time()) - notes * 30
+    t0 = time.perf_counter()
+    batch = []
+    for i in range(notes):
+        # Чати нерівномірні: перші — «великі», хвіст — дрібні
+        chat = -100 - min(chats - 1, int(rng.paretovariate(1.2)) - 1)
+        batch.append((rng.randrange(users), chat, gen_text(rng), base + i * 30))
+        if len(batch) == 20000:
+            conn.executemany(db.SQL_INSERT_NOTE, batch)
+            conn.commit()
+            batch.clear()
+    if batch:
+        conn.executemany(db.SQL_INSERT_NOTE, batch)
+        conn.commit()
+    conn.execute("INSERT INTO notes_fts(notes_fts) VALUES ('optimize')")
+    conn.commit()
+    conn.close()
+    return time.perf_counter() - t0, base
+
+
+async def measure(path: str, runs: int, chats: int, base: int, notes: int):
+    store = db.NoteStore(path)
+    await store.open()
+    db._store = store
+    week = (base + (notes - 7 * 2880) * 30, base + notes * 30)
+    cases = [
+        ("rare_word_chat", "артефакт7", {"chat_id": -100}),
+        ("common_word_chat", "звіти", {"chat_id": -100}),
+        ("two_words_chat", "клієнт договір", {"chat_id": -100}),
+        ("phrase_chat", '"нова версія"', {"chat_id": -100}),
+        # Основа довша за найбільший префіксний індекс (FTS_PREFIX) — OR точних словоформ
+        ("long_stem_chat", "постачальниками", {"chat_id": -100}),
+        ("common_word_small_chat", "звіти", {"chat_id": -100 - (chats - 1)}),
+        ("rare_word_small_chat", "артефакт7", {"chat_id": -100 - (chats - 1)}),
+        ("common_word_user", "бюджет", {"user_id": 7}),
+        ("common_word_chat_last_week", "реліз", {"chat_id": -100, "start_epoch": week[0], "end_epoch": week[1]}),
+        ("common_word_chat_page_10", "звіти", {"chat_id": -100, "offset": 50}),
+    ]
+    out = []
+    for name, query, kw in cases:
+        match = build_match(query)
+        lat = []
+        found = 0
+        for _ in range(runs):
+            t = time.perf_counter()
+            rows = await db.search_notes(match, limit=6, **kw)
+            lat.append(time.perf_counter() - t)
+            found = len(rows)
+        out.append({
+            "case": name, "match": match, "rows": found,
+            "p50_ms": round(pct(lat, 0.5) * 1000, 2), "p99_ms": round(pct(lat, 0.99) * 1000, 2),
+        })
+    await store.close()
+    db._store = None
+    return out
+
+
+async def main_async(args):
+    path = args.db or os.path.join(tempfile.mkdtemp(prefix="voicebot-fts-"), "notes.db")
+    info = {"db": path, "notes": args.notes, "tokenize": db.FTS_TOKENIZE}
+    if args.reuse and os.path.exists(path):
+        conn = sqlite3.connect(path)
+        base = conn.execute("SELECT MIN(created_at_epoch) FROM notes").fetchone()[0]
+        info["notes"] = conn.execute("SELECT COUNT(*) FROM notes").fetchone()[0]
+        conn.close()
+    else:
+        await prepare(path)
+        fill_s, base = fill(path, args.notes, args.chats, args.users, args.seed)
+        info["fill_s"] = round(fill_s, 1)
+    info["db_mb"] = round(os.path.getsize(path) / (1024 * 1024), 1)
+    conn = sqlite3.connect(path)
+    info["fts_mb"] = round(conn.execute(
+        "SELECT COALESCE(SUM(pgsize), 0) FROM dbstat WHERE name LIKE 'notes_fts%'").fetchone()[0] / (1024 * 1024), 1)
+    conn.close()
+    print(json.dumps(info, ensure_ascii=False))
+    for row in await measure(path, args.runs, args.chats, base, info["notes"]):
+        print(json.dumps(row, ensure_ascii=False))
+
+
+def main_cli():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--notes", type=int, default=1_000_000)
+    ap.add_argument("--chats", type=int, default=200)
+    ap.add_argument("--users", type=int, default=2000)
+    ap.add_argument("--runs", type=int, default=200)
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("--db", default="")
+    ap.add_argument("--reuse", action="store_true")
+    asyncio.run(main_async(ap.parse_args()))
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,89 @@
+"""
+Пікова пам'ять (RSS) при N одночасних голосових по 20 МБ: старий шлях (r.content -> bytes у multipart)
+проти потокового (download_audio -> AudioBlob -> файловий потік у multipart).
+Мережі немає: фейковий транспорт httpx віддає файл частинами і «з'їдає» тіло upload-у, не буферизуючи.
+
+    python bench/bench_voice_memory.py --notes 8 --size-mb 20
+"""
+import os
+import sys
+import asyncio
+import argparse
+import resource
+import subprocess
+
+import httpx
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+class FakeUpstream(httpx.AsyncBaseTransport):
+    """GET віддає size байт шматками по 64 КБ; POST читає тіло потоком і відповідає {"text": ...}."""
+
+    def __init__(self, size: int):
+        self.size = size
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        if request.method == "GET":
+            async def body():
+                left = self.size
+                chunk = b"\0" * 65536
+                while left > 0:
+                    n = min(left, len(chunk))
+                    left -= n
+                    yield chunk[:n]
+                    await asyncio.sleep(0)
+            return httpx.Response(200, content=body())
+        received = 0
+        async for part in request.stream:
+            received += len(part)
+            await asyncio.sleep(0)
+        return httpx.Response(200, json={"text": f"received {received}"})
+
+
+def peak_rss_mb() -> float:
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+async def run_mode(mode: str, notes: int, size: int):
+    import clients
+    import ai
+    from audio import download_audio
+
+    transport = FakeUpstream(size)
+    clients._openai = httpx.AsyncClient(transport=transport)
+    clients._telegram = httpx.AsyncClient(transport=transport)
+
+    async def legacy():
+        r = await clients.telegram_client().get("http://tg/file")
+        file_bytes = r.content
+        return await ai.whisper_transcribe(file_bytes, "voice.ogg")
+
+    async def streaming():
+        with await download_audio(clients.telegram_client(), "http://tg/file", max_bytes=size) as audio:
+            return await ai.whisper_transcribe(audio, "voice.ogg")
+
+    fn = legacy if mode == "legacy" else streaming
+    await asyncio.gather(*(fn() for _ in range(notes)))
+    await clients.close_clients()
+    print(f"{mode:9s} notes={notes} size={size // (1024 * 1024)}MB peak_rss={peak_rss_mb():.1f}MB")
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--notes", type=int, default=8)
+    ap.add_argument("--size-mb", type=int, default=20)
+    ap.add_argument("--mode", choices=["legacy", "streaming"])
+    args = ap.parse_args()
+    size = args.size_mb * 1024 * 1024
+    if args.mode:
+        asyncio.run(run_mode(args.mode, args.notes, size))
+        return
+    # ru_maxrss монотонний — кожен режим у власному процесі
+    for mode in ("legacy", "streaming"):
+        subprocess.run([sys.executable, __file__, "--mode", mode,
+                        "--notes", str(args.notes), "--size-mb", str(args.size_mb)], check=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,139 @@
+"""
+Перевірка map-reduce аналізу (summarize.chunk_notes / analyze_texts); exit 1 при порушенні.
+
+1. chunk_notes на синтетичних нотатках різних розмірів: кожен шматок ≤ бюджету, порядок і повнота
+   нотаток збережені, останні overlap нотаток шматка повторюються на початку наступного (якщо влазять),
+   завеликі нотатки розрізані на частини ≤ бюджету.
+2. analyze_texts проти фейкового OpenAI (bench/fake_upstreams.py), де латентність росте з довжиною
+   промпту: на вході в 1x і 10x бюджету розмір промпту на виклик обмежений, а 10x через map-reduce
+   швидший за один виклик з усім текстом.
+
+    python bench/check_chunking.py
+"""
+import os
+import sys
+import time
+import json
+import random
+import asyncio
+import tempfile
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))
+sys.path.insert(0, HERE)
+
+from fake_upstreams import FakeUpstreams  # noqa: E402
+
+BUDGET = 2000
+
+
+def synthetic_notes(rng: random.Random, total_tokens: int, oversized: bool = True):
+    notes, tokens = [], 0
+    while tokens < total_tokens:
+        # Переважно короткі нотатки, зрідка — довгі й завеликі для одного шматка
+        size = rng.choice([60, 150, 400, 900])
+        if oversized and rng.random() < 0.03:
+            size = rng.choice([BUDGET * 3, BUDGET * 7])
+        words = " ".join(f"слово{rng.randrange(10_000)}" for _ in range(size // 4))
+        lines = [words[i:i + 300] for i in range(0, len(words), 300)]
+        notes.append("\n".join(lines))
+        tokens += len(notes[-1]) // 3
+    return notes
+
+
+def check_chunks(failures: list):
+    from ai import estimate_tokens
+    from summarize import chunk_notes
+
+    rng = random.Random(1)
+    for budget in (200, 1000, BUDGET, 6000):
+        for overlap in (0, 1, 2):
+            notes = synthetic_notes(rng, budget * 12)
+            chunks = chunk_notes(notes, budget=budget, overlap=overlap)
+            name = f"budget={budget} overlap={overlap}"
+            for n, chunk in enumerate(chunks):
+                used = sum(estimate_tokens(p) for p in chunk)
+                if used > budget:
+                    failures.append(f"{name}: chunk {n} has {used} tokens")
+            # Перекриття: початок шматка — хвіст попереднього (k нотаток); менше за overlap — лише якщо
+            # ще одна нотатка не влізла б у бюджет. Без повторів шматки складаються у вихідний текст.
+            rebuilt, prev = [], []
+            for chunk in chunks:
+                k = max((j for j in range(1, min(overlap, len(prev), len(chunk) - 1) + 1)
+                         if chunk[:j] == prev[-j:]), default=0)
+                if prev and k < min(overlap, len(prev)):
+                    wider = sum(estimate_tokens(c) for c in prev[-(k + 1):]) + estimate_tokens(chunk[k])
+                    if wider <= budget:
+                        failures.append(f"{name}: overlap {k} notes, but {k + 1} fit the budget")
+                rebuilt.extend(chunk[k:])
+                prev = chunk
+            if "\n".join(rebuilt).replace("\n", "") != "\n".join(notes).replace("\n", ""):
+                failures.append(f"{name}: notes lost, duplicated or reordered")
+            print(json.dumps({"check": "chunk_notes", "budget": budget, "overlap": overlap,
+                              "notes": len(notes), "chunks": len(chunks)}))
+
+
+async def check_map_reduce(failures: list, fakes: FakeUpstreams):
+    import db
+    import clients
+    from ai import analyze_notes_text, estimate_tokens
+    from summarize import analyze_texts, ANALYZE_MAP_CONCURRENCY
+
+    await db.init_db()
+    await clients.start_clients()
+    rng = random.Random(2)
+    try:
+        for scale in (1, 10):
+            # 1x — трохи менше бюджету (один виклик), 10x — у десять разів більше
+            notes = synthetic_notes(rng, int(BUDGET * scale * 0.9), oversized=False)
+            start = len(fakes.chat_prompt_chars)
+            t = time.perf_counter()
+            await analyze_texts(notes)
+            mapped_s = time.perf_counter() - t
+            prompts = fakes.chat_prompt_chars[start:]
+            max_tokens = max(estimate_tokens("x" * c) for c in prompts)
+
+            # Як до map-reduce: увесь текст одним викликом (інший текст — щоб не влучити в кеш аналізів)
+            t = time.perf_counter()
+            await analyze_notes_text("\n".join(notes) + f"\n#{scale}")
+            single_s = time.perf_counter() - t
+
+            # Бюджет — на текст нотаток; промпт додає інструкцію (~250 токенів)
+            if max_tokens > BUDGET + 400:
+                failures.append(f"x{scale}: prompt of {max_tokens} tokens exceeds budget {BUDGET}")
+            if scale > 1 and mapped_s >= single_s:
+                failures.append(f"x{scale}: map-reduce {mapped_s:.2f}s not faster than single {single_s:.2f}s")
+            print(json.dumps({"check": "map_reduce", "input_x_budget": scale, "notes": len(notes),
+                              "calls": len(prompts), "max_prompt_tokens": max_tokens,
+                              "map_concurrency": ANALYZE_MAP_CONCURRENCY,
+                              "map_reduce_s": round(mapped_s, 2), "single_call_s": round(single_s, 2)}))
+    finally:
+        await clients.close_clients()
+        await db.close_db()
+
+
+async def main() -> int:
+    fakes = FakeUpstreams(chat_latency=0.05, chat_latency_per_1k_tokens=0.2)
+    await fakes.start()
+    # До імпорту ai/summarize/clients: вони читають конфіг під час імпорту
+    os.environ.update({
+        "OPENAI_BASE_URL": fakes.openai_url,
+        "OPENAI_API_KEY": "sk-bench",
+        "DB_PATH": os.path.join(tempfile.mkdtemp(prefix="voicebot-chunking-"), "notes.db"),
+        "ANALYZE_CHUNK_TOKENS": str(BUDGET),
+        "LOG_SKIP_EVENTS": os.getenv("LOG_SKIP_EVENTS", "*"),
+    })
+    failures: list = []
+    try:
+        check_chunks(failures)
+        await check_map_reduce(failures, fakes)
+    finally:
+        await fakes.stop()
+    for f in failures:
+        print(f"FAIL: {f}")
+    print(f"{len(failures)} failures")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))
@@ -0,0 +1,32 @@
+"""
+Регресійна перевірка планів запитів: накатує міграції на порожню БД і падає (exit 1),
+якщо будь-який продакшн-запит із db.QUERY_PLANS робить недозволений повний прохід.
+
+    python bench/check_query_plans.py
+"""
+import os
+import sys
+import asyncio
+import tempfile
+
+import aiosqlite
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import db  # noqa: E402
+
+
+async def main() -> int:
+    with tempfile.TemporaryDirectory() as tmp:
+        async with aiosqlite.connect(os.path.join(tmp, "plans.db")) as conn:
+            await db.migrate(conn)
+            await conn.execute("ANALYZE")
+            bad = await db.explain_full_scans(conn)
+    for name, detail in bad:
+        print(f"FULL SCAN: {name}: {detail}")
+    print(f"checked {len(db.QUERY_PLANS)} queries, {len(bad)} full scans")
+    return 1 if bad else 0
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))
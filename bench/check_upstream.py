@@ -0,0 +1,283 @@
+"""
+Детермінована перевірка upstream.call (повтори, circuit breaker, хеджування) на httpx.MockTransport,
+без мережі й фейкових серверів; exit 1 при порушенні.
+
+1. Retry-After: 429/503 з Retry-After — пауза не менша за заголовок, потім успіх.
+2. Breaker: BREAKER_FAILURES мережевих збоїв поспіль — open, далі CircuitOpen без звернення до апстріму;
+   half-open пропускає одну пробу: успіх закриває, збій знову відкриває.
+3. Проба без результату (скасування, не-транспортний виняток, 429) не лишає breaker у half-open назавжди.
+4. httpx.PoolTimeout (черга на локальний пул) не рахується збоєм апстріму.
+5. Хедж: повільний перший запит — виграє другий (hedge_won); швидкий — хеджу немає;
+   поріг множиться на cost, тож «дорогий» запит не хеджується лише через свою довжину.
+
+    python bench/check_upstream.py
+"""
+import os
+import sys
+import time
+import json
+import asyncio
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))
+
+# До імпорту upstream: він читає конфіг під час імпорту
+os.environ.update({
+    "UPSTREAM_BACKOFF_BASE": "0.01",
+    "BREAKER_FAILURES": "3",
+    "BREAKER_RESET_S": "30",
+    "HEDGE_MIN_SAMPLES": "5",
+    "HEDGE_MIN_DELAY": "0.05",
+    "LOG_SKIP_EVENTS": os.getenv("LOG_SKIP_EVENTS", "*"),
+})
+
+import httpx  # noqa: E402
+
+import upstream  # noqa: E402
+from upstream import CircuitOpen, BREAKER_FAILURES  # noqa: E402
+
+
+class Script:
+    """Апстрім за сценарієм: кожен запит бере наступний крок (відповідь, виняток або корутину)."""
+
+    def __init__(self, *steps):
+        self.steps = list(steps)
+        self.calls = 0
+
+    async def handler(self, request: httpx.Request) -> httpx.Response:
+        step = self.steps[min(self.calls, len(self.steps) - 1)]
+        self.calls += 1
+        if isinstance(step, BaseException):
+            raise step
+        if callable(step):
+            return await step(request)
+        status, headers = step if isinstance(step, tuple) else (step, {})
+        return httpx.Response(status, headers=headers, json={"ok": True})
+
+    def client(self) -> httpx.AsyncClient:
+        return httpx.AsyncClient(transport=httpx.MockTransport(self.handler), base_url="http://upstream")
+
+
+def fresh(endpoint: str) -> upstream.CircuitBreaker:
+    upstream._breakers.pop(endpoint, None)
+    upstream._latency.pop(endpoint, None)
+    return upstream.breaker(endpoint)
+
+
+def to_half_open(br: upstream.CircuitBreaker):
+    br.failures = br.threshold
+    br.opened_at = time.monotonic() - br.reset_s
+
+
+def check(failures: list, name: str, ok: bool, **info):
+    print(json.dumps({"check": name, "ok": ok, **info}, ensure_ascii=False))
+    if not ok:
+        failures.append(f"{name}: {info}")
+
+
+async def check_retry_after(failures: list):
+    for status in (429, 503):
+        fresh("retry")
+        script = Script((status, {"Retry-After": "0.3"}), 200)
+        async with script.client() as c:
+            t = time.perf_counter()
+            r = await upstream.call("retry", lambda: c.get("/"))
+            waited = time.perf_counter() - t
+        check(failures, f"retry_after_{status}", r.status_code == 200 and script.calls == 2 and waited >= 0.3,
+              calls=script.calls, waited_s=round(waited, 3), breaker=upstream.breaker("retry").state)
+        if status == 429:
+            # 429 — ліміт, а не збій апстріму
+            check(failures, "retry_after_429_no_failure", upstream.breaker("retry").failures == 0)
+
+
+async def check_breaker(failures: list):
+    br = fresh("br")
+    script = Script(httpx.ConnectError("refused"))
+    async with script.client() as c:
+        for _ in range(BREAKER_FAILURES):
+            try:
+                await upstream.call("br", lambda: c.get("/"), retries=0)
+            except httpx.ConnectError:
+                pass
+        opened = br.state
+        calls = script.calls
+        try:
+            await upstream.call("br", lambda: c.get("/"), retries=0)
+            fast_fail = False
+        except CircuitOpen:
+            fast_fail = script.calls == calls
+    check(failures, "breaker_opens", opened == "open" and fast_fail, state=opened, upstream_calls=script.calls)
+
+    # half-open: успішна проба закриває
+    to_half_open(br)
+    script = Script(200)
+    async with script.client() as c:
+        r = await upstream.call("br", lambda: c.get("/"), retries=0)
+    check(failures, "half_open_success", r.status_code == 200 and br.state == "closed" and br.failures == 0,
+          state=br.state)
+
+    # half-open: невдала проба знову відкриває одразу (без накопичення BREAKER_FAILURES)
+    to_half_open(br)
+    script = Script(httpx.ReadTimeout("slow"))
+    async with script.client() as c:
+        try:
+            await upstream.call("br", lambda: c.get("/"), retries=0)
+        except httpx.ReadTimeout:
+            pass
+    check(failures, "half_open_failure", br.state == "open", state=br.state)
+
+    # half-open: поки триває проба, інші виклики відсікаються
+    to_half_open(br)
+    gate = asyncio.Event()
+
+    async def held(request):
+        await gate.wait()
+        return httpx.Response(200)
+
+    script = Script(held)
+    async with script.client() as c:
+        probe = asyncio.create_task(upstream.call("br", lambda: c.get("/"), retries=0))
+        await asyncio.sleep(0.01)
+        try:
+            await upstream.call("br", lambda: c.get("/"), retries=0)
+            second_blocked = False
+        except CircuitOpen:
+            second_blocked = True
+        gate.set()
+        await probe
+    check(failures, "half_open_single_probe", second_blocked and br.state == "closed", state=br.state)
+
+
+async def check_probe_release(failures: list):
+    never = asyncio.Event()
+
+    async def hang(request):
+        await never.wait()
+        return httpx.Response(200)
+
+    # Скасована проба (напр. таймаут обробника вище)
+    br = fresh("probe")
+    to_half_open(br)
+    script = Script(hang, 200)
+    async with script.client() as c:
+        task = asyncio.create_task(upstream.call("probe", lambda: c.get("/"), retries=0))
+        await asyncio.sleep(0.01)
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+        try:
+            r = await upstream.call("probe", lambda: c.get("/"), retries=0)
+        except CircuitOpen:
+            r = None
+    check(failures, "cancelled_probe_released", r is not None and br.state == "closed", state=br.state)
+
+    # Проба з не-транспортним RequestError (напр. зіпсоване стиснення відповіді)
+    for name, step in (("decoding_error", httpx.DecodingError("bad gzip")), ("rate_limited", (429, {}))):
+        br = fresh("probe")
+        to_half_open(br)
+        script = Script(step, 200)
+        async with script.client() as c:
+            try:
+                await upstream.call("probe", lambda: c.get("/"), retries=0)
+            except httpx.DecodingError:
+                pass
+            try:
+                r = await upstream.call("probe", lambda: c.get("/"), retries=0)
+            except CircuitOpen:
+                r = None
+        check(failures, f"{name}_probe_released", r is not None and br.state == "closed", state=br.state)
+
+
+async def check_pool_timeout(failures: list):
+    br = fresh("pool")
+    script = Script(httpx.PoolTimeout("pool exhausted"))
+    async with script.client() as c:
+        for _ in range(BREAKER_FAILURES * 2):
+            try:
+                await upstream.call("pool", lambda: c.get("/"), retries=1)
+            except (httpx.PoolTimeout, CircuitOpen):
+                pass
+    check(failures, "pool_timeout_not_failure", br.state == "closed" and br.failures == 0,
+          state=br.state, breaker_failures=br.failures, calls=script.calls)
+
+    # PoolTimeout під час half-open проби звільняє її
+    to_half_open(br)
+    script = Script(httpx.PoolTimeout("pool exhausted"), 200)
+    async with script.client() as c:
+        try:
+            await upstream.call("pool", lambda: c.get("/"), retries=0)
+        except httpx.PoolTimeout:
+            pass
+        r = await upstream.call("pool", lambda: c.get("/"), retries=0)
+    check(failures, "pool_timeout_probe_released", r.status_code == 200 and br.state == "closed", state=br.state)
+
+
+async def check_hedge(failures: list):
+    def warm(endpoint: str, seconds: float):
+        fresh(endpoint)
+        for _ in range(upstream.HEDGE_MIN_SAMPLES):
+            upstream.latency(endpoint).add(seconds)
+
+    def delayed(seconds: float, tag: str):
+        async def respond(request):
+            await asyncio.sleep(seconds)
+            return httpx.Response(200, json={"from": tag})
+        return respond
+
+    # Повільний перший — виграє хедж
+    warm("hedge", 0.02)
+    before = dict(upstream.hedge_stats)
+    script = Script(delayed(2.0, "first"), delayed(0.01, "second"))
+    async with script.client() as c:
+        t = time.perf_counter()
+        r = await upstream.call("hedge", lambda: c.get("/"), hedge=True)
+        took = time.perf_counter() - t
+    won = upstream.hedge_stats["hedge_won"] - before["hedge_won"]
+    check(failures, "hedge_second_wins", r.json()["from"] == "second" and won == 1 and took < 1.0,
+          took_s=round(took, 3), calls=script.calls, hedge_won=won)
+
+    # Хедж відправлено, але перший усе одно встиг першим — hedge_won не росте
+    warm("hedge", 0.02)
+    before = dict(upstream.hedge_stats)
+    script = Script(delayed(0.1, "first"), delayed(1.0, "second"))
+    async with script.client() as c:
+        r = await upstream.call("hedge", lambda: c.get("/"), hedge=True)
+    check(failures, "hedge_first_wins",
+          r.json()["from"] == "first" and upstream.hedge_stats["hedged"] - before["hedged"] == 1
+          and upstream.hedge_stats["hedge_won"] == before["hedge_won"], calls=script.calls)
+
+    # Швидкий перший — другого запиту немає
+    warm("hedge", 0.02)
+    before = dict(upstream.hedge_stats)
+    script = Script(delayed(0.01, "first"))
+    async with script.client() as c:
+        await upstream.call("hedge", lambda: c.get("/"), hedge=True)
+    check(failures, "no_hedge_when_fast", script.calls == 1 and upstream.hedge_stats["hedged"] == before["hedged"],
+          calls=script.calls)
+
+    # Поріг на одиницю cost: 0.02 с/од. * 20 од. = 0.4 с — запит у 0.2 с не хеджується
+    warm("hedge", 0.02)
+    script = Script(delayed(0.2, "first"), delayed(0.01, "second"))
+    async with script.client() as c:
+        r = await upstream.call("hedge", lambda: c.get("/"), hedge=True, cost=20)
+    check(failures, "hedge_threshold_scales_with_cost", script.calls == 1 and r.json()["from"] == "first",
+          calls=script.calls)
+
+
+async def main() -> int:
+    failures: list = []
+    await check_retry_after(failures)
+    await check_breaker(failures)
+    await check_probe_release(failures)
+    await check_pool_timeout(failures)
+    await check_hedge(failures)
+    for f in failures:
+        print(f"FAIL: {f}")
+    print(f"{len(failures)} failures")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))
@@ -0,0 +1,196 @@
+"""
+Локальні фейкові Telegram Bot API і OpenAI для бенчмарків і навантажувальних тестів.
+Затримки й помилки керовані й відтворювані (seed), мережа назовні не потрібна.
+tls=True — HTTPS із самопідписаним сертифікатом (openssl), щоб рукостискання коштували як у житті;
+клієнтам httpx достатньо SSL_CERT_FILE=srv.cert_file.
+
+    srv = FakeUpstreams(openai_latency=0.3, error_rate=0.05, seed=1)
+    await srv.start()   # srv.telegram_url, srv.openai_url
+    ...
+    await srv.stop()
+"""
+import os
+import ssl
+import json
+import time
+import random
+import asyncio
+import tempfile
+import subprocess
+from collections import Counter
+from typing import Optional
+
+from aiohttp import web
+
+
+class FakeUpstreams:
+    def __init__(
+        self,
+        telegram_latency: float = 0.02,
+        openai_latency: float = 0.3,
+        chat_latency: float = 0.8,
+        chat_latency_per_1k_tokens: float = 0.0,
+        error_rate: float = 0.0,
+        rate_limit_rate: float = 0.0,
+        tg_flood_rate: float = 0.0,
+        voice_bytes: int = 30_000,
+        seed: int = 0,
+        tls: bool = False,
+    ):
+        self.telegram_latency = telegram_latency
+        self.openai_latency = openai_latency
+        self.chat_latency = chat_latency
+        # Як у реальної моделі: довший промпт — довша відповідь (токени ~ символи / 3)
+        self.chat_latency_per_1k_tokens = chat_latency_per_1k_tokens
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.tg_flood_rate = tg_flood_rate
+        self.voice_bytes = voice_bytes
+        self.tls = tls
+        self.cert_file = ""
+        self._ssl: Optional[ssl.SSLContext] = None
+        self._rng = random.Random(seed)
+        self.calls: Counter = Counter()
+        self.sent_messages = []
+        self.sent_times = []      # time.perf_counter() кожного sent_messages[i]
+        self.chat_prompt_chars = []   # довжина user-промпту кожного chat/completions
+        self._runners = []
+        self.telegram_url = ""
+        self.openai_url = ""
+        self._msg_id = 0
+        self.webhook = {"url": "", "allowed_updates": []}
+
+    # ----- керування -----
+    def _make_cert(self):
+        tmp = tempfile.mkdtemp(prefix="fake-upstreams-tls-")
+        self.cert_file = os.path.join(tmp, "cert.pem")
+        key_file = os.path.join(tmp, "key.pem")
+        subprocess.run([
+            "openssl", "req", "-x509", "-newkey", "rsa:2048", "-nodes", "-days", "1",
+            "-subj", "/CN=127.0.0.1", "-addext", "subjectAltName=IP:127.0.0.1",
+            "-keyout", key_file, "-out", self.cert_file,
+        ], check=True, capture_output=True)
+        self._ssl = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
+        self._ssl.load_cert_chain(self.cert_file, key_file)
+
+    async def start(self):
+        if self.tls:
+            self._make_cert()
+        tg = web.Application(client_max_size=64 * 1024 * 1024)
+        tg.router.add_get("/file/bot{token}/{path:.*}", self._tg_file)
+        tg.router.add_route("*", "/bot{token}/{method}", self._tg_method)
+        oa = web.Application(client_max_size=64 * 1024 * 1024)
+        oa.router.add_post("/v1/audio/transcriptions", self._oa_transcribe)
+        oa.router.add_post("/v1/chat/completions", self._oa_chat)
+        self.telegram_url = await self._serve(tg)
+        self.openai_url = await self._serve(oa) + "/v1"
+
+    async def _serve(self, app: web.Application) -> str:
+        runner = web.AppRunner(app, access_log=None)
+        await runner.setup()
+        site = web.TCPSite(runner, "127.0.0.1", 0, ssl_context=self._ssl)
+        await site.start()
+        self._runners.append(runner)
+        port = site._server.sockets[0].getsockname()[1]
+        return f"{'https' if self.tls else 'http'}://127.0.0.1:{port}"
+
+    async def stop(self):
+        for r in self._runners:
+            await r.cleanup()
+        self._runners.clear()
+
+    # ----- інжекція збоїв -----
+    def _fault(self):
+        x = self._rng.random()
+        if x < self.rate_limit_rate:
+            return web.json_response({"error": {"message": "rate limited"}}, status=429,
+                                     headers={"Retry-After": "1"})
+        if x < self.rate_limit_rate + self.error_rate:
+            return web.json_response({"error": {"message": "injected"}}, status=503)
+        return None
+
+    # ----- Telegram -----
+    async def _tg_file(self, request: web.Request):
+        self.calls["tg_file"] += 1
+        await asyncio.sleep(self.telegram_latency)
+        return web.Response(body=b"\0" * self.voice_bytes, content_type="application/octet-stream")
+
+    async def _tg_method(self, request: web.Request):
+        method = request.match_info["method"]
+        self.calls[f"tg_{method}"] += 1
+        await asyncio.sleep(self.telegram_latency)
+        if request.method == "GET":
+            params = dict(request.query)
+        elif request.content_type == "application/json":
+            params = await request.json()
+        else:
+            params = dict(await request.post())
+        if method == "getFile":
+            file_id = params.get("file_id", "f")
+            return web.json_response({"ok": True, "result": {
+                "file_id": file_id, "file_unique_id": f"u-{file_id}",
+                "file_size": self.voice_bytes, "file_path": f"voice/{file_id}.oga",
+            }})
+        if method == "getWebhookInfo":
+            return web.json_response({"ok": True, "result": dict(self.webhook, pending_update_count=0)})
+        if method == "setWebhook":
+            self.webhook = {"url": params.get("url", ""), "allowed_updates": params.get("allowed_updates") or []}
+            return web.json_response({"ok": True, "result": True})
+        if method in ("sendMessage", "editMessageText", "sendDocument"):
+            if self._rng.random() < self.tg_flood_rate:
+                self.calls["tg_429"] += 1
+                return web.json_response({
+                    "ok": False, "error_code": 429, "description": "Too Many Requests: retry after 1",
+                    "parameters": {"retry_after": 1},
+                }, status=429)
+            if method == "sendMessage" and len(params.get("text", "")) > 4096:
+                return web.json_response({
+                    "ok": False, "error_code": 400, "description": "Bad Request: message is too long",
+                }, status=400)
+            self._msg_id += 1
+            chat_id = int(params.get("chat_id", 0) or 0)
+            text = params.get("text") or params.get("caption") or ""
+            self.sent_messages.append((chat_id, method, text))
+            self.sent_times.append(time.perf_counter())
+            return web.json_response({"ok": True, "result": {
+                "message_id": self._msg_id, "date": int(time.time()),
+                "chat": {"id": chat_id, "type": "group", "title": "bench"},
+                "text": text,
+            }})
+        return web.json_response({"ok": True, "result": True})
+
+    # ----- OpenAI -----
+    async def _oa_transcribe(self, request: web.Request):
+        self.calls["oa_transcribe"] += 1
+        reader = await request.multipart()
+        size = 0
+        async for part in reader:
+            while True:
+                chunk = await part.read_chunk()
+                if not chunk:
+                    break
+                size += len(chunk)
+        await asyncio.sleep(self.openai_latency)
+        fault = self._fault()
+        if fault is not None:
+            return fault
+        return web.json_response({"text": f"Тестова нотатка ({size} байт): зробити звіт до завтра."})
+
+    async def _oa_chat(self, request: web.Request):
+        self.calls["oa_chat"] += 1
+        body = await request.json()
+        prompt = body["messages"][-1]["content"]
+        self.chat_prompt_chars.append(len(prompt))
+        await asyncio.sleep(self.chat_latency + len(prompt) / 3 / 1000 * self.chat_latency_per_1k_tokens)
+        fault = self._fault()
+        if fault is not None:
+            return fault
+        content = json.dumps({
+            "events": [f"подія {len(prompt)}"],
+            "tasks": [{"title": "Зробити звіт", "due": None, "owner": "", "priority": "med"}],
+            "risks": [], "ideas": [], "quotes": [],
+        }, ensure_ascii=False)
+        return web.json_response({
+            "choices": [{"message": {"role": "assistant", "content": content}}],
+            "usage": {"prompt_tokens": len(prompt) // 3, "completion_tokens": len(content) // 3},
+        })
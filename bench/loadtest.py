@@ -0,0 +1,242 @@
+"""
+Офлайн навантажувальний тест бота: фейкові Telegram і OpenAI (bench/fake_upstreams.py),
+синтетичні потоки вебхук-апдейтів у telegram_webhook через ASGI, звіт у stdout.
+
+Сценарії:
+  voice   — сплеск голосових від багатьох користувачів
+  button  — шторм натискань «Сформувати звіт» в одному чаті
+  daily   — 20:00 зведення (build_and_send_summary_all) по тисячах користувачів
+
+    python bench/loadtest.py --scenario all --voices 300 --clicks 100 --users 2000
+    python bench/loadtest.py --scenario voice --error-rate 0.05 --openai-latency 0.5
+"""
+import os
+import sys
+import time
+import json
+import asyncio
+import argparse
+import resource
+import tempfile
+
+import httpx
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))
+sys.path.insert(0, HERE)
+
+from fake_upstreams import FakeUpstreams  # noqa: E402
+
+WEBHOOK_SECRET = "bench-secret"
+CHAT_ID = -100500
+GROUP_ID = -100777
+
+
+def pct(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * q))] if values else 0.0
+
+
+def peak_rss_mb() -> float:
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def db_size_mb(path: str) -> float:
+    total = 0
+    for suffix in ("", "-wal", "-shm"):
+        if os.path.exists(path + suffix):
+            total += os.path.getsize(path + suffix)
+    return total / (1024 * 1024)
+
+
+def voice_update(update_id: int, user_id: int, chat_id: int = CHAT_ID) -> dict:
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "group", "title": "bench"},
+            "from": {"id": user_id, "is_bot": False, "first_name": f"U{user_id}"},
+            "voice": {
+                "file_id": f"file-{update_id}",
+                "file_unique_id": f"uniq-{update_id}",
+                "duration": 12,
+                "mime_type": "audio/ogg",
+                "file_size": 30_000,
+            },
+        },
+    }
+
+
+def button_update(update_id: int, user_id: int, chat_id: int = CHAT_ID) -> dict:
+    return {
+        "update_id": update_id,
+        "callback_query": {
+            "id": str(update_id),
+            "chat_instance": "bench",
+            "data": "make_summary",
+            "from": {"id": user_id, "is_bot": False, "first_name": f"U{user_id}"},
+            "message": {
+                "message_id": 1,
+                "date": int(time.time()),
+                "chat": {"id": chat_id, "type": "group", "title": "bench"},
+                "text": "✅ Транскрибовано",
+            },
+        },
+    }
+
+
+class Harness:
+    def __init__(self, main):
+        self.main = main
+        self.submitted = {}
+        self.finished = {}
+        inner = main.ingest._handler
+
+        async def timed_handler(update):
+            try:
+                await inner(update)
+            finally:
+                self.finished[update.update_id] = time.perf_counter()
+
+        main.ingest._handler = timed_handler
+        self.client = httpx.AsyncClient(
+            transport=httpx.ASGITransport(app=main.app), base_url="http://bot", timeout=60
+        )
+
+    async def post(self, update: dict) -> float:
+        t = time.perf_counter()
+        self.submitted[update["update_id"]] = t
+        r = await self.client.post(f"/{WEBHOOK_SECRET}", json=update)
+        r.raise_for_status()
+        return time.perf_counter() - t
+
+    async def replay(self, updates, rate: float):
+        """Подати апдейти з заданою частотою (0 — без пауз) і дочекатися обробки."""
+        acks = []
+        interval = 1.0 / rate if rate > 0 else 0
+        start = time.perf_counter()
+        for u in updates:
+            acks.append(await self.post(u))
+            if interval:
+                await asyncio.sleep(interval)
+        ids = [u["update_id"] for u in updates]
+        while not all(i in self.finished for i in ids):
+            await asyncio.sleep(0.05)
+        elapsed = time.perf_counter() - start
+        e2e = [self.finished[i] - self.submitted[i] for i in ids]
+        return elapsed, acks, e2e
+
+    async def close(self):
+        await self.client.aclose()
+
+
+def report(name: str, count: int, elapsed: float, acks, e2e, db_path: str, extra=None):
+    row = {
+        "scenario": name,
+        "count": count,
+        "per_sec": round(count / elapsed, 1) if elapsed else None,
+        "ack_p50_ms": round(pct(acks, 0.5) * 1000, 1),
+        "ack_p99_ms": round(pct(acks, 0.99) * 1000, 1),
+        "e2e_p50_s": round(pct(e2e, 0.5), 3),
+        "e2e_p99_s": round(pct(e2e, 0.99), 3),
+        "peak_rss_mb": round(peak_rss_mb(), 1),
+        "sqlite_mb": round(db_size_mb(db_path), 2),
+    }
+    row.update(extra or {})
+    print(json.dumps(row, ensure_ascii=False))
+
+
+async def run(args):
+    fakes = FakeUpstreams(
+        telegram_latency=args.telegram_latency,
+        openai_latency=args.openai_latency,
+        chat_latency=args.chat_latency,
+        error_rate=args.error_rate,
+        rate_limit_rate=args.rate_limit_rate,
+        tg_flood_rate=args.tg_flood_rate,
+        seed=args.seed,
+    )
+    await fakes.start()
+    tmp = tempfile.mkdtemp(prefix="voicebot-bench-")
+    db_path = os.path.join(tmp, "notes.db")
+    os.environ.update({
+        "APP_URL": "http://bench.local",
+        "TG_TOKEN": "123456:bench",
+        "OPENAI_API_KEY": "sk-bench",
+        "GROUP_ID": str(GROUP_ID),
+        "WEBHOOK_SECRET": WEBHOOK_SECRET,
+        "RUN_DAILY": "0",
+        "DB_PATH": db_path,
+        "TELEGRAM_API_URL": fakes.telegram_url,
+        "OPENAI_BASE_URL": fakes.openai_url,
+        "LOG_SKIP_EVENTS": os.getenv("LOG_SKIP_EVENTS", "*"),
+    })
+    import main  # noqa: E402 — після env, бо main читає конфіг під час імпорту
+    import db
+
+    await main.on_startup()
+    h = Harness(main)
+    scenarios = ["voice", "button", "daily"] if args.scenario == "all" else [args.scenario]
+    next_id = 1
+    try:
+        for sc in scenarios:
+            if sc == "voice":
+                ups = [voice_update(next_id + i, 1000 + i % args.speakers) for i in range(args.voices)]
+                next_id += len(ups)
+                elapsed, acks, e2e = await h.replay(ups, args.rate)
+                report("voice", len(ups), elapsed, acks, e2e, db_path,
+                       {"whisper_calls": fakes.calls["oa_transcribe"]})
+            elif sc == "button":
+                ups = [button_update(next_id + i, 1000 + i % args.speakers) for i in range(args.clicks)]
+                next_id += len(ups)
+                before = fakes.calls["oa_chat"]
+                elapsed, acks, e2e = await h.replay(ups, args.rate)
+                report("button", len(ups), elapsed, acks, e2e, db_path,
+                       {"chat_calls": fakes.calls["oa_chat"] - before})
+            elif sc == "daily":
+                now = int(time.time())
+                for u in range(args.users):
+                    for k in range(args.notes_per_user):
+                        await db.add_note(50_000 + u, CHAT_ID - u % 50, f"Нотатка {k} користувача {u}", now)
+                before = fakes.calls["oa_chat"]
+                first_msg = len(fakes.sent_messages)
+                t = time.perf_counter()
+                await main.build_and_send_summary_all(GROUP_ID)
+                elapsed = time.perf_counter() - t
+                sent = [(m, ts) for m, ts in zip(fakes.sent_messages[first_msg:], fakes.sent_times[first_msg:])
+                        if m[0] == GROUP_ID]
+                report("daily", args.users, elapsed, [], [elapsed], db_path,
+                       {"chat_calls": fakes.calls["oa_chat"] - before,
+                        "messages": sum(1 for m, _ in sent if m[1] == "sendMessage"),
+                        "documents": sum(1 for m, _ in sent if m[1] == "sendDocument"),
+                        "first_message_s": round(sent[0][1] - t, 3) if sent else None,
+                        "tg_429": fakes.calls["tg_429"]})
+    finally:
+        await h.close()
+        await main.on_shutdown()
+        await main.bot.session.close()
+        await fakes.stop()
+
+
+def main_cli():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--scenario", choices=["voice", "button", "daily", "all"], default="all")
+    ap.add_argument("--voices", type=int, default=200)
+    ap.add_argument("--clicks", type=int, default=50)
+    ap.add_argument("--users", type=int, default=1000)
+    ap.add_argument("--notes-per-user", type=int, default=3)
+    ap.add_argument("--speakers", type=int, default=50)
+    ap.add_argument("--rate", type=float, default=0, help="апдейтів/с (0 — якнайшвидше)")
+    ap.add_argument("--telegram-latency", type=float, default=0.02)
+    ap.add_argument("--openai-latency", type=float, default=0.3)
+    ap.add_argument("--chat-latency", type=float, default=0.8)
+    ap.add_argument("--error-rate", type=float, default=0.0)
+    ap.add_argument("--rate-limit-rate", type=float, default=0.0)
+    ap.add_argument("--tg-flood-rate", type=float, default=0.0, help="частка sendMessage з відповіддю 429")
+    ap.add_argument("--seed", type=int, default=0)
+    asyncio.run(run(ap.parse_args()))
+
+
+if __name__ == "__main__":
+    main_cli()
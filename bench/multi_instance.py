@@ -0,0 +1,195 @@
+"""
+Локальна перевірка режиму кількох інстансів: два процеси бота (uvicorn) на одній БД
+(спільний DB_PATH або DB_URL), фейкові Telegram/OpenAI з bench/fake_upstreams.py.
+
+  * вебхуки розкидаються по інстансах по колу, частина доставляється повторно на ІНШИЙ інстанс
+    (ретрай Telegram за балансувальником) — нотаток має бути рівно стільки, скільки унікальних апдейтів;
+  * обидва інстанси одночасно запускають run_daily_job для кількох «днів» —
+    у GROUP_ID має піти рівно один звіт на день.
+
+    python bench/multi_instance.py --updates 200 --days 3
+    DB_URL=postgresql://localhost/voicebot python bench/multi_instance.py
+
+Код виходу 1, якщо звітів не рівно по одному на день або є дублікати нотаток.
+"""
+import os
+import sys
+import json
+import time
+import signal
+import asyncio
+import argparse
+import sqlite3
+import tempfile
+
+import httpx
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(HERE)
+sys.path.insert(0, ROOT)
+sys.path.insert(0, HERE)
+
+from loadtest import voice_update, GROUP_ID, WEBHOOK_SECRET  # noqa: E402
+
+REPORT_HEADER = "🧾"
+
+
+# ===== дочірній процес: один інстанс бота =====
+async def child(args):
+    import uvicorn
+    import main
+
+    async def fire():
+        # Обидва інстанси «прокидаються о 20:00» в один момент: батько пише час у fire-файл,
+        # коли всі інстанси піднялися
+        while not (server.started and os.path.exists(args.fire_file)):
+            await asyncio.sleep(0.1)
+        with open(args.fire_file) as f:
+            fire_at = float(f.read())
+        await asyncio.sleep(max(0.0, fire_at - time.time()))
+        for d in range(args.days):
+            day = f"2030-01-{d + 1:02d}"
+            results = await asyncio.gather(*(main.run_daily_job(day) for _ in range(args.attempts)),
+                                           return_exceptions=True)
+            for r in results:
+                if isinstance(r, BaseException):
+                    print(f"[{args.port}] run_daily_job({day}): {r!r}", file=sys.stderr)
+
+    server = uvicorn.Server(uvicorn.Config(main.app, host="127.0.0.1", port=args.port, log_level="warning"))
+    task = asyncio.create_task(fire())
+    await server.serve()
+    task.cancel()
+
+
+# ===== батьківський процес =====
+async def wait_ready(client: httpx.AsyncClient, url: str, timeout: float = 30):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            if (await client.get(f"{url}/healthz")).status_code == 200:
+                return
+        except httpx.HTTPError:
+            pass
+        await asyncio.sleep(0.2)
+    raise RuntimeError(f"інстанс {url} не піднявся")
+
+
+def sent_days(db_path: str) -> int:
+    conn = sqlite3.connect(db_path)
+    try:
+        return conn.execute("SELECT COUNT(*) FROM report_log WHERE status='sent'").fetchone()[0]
+    except sqlite3.OperationalError:
+        return 0
+    finally:
+        conn.close()
+
+
+async def parent(args):
+    from fake_upstreams import FakeUpstreams
+
+    fakes = FakeUpstreams(openai_latency=args.openai_latency, chat_latency=args.chat_latency, seed=args.seed)
+    await fakes.start()
+    tmp = tempfile.mkdtemp(prefix="voicebot-multi-")
+    db_path = os.path.join(tmp, "notes.db")
+    env = dict(
+        os.environ,
+        APP_URL="http://bench.local", TG_TOKEN="123456:bench", OPENAI_API_KEY="sk-bench",
+        GROUP_ID=str(GROUP_ID), WEBHOOK_SECRET=WEBHOOK_SECRET, RUN_DAILY="0",
+        DB_PATH=db_path, TELEGRAM_API_URL=fakes.telegram_url, OPENAI_BASE_URL=fakes.openai_url,
+        INGEST_SHARED_DEDUPE="1", LOG_SKIP_EVENTS=os.getenv("LOG_SKIP_EVENTS", "*"),
+    )
+    fire_file = os.path.join(tmp, "fire_at")
+    ports = [args.base_port + i for i in range(args.instances)]
+    procs = []
+    for i, port in enumerate(ports):
+        procs.append(await asyncio.create_subprocess_exec(
+            sys.executable, os.path.abspath(__file__), "--child", "--port", str(port),
+            "--fire-file", fire_file, "--days", str(args.days), "--attempts", str(args.attempts),
+            env=dict(env, INSTANCE_ID=f"bench-{i}"), cwd=ROOT,
+        ))
+    urls = [f"http://127.0.0.1:{p}" for p in ports]
+    ok = False
+    try:
+        async with httpx.AsyncClient(timeout=30) as client:
+            await asyncio.gather(*(wait_ready(client, u) for u in urls))
+            fire_at = time.time() + args.fire_after
+            with open(fire_file + ".tmp", "w") as f:
+                f.write(str(fire_at))
+            os.replace(fire_file + ".tmp", fire_file)
+
+            # Вебхуки: по колу + кожен redeliver-ний апдейт ще раз на сусідній інстанс
+            posts = []
+            for n in range(args.updates):
+                u = voice_update(n + 1, 1000 + n % 50)
+                posts.append((urls[n % len(urls)], u))
+                if n % args.redeliver_every == 0:
+                    posts.append((urls[(n + 1) % len(urls)], u))
+            await asyncio.gather(*(client.post(f"{url}/{WEBHOOK_SECRET}", json=u) for url, u in posts))
+
+            # Чекаємо, поки все оброблено і щоденні задачі відпрацювали
+            deadline = time.time() + args.timeout
+            while time.time() < deadline:
+                stats = [(await client.get(f"{u}/healthz")).json()["queue"] for u in urls]
+                if sum(s["processed"] + s["failed"] for s in stats) >= len(posts) and time.time() > fire_at + 1 \
+                        and (os.getenv("DB_URL") or sent_days(db_path) >= args.days):
+                    break
+                await asyncio.sleep(0.5)
+            await asyncio.sleep(args.settle)
+
+        reports = sum(1 for c, _, t in fakes.sent_messages if c == GROUP_ID and t.startswith(REPORT_HEADER))
+        row = {
+            "instances": len(urls),
+            "updates": args.updates,
+            "deliveries": len(posts),
+            "per_instance_processed": [s["processed"] for s in stats],
+            "days": args.days,
+            "reports_sent": reports,
+            "set_webhook_calls": fakes.calls["tg_setWebhook"],
+        }
+        if not os.getenv("DB_URL"):
+            conn = sqlite3.connect(db_path)
+            row["notes"] = conn.execute("SELECT COUNT(*) FROM notes").fetchone()[0]
+            row["report_log"] = conn.execute(
+                "SELECT day, status FROM report_log ORDER BY day").fetchall()
+            conn.close()
+            ok = row["notes"] == args.updates
+        else:
+            ok = True
+        ok = ok and reports == args.days
+        row["ok"] = ok
+        print(json.dumps(row, ensure_ascii=False))
+    finally:
+        for p in procs:
+            if p.returncode is None:
+                p.send_signal(signal.SIGTERM)
+        await asyncio.gather(*(p.wait() for p in procs))
+        await fakes.stop()
+    return ok
+
+
+def main_cli():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    ap.add_argument("--port", type=int, default=0, help=argparse.SUPPRESS)
+    ap.add_argument("--fire-file", default="", help=argparse.SUPPRESS)
+    ap.add_argument("--instances", type=int, default=2)
+    ap.add_argument("--base-port", type=int, default=18080)
+    ap.add_argument("--updates", type=int, default=200)
+    ap.add_argument("--redeliver-every", type=int, default=5, help="кожен N-й апдейт доставити ще й сусіду")
+    ap.add_argument("--days", type=int, default=3)
+    ap.add_argument("--attempts", type=int, default=2, help="скільки разів кожен інстанс запускає задачу дня")
+    ap.add_argument("--fire-after", type=float, default=2.0, help="через скільки секунд після старту «настає 20:00»")
+    ap.add_argument("--openai-latency", type=float, default=0.05)
+    ap.add_argument("--chat-latency", type=float, default=0.05)
+    ap.add_argument("--settle", type=float, default=3.0)
+    ap.add_argument("--timeout", type=float, default=120.0)
+    ap.add_argument("--seed", type=int, default=0)
+    args = ap.parse_args()
+    if args.child:
+        asyncio.run(child(args))
+        return
+    sys.exit(0 if asyncio.run(parent(args)) else 1)
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,66 @@
+import os
+import httpx
+from typing import Optional
+
+# Спільні HTTP-клієнти на весь застосунок: по одному на апстрім (keep-alive пул, HTTP/2 якщо є h2).
+# Створюються в on_startup, закриваються в on_shutdown.
+
+# Базові URL апстрімів (перевизначаються для локальних фейкових серверів у bench/)
+OPENAI_BASE_URL  = os.getenv("OPENAI_BASE_URL", "https://api.openai.com/v1").rstrip("/")
+TELEGRAM_API_URL = os.getenv("TELEGRAM_API_URL", "https://api.telegram.org").rstrip("/")
+
+CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", "5"))
+# Скільки чекати вільне з'єднання з пулу; 0 — без ліміту. Зайнятість пулу — це локальна черга, а не збій
+# апстріму: з'єднання звільняються не пізніше за read-таймаут (90 с для OpenAI), тож коротке очікування
+# тут лише перетворює чергу на PoolTimeout.
+POOL_TIMEOUT    = float(os.getenv("HTTP_POOL_TIMEOUT", "0")) or None
+
+OPENAI_READ_TIMEOUT    = float(os.getenv("OPENAI_READ_TIMEOUT", "90"))
+OPENAI_MAX_CONNECTIONS = int(os.getenv("OPENAI_MAX_CONNECTIONS", "20"))
+
+TELEGRAM_READ_TIMEOUT    = float(os.getenv("TELEGRAM_READ_TIMEOUT", "30"))
+TELEGRAM_MAX_CONNECTIONS = int(os.getenv("TELEGRAM_MAX_CONNECTIONS", "20"))
+
+try:
+    import h2  # noqa: F401
+    HTTP2 = True
+except ImportError:
+    HTTP2 = False
+
+_openai: Optional[httpx.AsyncClient] = None
+_telegram: Optional[httpx.AsyncClient] = None
+
+def _make_client(read_timeout: float, max_connections: int) -> httpx.AsyncClient:
+    return httpx.AsyncClient(
+        http2=HTTP2,
+        timeout=httpx.Timeout(connect=CONNECT_TIMEOUT, read=read_timeout, write=read_timeout, pool=POOL_TIMEOUT),
+        limits=httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_connections,
+            keepalive_expiry=60,
+        ),
+    )
+
+async def start_clients():
+    global _openai, _telegram
+    if _openai is None:
+        _openai = _make_client(OPENAI_READ_TIMEOUT, OPENAI_MAX_CONNECTIONS)
+    if _telegram is None:
+        _telegram = _make_client(TELEGRAM_READ_TIMEOUT, TELEGRAM_MAX_CONNECTIONS)
+
+async def close_clients():
+    global _openai, _telegram
+    for c in (_openai, _telegram):
+        if c is not None:
+            await c.aclose()
+    _openai = _telegram = None
+
+def openai_client() -> httpx.AsyncClient:
+    if _openai is None:
+        raise RuntimeError("HTTP-клієнти не ініціалізовані: виклич start_clients()")
+    return _openai
+
+def telegram_client() -> httpx.AsyncClient:
+    if _telegram is None:
+        raise RuntimeError("HTTP-клієнти не ініціалізовані: виклич start_clients()")
+    return _telegram
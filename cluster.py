@@ -0,0 +1,103 @@
+import os
+import time
+import socket
+import secrets
+import asyncio
+from contextlib import asynccontextmanager
+
+import db
+from logs import log
+
+# Кілька інстансів на спільній БД (DB_URL або спільний DB_PATH): ідентичність, оренди, дедуп.
+# FLY_MACHINE_ID — на Fly.io; локально — hostname:pid.
+INSTANCE_ID = os.getenv("INSTANCE_ID") or os.getenv("FLY_MACHINE_ID") or f"{socket.gethostname()}:{os.getpid()}"
+
+LEASE_TTL_S          = int(os.getenv("LEASE_TTL_S", "60"))
+REPORT_STALE_S       = int(os.getenv("REPORT_STALE_S", "1800"))   # через скільки «зависле» sending можна перезаявити
+INGEST_SHARED_DEDUPE = os.getenv("INGEST_SHARED_DEDUPE", "0") == "1"
+UPDATES_SEEN_TTL_S   = int(os.getenv("UPDATES_SEEN_TTL_S", str(24 * 3600)))  # Telegram ретраїть до доби
+
+_claims_since_evict = 0
+
+
+def new_claim() -> str:
+    """Унікальний токен заявки: ідентифікує не лише інстанс, а й конкретну спробу."""
+    return f"{INSTANCE_ID}/{secrets.token_hex(4)}"
+
+
+class Lease:
+    """
+    Оренда з TTL у таблиці leases: лише власник виконує задачу (лідер для name).
+    Поки задача йде, оренда продовжується у фоні кожні ttl/3; якщо продовжити не вдалося —
+    lost=True і лог LEASE_LOST (ідемпотентність самої задачі — окремо, див. report_claim).
+    """
+
+    def __init__(self, name: str, ttl: int = LEASE_TTL_S, holder: str = INSTANCE_ID):
+        self.name = name
+        self.ttl = ttl
+        self.holder = holder
+        self.lost = False
+
+    async def acquire(self) -> bool:
+        return await db.lease_acquire(self.name, self.holder, self.ttl, int(time.time()))
+
+    async def release(self):
+        await db.lease_release(self.name, self.holder)
+
+    async def _renew(self):
+        while True:
+            await asyncio.sleep(max(1, self.ttl / 3))
+            try:
+                ok = await self.acquire()
+            except Exception as e:
+                ok = False
+                log("LEASE_ERROR", lease=self.name, error=str(e))
+            if not ok:
+                self.lost = True
+                log("LEASE_LOST", lease=self.name, holder=self.holder)
+                return
+
+    @asynccontextmanager
+    async def hold(self):
+        """async with lease.hold() as held: ... — held=False, якщо оренда в іншого інстансу."""
+        if not await self.acquire():
+            yield False
+            return
+        renew = asyncio.create_task(self._renew())
+        try:
+            yield True
+        finally:
+            renew.cancel()
+            await asyncio.gather(renew, return_exceptions=True)
+            if not self.lost:
+                await self.release()
+
+
+async def claim_update(update_id: int) -> bool:
+    """Спільний дедуп: True — цей інстанс перший узяв update_id і має його обробити."""
+    global _claims_since_evict
+    now = int(time.time())
+    ok = await db.update_claim(update_id, new_claim(), now)
+    _claims_since_evict += 1
+    if _claims_since_evict >= 500:
+        _claims_since_evict = 0
+        await db.updates_evict(now - UPDATES_SEEN_TTL_S)
+    return ok
+
+
+async def run_once(day: str, chat_id: int, job) -> bool:
+    """
+    Виконати job() для (day, chat_id) рівно раз на всі інстанси: заявка в report_log,
+    після успіху — status=sent; після помилки заявка знімається і виняток летить далі.
+    False — звіт уже відправлено або відправляється іншим інстансом.
+    """
+    claim = new_claim()
+    if not await db.report_claim(day, chat_id, claim, int(time.time()), REPORT_STALE_S):
+        return False
+    try:
+        await job()
+    except BaseException:
+        await db.report_unclaim(day, chat_id, claim)
+        raise
+    await db.report_done(day, chat_id, claim, int(time.time()))
+    return True
@@ -1,79 +1,987 @@
+import os
+import re
+import time
+import asyncio
 import aiosqlite
-from typing import List, Tuple
+from contextlib import asynccontextmanager
+from functools import lru_cache
+from typing import Any, Dict, List, Optional, Sequence, Tuple
 
-DB_PATH = "notes.db"
+from logs import log
+from metrics import DB_QUERY_SECONDS
 
-# Схема: час як UTC epoch (INTEGER)
+DB_PATH = os.getenv("DB_PATH", "notes.db")
+# Спільна БД для кількох інстансів: postgresql://... -> db_pg.PgStore (інакше — локальний SQLite DB_PATH)
+DB_URL  = os.getenv("DB_URL", "")
+
+# Пул читачів і груповий коміт записів
+DB_READ_POOL    = int(os.getenv("DB_READ_POOL", "3"))
+DB_BATCH_MS     = float(os.getenv("DB_BATCH_MS", "5"))      # скільки чекати «попутні» записи перед комітом
+DB_BATCH_MAX    = int(os.getenv("DB_BATCH_MAX", "200"))
+DB_MMAP_SIZE    = int(os.getenv("DB_MMAP_SIZE", str(64 * 1024 * 1024)))
+DB_CACHE_KIB    = int(os.getenv("DB_CACHE_KIB", "16000"))
+
+# Токенізатор повнотекстового індексу notes_fts: unicode61 (слова; з префіксним пошуком по основі)
+# або trigram (пошук підрядків — стійкіший до відмінків, але індекс ~3x більший). Зміна -> перебудова на старті.
+FTS_TOKENIZE = os.getenv("FTS_TOKENIZE", "unicode61 remove_diacritics 2")
+# Префіксні індекси notes_fts (довжини в символах): "основа"* такої довжини читає готовий список замість
+# злиття всіх слів з цією основою. Основи інших довжин search.build_match розгортає в OR точних словоформ.
+# Кожна довжина — ще +40–60% до FTS-індексу (bench/bench_fts.py, 1M нотаток: 83 MB без префіксних індексів,
+# 133 MB з "4", 166 MB з "4 6", 315 MB з "3 4 5 6 7 8"). "" — без префіксних індексів.
+FTS_PREFIX   = os.getenv("FTS_PREFIX", "4 6")
+
+PRAGMAS = [
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    f"PRAGMA mmap_size={DB_MMAP_SIZE}",
+    f"PRAGMA cache_size=-{DB_CACHE_KIB}",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA busy_timeout=5000",
+]
+
+# Схема: час як UTC epoch (INTEGER). Версія схеми — PRAGMA user_version, див. MIGRATIONS нижче.
 CREATE_SQL = """
-PRAGMA journal_mode=WAL;
 CREATE TABLE IF NOT EXISTS notes (
   id INTEGER PRIMARY KEY AUTOINCREMENT,
-  user_id TEXT NOT NULL,
-  chat_id TEXT NOT NULL,
+  user_id INTEGER NOT NULL,
+  chat_id INTEGER NOT NULL,
   text TEXT NOT NULL,
   created_at_epoch INTEGER NOT NULL
 );
 CREATE INDEX IF NOT EXISTS idx_notes_chat_time ON notes(chat_id, created_at_epoch);
 """
 
-async def init_db():
-    async with aiosqlite.connect(DB_PATH) as db:
-        for stmt in CREATE_SQL.strip().split(";"):
-            s = stmt.strip()
-            if s:
-                await db.execute(s)
+# Незмінні тексти запитів — sqlite3 кешує підготовлені statement-и по тексту
+SQL_INSERT_NOTE = "INSERT INTO notes (user_id, chat_id, text, created_at_epoch) VALUES (?, ?, ?, ?)"
+SQL_NOTES_CHAT_BETWEEN = (
+    "SELECT id, user_id, chat_id, text, created_at_epoch FROM notes "
+    "WHERE chat_id=? AND created_at_epoch >= ? AND created_at_epoch < ? "
+    "ORDER BY created_at_epoch ASC"
+)
+SQL_NOTES_ALL_BETWEEN = (
+    "SELECT id, user_id, chat_id, text, created_at_epoch "
+    "FROM notes WHERE created_at_epoch >= ? AND created_at_epoch < ? "
+    "ORDER BY created_at_epoch ASC"
+)
+SQL_NOTES_USER_BETWEEN = (
+    "SELECT id, text, created_at_epoch FROM notes "
+    "WHERE user_id=? AND created_at_epoch >= ? AND created_at_epoch < ? "
+    "ORDER BY created_at_epoch ASC"
+)
+# Те саме, але у формі SQL_NOTES_ALL_BETWEEN (з user_id/chat_id) — для rollup-ів одного користувача
+SQL_NOTES_USER_CHATS_BETWEEN = (
+    "SELECT id, user_id, chat_id, text, created_at_epoch FROM notes "
+    "WHERE user_id=? AND created_at_epoch >= ? AND created_at_epoch < ? "
+    "ORDER BY created_at_epoch ASC"
+)
+SQL_LAST_N = "SELECT id, user_id, chat_id, text, created_at_epoch FROM notes ORDER BY id DESC LIMIT ?"
+SQL_SET_NOTE_ANALYSIS = "UPDATE notes SET analysis=? WHERE id=?"
+SQL_NOTE_ANALYSES = "SELECT id, analysis FROM notes WHERE id IN ({}) AND analysis IS NOT NULL"
+
+# Кеш аналізів (ключ — хеш моделі + промпту + тексту)
+SQL_CACHE_GET = "SELECT value FROM analysis_cache WHERE key=? AND created_at >= ?"
+SQL_CACHE_TOUCH = "UPDATE analysis_cache SET last_used_at=? WHERE key=?"
+SQL_CACHE_PUT = (
+    "INSERT INTO analysis_cache (key, value, created_at, last_used_at) VALUES (?, ?, ?, ?) "
+    "ON CONFLICT(key) DO UPDATE SET value=excluded.value, created_at=excluded.created_at, "
+    "last_used_at=excluded.last_used_at"
+)
+# Кеш транскрипцій за Telegram file_unique_id (пересилання того самого голосового)
+SQL_TRANSCRIPT_GET = "SELECT text FROM transcripts WHERE file_unique_id=? AND model=?"
+SQL_TRANSCRIPT_HIT = "UPDATE transcripts SET hits=hits+1, last_used_at=? WHERE file_unique_id=? AND model=?"
+SQL_TRANSCRIPT_PUT = (
+    "INSERT INTO transcripts (file_unique_id, model, text, duration, file_size, created_at, last_used_at, hits) "
+    "VALUES (?, ?, ?, ?, ?, ?, ?, 0) "
+    "ON CONFLICT(file_unique_id, model) DO UPDATE SET text=excluded.text, last_used_at=excluded.last_used_at"
+)
+SQL_TRANSCRIPT_TRIM = (
+    "DELETE FROM transcripts WHERE rowid IN "
+    "(SELECT rowid FROM transcripts ORDER BY last_used_at DESC LIMIT -1 OFFSET ?)"
+)
+SQL_TRANSCRIPT_STATS = (
+    "SELECT COUNT(*), COALESCE(SUM(hits), 0), COALESCE(SUM(hits * duration), 0), "
+    "COALESCE(SUM(hits * file_size), 0) FROM transcripts"
+)
+# Координація інстансів: оренди (лідер для фонових задач), журнал відправлених звітів, спільний дедуп апдейтів.
+# Оренду можна перехопити лише якщо вона прострочена або вже наша.
+SQL_LEASE_ACQUIRE = (
+    "INSERT INTO leases (name, holder, expires_at) VALUES (?, ?, ?) "
+    "ON CONFLICT(name) DO UPDATE SET holder=excluded.holder, expires_at=excluded.expires_at "
+    "WHERE leases.holder=excluded.holder OR leases.expires_at < ?"
+)
+SQL_LEASE_GET = "SELECT holder, expires_at FROM leases WHERE name=?"
+SQL_LEASE_RELEASE = "DELETE FROM leases WHERE name=? AND holder=?"
+# Звіт (день, чат) відправляється рівно раз; «зависле» sending старше stale-межі можна перезаявити
+SQL_REPORT_CLAIM = (
+    "INSERT INTO report_log (day, chat_id, claim, status, claimed_at) VALUES (?, ?, ?, 'sending', ?) "
+    "ON CONFLICT(day, chat_id) DO UPDATE SET claim=excluded.claim, claimed_at=excluded.claimed_at "
+    "WHERE report_log.status='sending' AND report_log.claimed_at < ?"
+)
+SQL_REPORT_GET = "SELECT claim, status FROM report_log WHERE day=? AND chat_id=?"
+SQL_REPORT_DONE = "UPDATE report_log SET status='sent', sent_at=? WHERE day=? AND chat_id=? AND claim=?"
+SQL_REPORT_UNCLAIM = "DELETE FROM report_log WHERE day=? AND chat_id=? AND claim=? AND status='sending'"
+SQL_UPDATE_CLAIM = "INSERT INTO updates_seen (update_id, claim, seen_at) VALUES (?, ?, ?) ON CONFLICT(update_id) DO NOTHING"
+SQL_UPDATE_GET = "SELECT claim FROM updates_seen WHERE update_id=?"
+SQL_UPDATES_EXPIRE = "DELETE FROM updates_seen WHERE seen_at < ?"
+
+# Денні rollup-и: аналіз за (локальний день, user_id, chat_id); rollup_days.final=1 — зібрано після кінця дня
+SQL_ROLLUP_PUT = (
+    "INSERT INTO rollups (day, user_id, chat_id, analysis, notes, updated_at) VALUES (?, ?, ?, ?, ?, ?) "
+    "ON CONFLICT(day, user_id, chat_id) DO UPDATE SET analysis=excluded.analysis, notes=excluded.notes, "
+    "updated_at=excluded.updated_at"
+)
+SQL_ROLLUP_DAY_CLEAR = "DELETE FROM rollups WHERE day=?"
+SQL_ROLLUP_DAY_CLEAR_CHAT = "DELETE FROM rollups WHERE day=? AND chat_id=?"
+SQL_ROLLUP_DAY_CLEAR_USER = "DELETE FROM rollups WHERE day=? AND user_id=?"
+SQL_ROLLUP_DAY_PUT = (
+    "INSERT INTO rollup_days (day, final, notes, built_at) VALUES (?, ?, ?, ?) "
+    "ON CONFLICT(day) DO UPDATE SET final=excluded.final, notes=excluded.notes, built_at=excluded.built_at"
+)
+SQL_ROLLUP_DAYS_BETWEEN = "SELECT day, final FROM rollup_days WHERE day >= ? AND day <= ?"
+SQL_ROLLUPS_ALL_BETWEEN = "SELECT day, user_id, chat_id, analysis FROM rollups WHERE day >= ? AND day <= ?"
+SQL_ROLLUPS_CHAT_BETWEEN = (
+    "SELECT day, user_id, chat_id, analysis FROM rollups WHERE chat_id=? AND day >= ? AND day <= ?"
+)
+SQL_ROLLUPS_USER_BETWEEN = (
+    "SELECT day, user_id, chat_id, analysis FROM rollups WHERE user_id=? AND day >= ? AND day <= ?"
+)
+SQL_NOTES_FIRST_TS = "SELECT MIN(created_at_epoch) FROM notes"
+
+# Retention: нотатки дня в архів (разом з аналізом), потім видалення пачками по id
+SQL_NOTES_ARCHIVE_BETWEEN = (
+    "SELECT id, user_id, chat_id, text, created_at_epoch, analysis FROM notes "
+    "WHERE created_at_epoch >= ? AND created_at_epoch < ? ORDER BY created_at_epoch, id"
+)
+SQL_NOTES_DELETE_IDS = "DELETE FROM notes WHERE id IN ({})"
+
+# Повнотекстовий пошук: від найновіших (rowid DESC FTS5 віддає без сортування всіх збігів).
+# Чат/користувач звужуються ще в FTS токеном колонки scope (див. search_notes); умови на notes лишаються
+# джерелом істини (trigram шукає підрядки, тож "c12" знайде й "c123"), час — лише на з'єднаних рядках notes
+SQL_SEARCH_CHAT = (
+    "SELECT n.id, n.user_id, n.chat_id, n.created_at_epoch, "
+    "snippet(notes_fts, 0, char(2), char(3), '…', ?) "
+    "FROM notes_fts JOIN notes n ON n.id = notes_fts.rowid "
+    "WHERE notes_fts MATCH ? AND n.chat_id=? AND n.created_at_epoch >= ? AND n.created_at_epoch < ? "
+    "ORDER BY notes_fts.rowid DESC LIMIT ? OFFSET ?"
+)
+SQL_SEARCH_USER = (
+    "SELECT n.id, n.user_id, n.chat_id, n.created_at_epoch, "
+    "snippet(notes_fts, 0, char(2), char(3), '…', ?) "
+    "FROM notes_fts JOIN notes n ON n.id = notes_fts.rowid "
+    "WHERE notes_fts MATCH ? AND n.user_id=? AND n.created_at_epoch >= ? AND n.created_at_epoch < ? "
+    "ORDER BY notes_fts.rowid DESC LIMIT ? OFFSET ?"
+)
+SQL_SEARCH_ALL = (
+    "SELECT n.id, n.user_id, n.chat_id, n.created_at_epoch, "
+    "snippet(notes_fts, 0, char(2), char(3), '…', ?) "
+    "FROM notes_fts JOIN notes n ON n.id = notes_fts.rowid "
+    "WHERE notes_fts MATCH ? AND n.created_at_epoch >= ? AND n.created_at_epoch < ? "
+    "ORDER BY notes_fts.rowid DESC LIMIT ? OFFSET ?"
+)
+# Маркери підсвітки у snippet(): char(2)/char(3) — щоб не конфліктувати з Markdown у тексті нотаток
+SNIPPET_OPEN, SNIPPET_CLOSE = "\x02", "\x03"
+
+SQL_CACHE_EXPIRE = "DELETE FROM analysis_cache WHERE created_at < ?"
+SQL_CACHE_TRIM = (
+    "DELETE FROM analysis_cache WHERE key IN "
+    "(SELECT key FROM analysis_cache ORDER BY last_used_at DESC LIMIT -1 OFFSET ?)"
+)
+
+# Усі продакшн-запити на читання: (назва, SQL, приклад параметрів, дозволений SCAN — regex на весь рядок
+# плану або None). Дозвіл вузький: лише конкретний прохід, а не будь-який SCAN у цьому запиті.
+# explain_full_scans() повертає ті, що без дозволу роблять повний прохід по таблиці
+# (на старті — DB_PLAN_WARN у лог; у CI — bench/check_query_plans.py з ненульовим кодом виходу).
+QUERY_PLANS = [
+    ("notes_chat_between", SQL_NOTES_CHAT_BETWEEN, (1, 0, 1), None),
+    ("notes_all_between", SQL_NOTES_ALL_BETWEEN, (0, 1), None),
+    ("notes_user_between", SQL_NOTES_USER_BETWEEN, (1, 0, 1), None),
+    ("notes_user_chats_between", SQL_NOTES_USER_CHATS_BETWEEN, (1, 0, 1), None),
+    # SCAN по rowid у зворотному порядку з LIMIT — читає лише N рядків
+    ("last_n", SQL_LAST_N, (10,), r"SCAN notes"),
+    ("cache_get", SQL_CACHE_GET, ("k", 0), None),
+    ("transcript_get", SQL_TRANSCRIPT_GET, ("f", "m"), None),
+    # Агрегат для /diag: прохід по transcripts, але таблиця обмежена TRANSCRIPT_CACHE_MAX рядків (LRU-обрізка)
+    ("transcript_stats", SQL_TRANSCRIPT_STATS, (), r"SCAN transcripts"),
+    ("lease_get", SQL_LEASE_GET, ("daily",), None),
+    ("report_get", SQL_REPORT_GET, ("2024-01-01", 1), None),
+    ("update_get", SQL_UPDATE_GET, (1,), None),
+    ("rollup_days_between", SQL_ROLLUP_DAYS_BETWEEN, ("2024-01-01", "2024-01-31"), None),
+    ("rollups_all_between", SQL_ROLLUPS_ALL_BETWEEN, ("2024-01-01", "2024-01-31"), None),
+    ("rollups_chat_between", SQL_ROLLUPS_CHAT_BETWEEN, (1, "2024-01-01", "2024-01-31"), None),
+    ("rollups_user_between", SQL_ROLLUPS_USER_BETWEEN, (1, "2024-01-01", "2024-01-31"), None),
+    # MIN по індексу idx_notes_time — один крок, не прохід
+    ("notes_first_ts", SQL_NOTES_FIRST_TS, (), None),
+    ("notes_archive_between", SQL_NOTES_ARCHIVE_BETWEEN, (0, 1), None),
+    # "SCAN notes_fts VIRTUAL TABLE INDEX ..." — пошук по FTS-індексу, а не прохід таблиці
+    ("search_chat", SQL_SEARCH_CHAT, (12, 'scope : "cn1" AND text : ("звіт"*)', -1, 0, 1, 5, 0),
+     r"SCAN notes_fts VIRTUAL TABLE INDEX .*"),
+    ("search_user", SQL_SEARCH_USER, (12, 'scope : "u1" AND text : ("звіт"*)', 1, 0, 1, 5, 0),
+     r"SCAN notes_fts VIRTUAL TABLE INDEX .*"),
+    ("search_all", SQL_SEARCH_ALL, (12, 'text : ("звіт"*)', 0, 1, 5, 0), r"SCAN notes_fts VIRTUAL TABLE INDEX .*"),
+]
+
+def _is_full_scan(detail: str) -> bool:
+    # "SCAN notes" — повний прохід; "SCAN notes USING (COVERING) INDEX" — теж прохід усього індексу
+    return detail.startswith("SCAN ")
+
+async def explain_full_scans(db: aiosqlite.Connection) -> List[Tuple[str, str]]:
+    """Повертає [(назва_запиту, рядок плану)] для запитів, що роблять недозволений повний прохід."""
+    bad = []
+    for name, sql, params, allowed in QUERY_PLANS:
+        cur = await db.execute("EXPLAIN QUERY PLAN " + sql, params)
+        for row in await cur.fetchall():
+            detail = row[-1]
+            if _is_full_scan(detail) and not (allowed and re.fullmatch(allowed, detail)):
+                bad.append((name, detail))
+    return bad
+
+
+@lru_cache(maxsize=1024)
+def _sql_name(sql: str) -> str:
+    """Мітка для метрик: ім'я константи SQL_* без префікса (sql_notes_chat_between -> notes_chat_between)."""
+    for name, value in globals().items():
+        if name.startswith("SQL_") and value == sql:
+            return name[4:].lower()
+    # Запити зі змінною кількістю параметрів (IN (...)) — за шаблоном
+    for name, value in globals().items():
+        if name.startswith("SQL_") and isinstance(value, str) and "{}" in value \
+                and sql.startswith(value.split("{}")[0]):
+            return name[4:].lower()
+    return "other"
+
+
+# ===== Міграції =====
+# Кожна міграція виконується рівно один раз у власній транзакції; номер останньої
+# застосованої зберігається в PRAGMA user_version. Нові міграції — лише в кінець списку.
+
+async def _executescript(db: aiosqlite.Connection, script: str):
+    for stmt in script.strip().split(";"):
+        s = stmt.strip()
+        if s:
+            await db.execute(s)
+
+async def _m1_base(db: aiosqlite.Connection):
+    """Базова схема + перенесення зі старого поля created_at (TEXT) -> created_at_epoch."""
+    await _executescript(db, CREATE_SQL)
+    cur = await db.execute("PRAGMA table_info(notes)")
+    cols = [r[1] for r in await cur.fetchall()]
+    if "created_at" not in cols:
+        return
+    cur = await db.execute(
+        "SELECT id, created_at FROM notes WHERE created_at_epoch IS NULL OR created_at_epoch = ''"
+    )
+    rows = await cur.fetchall()
+    if rows:
+        import pytz
+        from datetime import datetime
+        for _id, created_at in rows:
+            try:
+                dt = datetime.fromisoformat(created_at)
+                if dt.tzinfo is None:
+                    dt = pytz.timezone("Europe/Kyiv").localize(dt)
+                ts = int(dt.astimezone(pytz.UTC).timestamp())
+            except Exception:
+                ts = 0
+            await db.execute("UPDATE notes SET created_at_epoch=? WHERE id=?", (ts, _id))
+
+async def _m2_integer_ids(db: aiosqlite.Connection):
+    """user_id/chat_id як INTEGER замість TEXT (перебудова таблиці; старе поле created_at відкидається)."""
+    cur = await db.execute("PRAGMA table_info(notes)")
+    types = {r[1]: (r[2] or "").upper() for r in await cur.fetchall()}
+    if types.get("user_id") == "INTEGER" and types.get("chat_id") == "INTEGER" and "created_at" not in types:
+        return
+    await _executescript(db, """
+    CREATE TABLE notes_new (
+      id INTEGER PRIMARY KEY AUTOINCREMENT,
+      user_id INTEGER NOT NULL,
+      chat_id INTEGER NOT NULL,
+      text TEXT NOT NULL,
+      created_at_epoch INTEGER NOT NULL
+    );
+    INSERT INTO notes_new (id, user_id, chat_id, text, created_at_epoch)
+      SELECT id, CAST(user_id AS INTEGER), CAST(chat_id AS INTEGER), text, COALESCE(created_at_epoch, 0) FROM notes;
+    DROP TABLE notes;
+    ALTER TABLE notes_new RENAME TO notes;
+    CREATE INDEX IF NOT EXISTS idx_notes_chat_time ON notes(chat_id, created_at_epoch)
+    """)
+
+async def _m3_time_indexes(db: aiosqlite.Connection):
+    """Індекси для зведень без фільтра по чату (/summary_all, 20:00) та по користувачу (/summary_me)."""
+    await _executescript(db, """
+    CREATE INDEX IF NOT EXISTS idx_notes_time ON notes(created_at_epoch);
+    CREATE INDEX IF NOT EXISTS idx_notes_user_time ON notes(user_id, created_at_epoch)
+    """)
+
+async def _m4_analysis_cache(db: aiosqlite.Connection):
+    """Кеш результатів analyze_notes_text з TTL (created_at) і LRU (last_used_at)."""
+    await _executescript(db, """
+    CREATE TABLE IF NOT EXISTS analysis_cache (
+      key TEXT PRIMARY KEY,
+      value TEXT NOT NULL,
+      created_at INTEGER NOT NULL,
+      last_used_at INTEGER NOT NULL
+    ) WITHOUT ROWID;
+    CREATE INDEX IF NOT EXISTS idx_analysis_cache_used ON analysis_cache(last_used_at)
+    """)
+
+async def _m5_note_analysis(db: aiosqlite.Connection):
+    """Структурований аналіз окремої нотатки (JSON) поруч із нею — для інкрементальних зведень."""
+    cur = await db.execute("PRAGMA table_info(notes)")
+    if "analysis" not in [r[1] for r in await cur.fetchall()]:
+        await db.execute("ALTER TABLE notes ADD COLUMN analysis TEXT")
+
+async def _m6_transcripts(db: aiosqlite.Connection):
+    """Кеш транскрипцій: (file_unique_id, model) -> текст + тривалість/розмір для статистики зекономленого."""
+    await _executescript(db, """
+    CREATE TABLE IF NOT EXISTS transcripts (
+      file_unique_id TEXT NOT NULL,
+      model TEXT NOT NULL,
+      text TEXT NOT NULL,
+      duration INTEGER NOT NULL DEFAULT 0,
+      file_size INTEGER NOT NULL DEFAULT 0,
+      created_at INTEGER NOT NULL,
+      last_used_at INTEGER NOT NULL,
+      hits INTEGER NOT NULL DEFAULT 0,
+      PRIMARY KEY (file_unique_id, model)
+    );
+    CREATE INDEX IF NOT EXISTS idx_transcripts_used ON transcripts(last_used_at)
+    """)
+
+async def _m7_coordination(db: aiosqlite.Connection):
+    """Таблиці для кількох інстансів на спільній БД: оренди, журнал звітів, спільний дедуп update_id."""
+    await _executescript(db, """
+    CREATE TABLE IF NOT EXISTS leases (
+      name TEXT PRIMARY KEY,
+      holder TEXT NOT NULL,
+      expires_at INTEGER NOT NULL
+    ) WITHOUT ROWID;
+    CREATE TABLE IF NOT EXISTS report_log (
+      day TEXT NOT NULL,
+      chat_id INTEGER NOT NULL,
+      claim TEXT NOT NULL,
+      status TEXT NOT NULL,
+      claimed_at INTEGER NOT NULL,
+      sent_at INTEGER,
+      PRIMARY KEY (day, chat_id)
+    ) WITHOUT ROWID;
+    CREATE TABLE IF NOT EXISTS updates_seen (
+      update_id INTEGER PRIMARY KEY,
+      claim TEXT NOT NULL,
+      seen_at INTEGER NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS idx_updates_seen_at ON updates_seen(seen_at)
+    """)
+
+async def _m8_rollups(db: aiosqlite.Connection):
+    """Денні rollup-и аналізів для звітів за тиждень/місяць/довільний діапазон."""
+    await _executescript(db, """
+    CREATE TABLE IF NOT EXISTS rollups (
+      day TEXT NOT NULL,
+      user_id INTEGER NOT NULL,
+      chat_id INTEGER NOT NULL,
+      analysis TEXT NOT NULL,
+      notes INTEGER NOT NULL,
+      updated_at INTEGER NOT NULL,
+      PRIMARY KEY (day, user_id, chat_id)
+    ) WITHOUT ROWID;
+    CREATE INDEX IF NOT EXISTS idx_rollups_chat_day ON rollups(chat_id, day);
+    CREATE INDEX IF NOT EXISTS idx_rollups_user_day ON rollups(user_id, day);
+    CREATE TABLE IF NOT EXISTS rollup_days (
+      day TEXT PRIMARY KEY,
+      final INTEGER NOT NULL,
+      notes INTEGER NOT NULL,
+      built_at INTEGER NOT NULL
+    ) WITHOUT ROWID
+    """)
+
+def fts_scope_token(kind: str, value: int) -> str:
+    """Токен колонки scope: c<chat_id> / u<user_id>, мінус -> "n" (unicode61 розриває токен на «-»)."""
+    return f"{kind}{value}".replace("-", "n")
+
+def _fts_scope_sql(row: str) -> str:
+    # Те саме, що fts_scope_token, але в SQL — для view і тригерів
+    return f"'c' || replace({row}.chat_id, '-', 'n') || ' u' || replace({row}.user_id, '-', 'n')"
+
+def _fts_create_sql() -> str:
+    # trigram шукає підрядки й без префіксних індексів
+    prefix = f", prefix='{FTS_PREFIX}'" if FTS_PREFIX and not FTS_TOKENIZE.startswith("trigram") else ""
+    return (
+        "CREATE VIRTUAL TABLE notes_fts USING fts5("
+        f"text, scope, content='notes_fts_src', content_rowid='id', tokenize='{FTS_TOKENIZE}'{prefix})"
+    )
+
+# External content для notes_fts: текст нотатки + токени чату й користувача (колонки scope в notes немає)
+SQL_FTS_SOURCE_VIEW = (
+    "CREATE VIEW IF NOT EXISTS notes_fts_src AS "
+    f"SELECT id, text, {_fts_scope_sql('notes')} AS scope FROM notes"
+)
+
+# Тригери з BEGIN ... END містять «;», тож виконуються окремо, а не через _executescript
+FTS_TRIGGERS = [
+    "CREATE TRIGGER IF NOT EXISTS notes_fts_ai AFTER INSERT ON notes BEGIN "
+    f"INSERT INTO notes_fts(rowid, text, scope) VALUES (new.id, new.text, {_fts_scope_sql('new')}); END",
+    "CREATE TRIGGER IF NOT EXISTS notes_fts_ad AFTER DELETE ON notes BEGIN "
+    "INSERT INTO notes_fts(notes_fts, rowid, text, scope) "
+    f"VALUES ('delete', old.id, old.text, {_fts_scope_sql('old')}); END",
+    # Лише зміна індексованих полів: запис аналізу (UPDATE analysis) індекс не чіпає
+    "CREATE TRIGGER IF NOT EXISTS notes_fts_au AFTER UPDATE OF text, chat_id, user_id ON notes BEGIN "
+    "INSERT INTO notes_fts(notes_fts, rowid, text, scope) "
+    f"VALUES ('delete', old.id, old.text, {_fts_scope_sql('old')}); "
+    f"INSERT INTO notes_fts(rowid, text, scope) VALUES (new.id, new.text, {_fts_scope_sql('new')}); END",
+]
+
+async def _create_fts(db: aiosqlite.Connection):
+    await db.execute(SQL_FTS_SOURCE_VIEW)
+    await db.execute(_fts_create_sql())
+    for trig in FTS_TRIGGERS:
+        await db.execute(trig)
+    await db.execute("INSERT INTO notes_fts(notes_fts) VALUES ('rebuild')")
+
+async def _m9_fts(db: aiosqlite.Connection):
+    """
+    Повнотекстовий індекс FTS5 по notes.text (external content) + тригери + одноразове заповнення.
+    Одразу в поточній формі (scope, префіксні індекси): _m10_fts_scope для такої БД нічого не робить.
+    """
+    await _create_fts(db)
+
+async def _m10_fts_scope(db: aiosqlite.Connection):
+    """
+    notes_fts з колонкою scope (токени чату й користувача) і префіксними індексами: фільтр /find
+    по чату/користувачу і "основа"* відпрацьовують в FTS, а не після злиття всіх збігів.
+    Перебудова лише для БД, де _m9_fts ще створила індекс без scope — оновлення робить один 'rebuild'.
+    """
+    cur = await db.execute("SELECT sql FROM sqlite_master WHERE name='notes_fts'")
+    row = await cur.fetchone()
+    if row is not None and "scope" in row[0]:
+        return
+    for trig in ("notes_fts_ai", "notes_fts_ad", "notes_fts_au"):
+        await db.execute(f"DROP TRIGGER IF EXISTS {trig}")
+    await db.execute("DROP TABLE IF EXISTS notes_fts")
+    await _create_fts(db)
+
+async def ensure_fts_config(db: aiosqlite.Connection):
+    """Якщо FTS_TOKENIZE чи FTS_PREFIX змінилися — перестворити notes_fts і заповнити заново."""
+    cur = await db.execute("SELECT sql FROM sqlite_master WHERE name='notes_fts'")
+    row = await cur.fetchone()
+    if row is None or row[0] == _fts_create_sql():
+        return
+    started = time.perf_counter()
+    await db.execute("BEGIN IMMEDIATE")
+    try:
+        # Тригери посилаються на notes_fts за іменем і лишаються валідними
+        await db.execute("DROP TABLE notes_fts")
+        await db.execute(_fts_create_sql())
+        await db.execute("INSERT INTO notes_fts(notes_fts) VALUES ('rebuild')")
         await db.commit()
-        # Простенька міграція зі старого поля created_at (TEXT) -> created_at_epoch
+    except Exception:
+        await db.rollback()
+        raise
+    log("DB_FTS_REBUILD", tokenize=FTS_TOKENIZE, prefix=FTS_PREFIX, seconds=round(time.perf_counter() - started, 2))
+
+async def ensure_auto_vacuum(db: aiosqlite.Connection):
+    """
+    auto_vacuum=INCREMENTAL: місце після видалень (retention.py) повертається через incremental_vacuum
+    без повного VACUUM. На наявній БД режим вмикається лише повним VACUUM — один раз, поза транзакцією
+    (тому не в MIGRATIONS) і з тимчасовою копією у файлі, а не в пам'яті (temp_store=MEMORY у PRAGMAS).
+    """
+    cur = await db.execute("PRAGMA auto_vacuum")
+    if (await cur.fetchone())[0] == 2:
+        return
+    started = time.perf_counter()
+    try:
+        await db.execute("PRAGMA auto_vacuum=INCREMENTAL")
+        await db.execute("PRAGMA temp_store=FILE")
+        await db.execute("VACUUM")
+        # VACUUM у WAL-режимі переписує всю БД у WAL — одразу перенести і обрізати
+        await db.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    except aiosqlite.OperationalError as e:
+        # Інший процес на тому ж файлі тримає БД — спробуємо на наступному старті
+        log("DB_AUTO_VACUUM_SKIP", error=str(e))
+        return
+    finally:
+        await db.execute("PRAGMA temp_store=MEMORY")
+    log("DB_AUTO_VACUUM", mode="incremental", seconds=round(time.perf_counter() - started, 2))
+
+MIGRATIONS = [
+    (1, _m1_base),
+    (2, _m2_integer_ids),
+    (3, _m3_time_indexes),
+    (4, _m4_analysis_cache),
+    (5, _m5_note_analysis),
+    (6, _m6_transcripts),
+    (7, _m7_coordination),
+    (8, _m8_rollups),
+    (9, _m9_fts),
+    (10, _m10_fts_scope),
+]
+
+async def migrate(db: aiosqlite.Connection):
+    cur = await db.execute("PRAGMA user_version")
+    current = (await cur.fetchone())[0]
+    for version, fn in MIGRATIONS:
+        if version <= current:
+            continue
+        # BEGIN IMMEDIATE + повторна перевірка версії: кілька процесів на одному файлі
+        # (інстанси з тим самим DB_PATH) не застосують міграцію двічі
+        await db.execute("BEGIN IMMEDIATE")
+        cur = await db.execute("PRAGMA user_version")
+        current = (await cur.fetchone())[0]
+        if version <= current:
+            await db.rollback()
+            continue
         try:
-            cur = await db.execute("PRAGMA table_info(notes)")
-            cols = [r[1] for r in await cur.fetchall()]
-            if "created_at" in cols and "created_at_epoch" in cols:
-                cur = await db.execute(
-                    "SELECT id, created_at FROM notes WHERE created_at_epoch IS NULL OR created_at_epoch = ''"
-                )
-                rows = await cur.fetchall()
-                if rows:
-                    import pytz
-                    from datetime import datetime
-                    for _id, created_at in rows:
-                        try:
-                            dt = datetime.fromisoformat(created_at)
-                            if dt.tzinfo is None:
-                                dt = pytz.timezone("Europe/Kyiv").localize(dt)
-                            ts = int(dt.astimezone(pytz.UTC).timestamp())
-                        except Exception:
-                            ts = 0
-                        await db.execute("UPDATE notes SET created_at_epoch=? WHERE id=?", (ts, _id))
-                    await db.execute("CREATE INDEX IF NOT EXISTS idx_notes_chat_time ON notes(chat_id, created_at_epoch)")
-                    await db.commit()
+            await fn(db)
+            await db.execute(f"PRAGMA user_version={version}")
+            await db.commit()
         except Exception:
-            pass
-
-async def add_note(user_id: str, chat_id: str, text: str, created_at_epoch: int):
-    async with aiosqlite.connect(DB_PATH) as db:
-        await db.execute(
-            "INSERT INTO notes (user_id, chat_id, text, created_at_epoch) VALUES (?, ?, ?, ?)",
-            (user_id, chat_id, text, created_at_epoch),
-        )
-        await db.commit()
+            await db.rollback()
+            raise
+        log("DB_MIGRATE", applied=version, migration=fn.__name__)
+
+
+class NoteStore:
+    """
+    Довгоживуче сховище: одне з'єднання-писач + невеликий пул з'єднань-читачів.
+    Записи, що прийшли протягом DB_BATCH_MS, комітяться однією транзакцією.
+    """
+
+    def __init__(self, path: str = DB_PATH, read_pool: int = DB_READ_POOL,
+                 batch_ms: float = DB_BATCH_MS, batch_max: int = DB_BATCH_MAX):
+        self.path = path
+        self._read_pool_size = read_pool
+        self._batch_s = batch_ms / 1000.0
+        self._batch_max = batch_max
+        self._writer: Optional[aiosqlite.Connection] = None
+        self._readers: asyncio.Queue = asyncio.Queue()
+        self._all_readers: list[aiosqlite.Connection] = []
+        self._writes: asyncio.Queue = asyncio.Queue()
+        self._writer_task: Optional[asyncio.Task] = None
+
+    async def _connect(self) -> aiosqlite.Connection:
+        conn = await aiosqlite.connect(self.path, cached_statements=256)
+        for p in PRAGMAS:
+            await conn.execute(p)
+        return conn
+
+    async def open(self):
+        self._writer = await self._connect()
+        await self._init_schema(self._writer)
+        for name, detail in await explain_full_scans(self._writer):
+            log("DB_PLAN_WARN", query=name, plan=detail)
+        for _ in range(self._read_pool_size):
+            conn = await self._connect()
+            await conn.execute("PRAGMA query_only=1")
+            self._all_readers.append(conn)
+            self._readers.put_nowait(conn)
+        self._writer_task = asyncio.create_task(self._writer_loop())
+
+    async def close(self):
+        if self._writer_task:
+            # Дочекатися вже поставлених записів
+            await self._writes.join()
+            self._writer_task.cancel()
+            await asyncio.gather(self._writer_task, return_exceptions=True)
+            self._writer_task = None
+        for conn in self._all_readers:
+            await conn.close()
+        self._all_readers.clear()
+        if self._writer:
+            await self._writer.close()
+            self._writer = None
+
+    async def _init_schema(self, db: aiosqlite.Connection):
+        await ensure_auto_vacuum(db)
+        await migrate(db)
+        await ensure_fts_config(db)
+
+    # ----- запис -----
+    async def execute_write(self, sql: str, params: Sequence[Any] = ()) -> int:
+        """Поставити запис у груповий коміт; повертає lastrowid після коміту."""
+        started = time.perf_counter()
+        fut = asyncio.get_running_loop().create_future()
+        await self._writes.put(([(sql, params)], fut))
+        try:
+            return await fut
+        finally:
+            DB_QUERY_SECONDS.labels(_sql_name(sql)).observe(time.perf_counter() - started)
+
+    async def execute_batch(self, statements: Sequence[Tuple[str, Sequence[Any]]]) -> int:
+        """
+        Кілька записів одним елементом групового коміту: в одній транзакції і атомарно (SAVEPOINT) —
+        читачі бачать або всі, або жоден. Повертає lastrowid останнього.
+        """
+        started = time.perf_counter()
+        fut = asyncio.get_running_loop().create_future()
+        await self._writes.put((list(statements), fut))
+        try:
+            return await fut
+        finally:
+            DB_QUERY_SECONDS.labels(_sql_name(statements[0][0])).observe(time.perf_counter() - started)
 
-async def get_notes_between(chat_id: str, start_epoch: int, end_epoch: int) -> List[Tuple[int, str, str, str, int]]:
-    async with aiosqlite.connect(DB_PATH) as db:
-        cur = await db.execute(
-            "SELECT id, user_id, chat_id, text, created_at_epoch FROM notes "
-            "WHERE chat_id=? AND created_at_epoch >= ? AND created_at_epoch < ? "
-            "ORDER BY created_at_epoch ASC",
-            (chat_id, start_epoch, end_epoch)
-        )
-        rows = await cur.fetchall()
-    return rows
-
-async def get_last_n(limit: int = 10) -> List[Tuple[int, str, str, str, int]]:
+    async def _writer_loop(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._writes.get()]
+            deadline = loop.time() + self._batch_s
+            while len(batch) < self._batch_max:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._writes.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            await self._flush(batch)
+
+    async def _flush(self, batch):
+        results = []
+        for statements, fut in batch:
+            atomic = len(statements) > 1
+            try:
+                if atomic:
+                    await self._writer.execute("SAVEPOINT write_batch")
+                for sql, params in statements:
+                    cur = await self._writer.execute(sql, params)
+                if atomic:
+                    await self._writer.execute("RELEASE write_batch")
+                results.append((fut, cur.lastrowid, None))
+            except Exception as e:
+                if atomic:
+                    # Відкотити лише цей елемент; решта пачки комітиться як зазвичай
+                    await self._writer.execute("ROLLBACK TO write_batch")
+                    await self._writer.execute("RELEASE write_batch")
+                results.append((fut, None, e))
+        try:
+            await self._writer.commit()
+        except Exception as e:
+            results = [(fut, None, err or e) for fut, _, err in results]
+        for fut, rowid, err in results:
+            if not fut.done():
+                if err is not None:
+                    fut.set_exception(err)
+                else:
+                    fut.set_result(rowid)
+            self._writes.task_done()
+
+    # ----- читання -----
+    @asynccontextmanager
+    async def reader(self):
+        conn = await self._readers.get()
+        try:
+            yield conn
+        finally:
+            self._readers.put_nowait(conn)
+
+    async def fetchall(self, sql: str, params: Sequence[Any] = ()) -> list:
+        started = time.perf_counter()
+        async with self.reader() as db:
+            cur = await db.execute(sql, params)
+            rows = await cur.fetchall()
+            await cur.close()
+        DB_QUERY_SECONDS.labels(_sql_name(sql)).observe(time.perf_counter() - started)
+        return rows
+
+    # ----- обслуговування (retention.py) -----
+    @asynccontextmanager
+    async def maintenance(self):
+        """
+        Окреме коротке з'єднання для checkpoint/vacuum/dbstat: PRAGMA не можна змішувати з відкритою
+        транзакцією групового коміту писача, а конкуренцію за блокування розводить busy_timeout.
+        """
+        conn = await self._connect()
+        try:
+            yield conn
+        finally:
+            await conn.close()
+
+
+# Бекенд сховища: NoteStore (SQLite) або db_pg.PgStore (PostgreSQL) — обидва з open/close/
+# execute_write/fetchall над тими самими константами SQL_*; функції нижче не знають, який саме.
+_store: Optional[NoteStore] = None
+
+def get_store() -> NoteStore:
+    if _store is None:
+        raise RuntimeError("БД не ініціалізована: виклич init_db()")
+    return _store
+
+async def init_db():
+    global _store
+    if _store is None:
+        if DB_URL.startswith(("postgres://", "postgresql://")):
+            from db_pg import PgStore
+            store = PgStore(DB_URL)
+        else:
+            store = NoteStore(DB_PATH)
+        await store.open()
+        _store = store
+
+async def close_db():
+    global _store
+    if _store is not None:
+        await _store.close()
+        _store = None
+
+async def add_note(user_id: int, chat_id: int, text: str, created_at_epoch: int) -> int:
+    return await get_store().execute_write(SQL_INSERT_NOTE, (user_id, chat_id, text, created_at_epoch))
+
+async def get_notes_between(chat_id: int, start_epoch: int, end_epoch: int) -> List[Tuple[int, int, int, str, int]]:
+    return await get_store().fetchall(SQL_NOTES_CHAT_BETWEEN, (chat_id, start_epoch, end_epoch))
+
+async def get_all_notes_between(start_epoch: int, end_epoch: int) -> List[Tuple[int, int, int, str, int]]:
+    """Усі нотатки за вікно без фільтра по чату: (id, user_id, chat_id, text, ts)."""
+    return await get_store().fetchall(SQL_NOTES_ALL_BETWEEN, (start_epoch, end_epoch))
+
+async def get_user_notes_between(user_id: int, start_epoch: int, end_epoch: int) -> List[Tuple[int, str, int]]:
+    """Нотатки одного користувача з усіх чатів: (id, text, ts)."""
+    return await get_store().fetchall(SQL_NOTES_USER_BETWEEN, (user_id, start_epoch, end_epoch))
+
+async def get_user_chat_notes_between(user_id: int, start_epoch: int,
+                                      end_epoch: int) -> List[Tuple[int, int, int, str, int]]:
+    """Нотатки одного користувача з усіх чатів у формі get_all_notes_between: (id, user_id, chat_id, text, ts)."""
+    return await get_store().fetchall(SQL_NOTES_USER_CHATS_BETWEEN, (user_id, start_epoch, end_epoch))
+
+async def get_last_n(limit: int = 10) -> List[Tuple[int, int, int, str, int]]:
     """Останні N нот без фільтру по чату (для діагностики)."""
-    async with aiosqlite.connect(DB_PATH) as db:
-        cur = await db.execute(
-            "SELECT id, user_id, chat_id, text, created_at_epoch FROM notes ORDER BY id DESC LIMIT ?",
-            (limit,)
-        )
-        rows = await cur.fetchall()
-    return rows
+    return await get_store().fetchall(SQL_LAST_N, (limit,))
+
+async def set_note_analysis(note_id: int, analysis_json: str):
+    await get_store().execute_write(SQL_SET_NOTE_ANALYSIS, (analysis_json, note_id))
+
+async def get_note_analyses(note_ids: Sequence[int]) -> Dict[int, str]:
+    """{note_id: analysis_json} для нотаток, що вже мають збережений аналіз."""
+    out: Dict[int, str] = {}
+    ids = list(note_ids)
+    for i in range(0, len(ids), 500):
+        part = ids[i:i + 500]
+        sql = SQL_NOTE_ANALYSES.format(",".join("?" * len(part)))
+        for note_id, analysis in await get_store().fetchall(sql, part):
+            out[note_id] = analysis
+    return out
+
+async def cache_get(key: str, not_older_than: int, now: int) -> Optional[str]:
+    """Значення з кешу аналізів, якщо є і не старше not_older_than (epoch); оновлює last_used_at."""
+    rows = await get_store().fetchall(SQL_CACHE_GET, (key, not_older_than))
+    if not rows:
+        return None
+    await get_store().execute_write(SQL_CACHE_TOUCH, (now, key))
+    return rows[0][0]
+
+async def cache_put(key: str, value: str, now: int):
+    await get_store().execute_write(SQL_CACHE_PUT, (key, value, now, now))
+
+async def cache_evict(not_older_than: int, max_rows: int):
+    """Прибрати прострочені записи (TTL) і найдавніше використані понад max_rows (LRU)."""
+    await get_store().execute_write(SQL_CACHE_EXPIRE, (not_older_than,))
+    await get_store().execute_write(SQL_CACHE_TRIM, (max_rows,))
+
+async def transcript_get(file_unique_id: str, model: str, now: int) -> Optional[str]:
+    """Збережена транскрипція цього файлу (або None); влучання рахується в hits."""
+    rows = await get_store().fetchall(SQL_TRANSCRIPT_GET, (file_unique_id, model))
+    if not rows:
+        return None
+    await get_store().execute_write(SQL_TRANSCRIPT_HIT, (now, file_unique_id, model))
+    return rows[0][0]
+
+async def transcript_put(file_unique_id: str, model: str, text: str, duration: int, file_size: int, now: int):
+    await get_store().execute_write(
+        SQL_TRANSCRIPT_PUT, (file_unique_id, model, text, duration, file_size, now, now)
+    )
+
+async def transcript_evict(max_rows: int):
+    await get_store().execute_write(SQL_TRANSCRIPT_TRIM, (max_rows,))
+
+async def transcript_stats() -> Dict[str, int]:
+    """Скільки записів у кеші, влучань, а також секунд Whisper і байт завантаження зекономлено."""
+    entries, hits, seconds, size = (await get_store().fetchall(SQL_TRANSCRIPT_STATS))[0]
+    return {"entries": entries, "hits": hits, "whisper_seconds_saved": seconds, "bytes_saved": size}
+
+async def lease_acquire(name: str, holder: str, ttl: int, now: int) -> bool:
+    """Взяти або продовжити оренду name до now+ttl. True — оренда наша."""
+    await get_store().execute_write(SQL_LEASE_ACQUIRE, (name, holder, now + ttl, now))
+    rows = await get_store().fetchall(SQL_LEASE_GET, (name,))
+    return bool(rows) and rows[0][0] == holder
+
+async def lease_release(name: str, holder: str):
+    await get_store().execute_write(SQL_LEASE_RELEASE, (name, holder))
+
+async def lease_holder(name: str, now: int) -> Optional[str]:
+    rows = await get_store().fetchall(SQL_LEASE_GET, (name,))
+    if rows and rows[0][1] >= now:
+        return rows[0][0]
+    return None
+
+async def report_claim(day: str, chat_id: int, claim: str, now: int, stale_after: int) -> bool:
+    """
+    Заявити відправку звіту (day, chat_id) унікальним токеном claim. False — звіт уже відправлено
+    або його зараз відправляє інший інстанс (заявка молодша за stale_after секунд).
+    """
+    await get_store().execute_write(SQL_REPORT_CLAIM, (day, chat_id, claim, now, now - stale_after))
+    rows = await get_store().fetchall(SQL_REPORT_GET, (day, chat_id))
+    return bool(rows) and rows[0][0] == claim and rows[0][1] == "sending"
+
+async def report_done(day: str, chat_id: int, claim: str, now: int):
+    await get_store().execute_write(SQL_REPORT_DONE, (now, day, chat_id, claim))
+
+async def report_unclaim(day: str, chat_id: int, claim: str):
+    """Зняти заявку після невдалої відправки, щоб наступна спроба могла її взяти."""
+    await get_store().execute_write(SQL_REPORT_UNCLAIM, (day, chat_id, claim))
+
+async def update_claim(update_id: int, claim: str, now: int) -> bool:
+    """Спільний (між інстансами) дедуп апдейтів Telegram. False — апдейт уже взяв хтось інший."""
+    await get_store().execute_write(SQL_UPDATE_CLAIM, (update_id, claim, now))
+    rows = await get_store().fetchall(SQL_UPDATE_GET, (update_id,))
+    return bool(rows) and rows[0][0] == claim
+
+async def updates_evict(not_older_than: int):
+    await get_store().execute_write(SQL_UPDATES_EXPIRE, (not_older_than,))
+
+async def rollup_day_put(day: str, rows: Sequence[Tuple[int, int, str, int]], final: bool, now: int,
+                         chat_id: Optional[int] = None, user_id: Optional[int] = None):
+    """
+    Перезаписати rollup-и дня: rows = [(user_id, chat_id, analysis_json, notes_count)].
+    Одним атомарним записом — паралельний звіт за діапазон не прочитає напівзаписаний день.
+    chat_id/user_id — перезаписати лише rollup-и цього чату/користувача; rollup_days тоді не чіпається
+    (день зібрано не повністю).
+    """
+    if chat_id is not None:
+        head, tail = [(SQL_ROLLUP_DAY_CLEAR_CHAT, (day, chat_id))], []
+    elif user_id is not None:
+        head, tail = [(SQL_ROLLUP_DAY_CLEAR_USER, (day, user_id))], []
+    else:
+        head = [(SQL_ROLLUP_DAY_CLEAR, (day,))]
+        tail = [(SQL_ROLLUP_DAY_PUT, (day, int(final), sum(r[3] for r in rows), now))]
+    await get_store().execute_batch(
+        head
+        + [(SQL_ROLLUP_PUT, (day, uid, cid, analysis, notes, now)) for uid, cid, analysis, notes in rows]
+        + tail
+    )
+
+async def rollup_days_between(first: str, last: str) -> Dict[str, bool]:
+    """{day: final} для вже зібраних днів діапазону (включно)."""
+    return {day: bool(final) for day, final in await get_store().fetchall(SQL_ROLLUP_DAYS_BETWEEN, (first, last))}
+
+async def get_rollups_between(first: str, last: str, chat_id: Optional[int] = None,
+                              user_id: Optional[int] = None) -> List[Tuple[str, int, int, str]]:
+    """Rollup-и діапазону днів (включно): [(day, user_id, chat_id, analysis_json)], фільтр — чат або користувач."""
+    if chat_id is not None:
+        return await get_store().fetchall(SQL_ROLLUPS_CHAT_BETWEEN, (chat_id, first, last))
+    if user_id is not None:
+        return await get_store().fetchall(SQL_ROLLUPS_USER_BETWEEN, (user_id, first, last))
+    return await get_store().fetchall(SQL_ROLLUPS_ALL_BETWEEN, (first, last))
+
+def _sqlite_store(what: str) -> NoteStore:
+    store = get_store()
+    if not isinstance(store, NoteStore):
+        raise RuntimeError(f"{what} доступний лише з SQLite-сховищем")
+    return store
+
+async def get_first_note_ts() -> Optional[int]:
+    return (await get_store().fetchall(SQL_NOTES_FIRST_TS))[0][0]
+
+async def search_notes(match: str, chat_id: Optional[int] = None, user_id: Optional[int] = None,
+                       start_epoch: int = 0, end_epoch: int = 2 ** 62, limit: int = 5, offset: int = 0,
+                       snippet_tokens: int = 16) -> List[Tuple[int, int, int, int, str]]:
+    """
+    Повнотекстовий пошук (match — вираз FTS5, див. search.build_match), від найновіших:
+    [(id, user_id, chat_id, ts, snippet)]; у snippet збіги між SNIPPET_OPEN/SNIPPET_CLOSE.
+    """
+    _sqlite_store("повнотекстовий пошук")
+    # Слова запиту — лише в тексті; чат/користувач — токеном scope, щоб FTS не перебирав чужі збіги
+    match = f"text : ({match})"
+    if chat_id is not None:
+        match = f'scope : "{fts_scope_token("c", chat_id)}" AND {match}'
+    elif user_id is not None:
+        match = f'scope : "{fts_scope_token("u", user_id)}" AND {match}'
+    if chat_id is not None:
+        sql, params = SQL_SEARCH_CHAT, (snippet_tokens, match, chat_id, start_epoch, end_epoch, limit, offset)
+    elif user_id is not None:
+        sql, params = SQL_SEARCH_USER, (snippet_tokens, match, user_id, start_epoch, end_epoch, limit, offset)
+    else:
+        sql, params = SQL_SEARCH_ALL, (snippet_tokens, match, start_epoch, end_epoch, limit, offset)
+    return await get_store().fetchall(sql, params)
+
+async def get_notes_for_archive(start_epoch: int, end_epoch: int) -> List[Tuple[int, int, int, str, int, Optional[str]]]:
+    """Нотатки вікна для архіву: (id, user_id, chat_id, text, ts, analysis)."""
+    return await get_store().fetchall(SQL_NOTES_ARCHIVE_BETWEEN, (start_epoch, end_epoch))
+
+async def delete_notes(note_ids: Sequence[int], batch: int = 500):
+    """Видалити нотатки пачками (кожна — короткий запис; тригер notes_fts_ad прибирає їх і з пошуку)."""
+    for i in range(0, len(note_ids), batch):
+        chunk = note_ids[i:i + batch]
+        await get_store().execute_write(SQL_NOTES_DELETE_IDS.format(",".join("?" * len(chunk))), chunk)
+
+def db_files_bytes(path: str) -> Dict[str, int]:
+    return {
+        name: os.path.getsize(path + suffix) if os.path.exists(path + suffix) else 0
+        for name, suffix in (("db", ""), ("wal", "-wal"))
+    }
+
+async def wal_checkpoint() -> Tuple[int, int, int]:
+    """PRAGMA wal_checkpoint(TRUNCATE): (busy, кадрів у WAL, перенесено); busy=1 — читачі завадили обрізати."""
+    async with _sqlite_store("checkpoint").maintenance() as conn:
+        cur = await conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        return tuple(await cur.fetchone())
+
+async def fts_merge(step_pages: int = 500) -> int:
+    """
+    Злити сегменти notes_fts кроками по step_pages: видалення (retention) лишають у FTS5 записи-«надгробки»,
+    що займають місце до злиття. На відміну від 'optimize', кожен крок — коротка транзакція.
+    Повертає кількість кроків; крок, що змінив < 2 рядків, означає «зливати більше нічого».
+    """
+    async with _sqlite_store("fts merge").maintenance() as conn:
+        steps = 0
+        while True:
+            before = conn.total_changes
+            await conn.execute("INSERT INTO notes_fts(notes_fts, rank) VALUES ('merge', ?)", (-step_pages,))
+            await conn.commit()
+            steps += 1
+            if conn.total_changes - before < 2:
+                return steps
+            await asyncio.sleep(0)
+
+async def incremental_vacuum(step_pages: int = 1024) -> int:
+    """
+    Повернути вільні сторінки файлу кроками по step_pages (кожен крок — окрема коротка транзакція,
+    писач між ними не чекає довго). Повертає звільнені байти; файл фізично зменшується після checkpoint.
+    """
+    async with _sqlite_store("vacuum").maintenance() as conn:
+        page_size = (await (await conn.execute("PRAGMA page_size")).fetchone())[0]
+        freed = 0
+        while True:
+            before = (await (await conn.execute("PRAGMA freelist_count")).fetchone())[0]
+            if before == 0:
+                break
+            cur = await conn.execute(f"PRAGMA incremental_vacuum({step_pages})")
+            await cur.fetchall()   # прагма звільняє сторінки по кроках виконання — дочитати до кінця
+            await conn.commit()
+            after = (await (await conn.execute("PRAGMA freelist_count")).fetchone())[0]
+            if after >= before:
+                break   # auto_vacuum ще не INCREMENTAL (див. ensure_auto_vacuum)
+            freed += (before - after) * page_size
+            await asyncio.sleep(0)
+        return freed
+
+async def storage_stats() -> Dict[str, Any]:
+    """
+    Розміри для /storage: файли БД і WAL, сторінки (вільні — під incremental_vacuum), байти по таблицях
+    з dbstat (індекси — до своєї таблиці, службові таблиці FTS5 — до notes_fts), кількість нотаток.
+    """
+    store = _sqlite_store("dbstat")
+    out: Dict[str, Any] = {"files": db_files_bytes(store.path)}
+    async with store.maintenance() as conn:
+        for pragma in ("page_size", "page_count", "freelist_count", "auto_vacuum"):
+            out[pragma] = (await (await conn.execute(f"PRAGMA {pragma}")).fetchone())[0]
+        tables: Dict[str, int] = {}
+        try:
+            cur = await conn.execute(
+                "SELECT COALESCE(m.tbl_name, s.name), SUM(s.pgsize) FROM dbstat s "
+                "LEFT JOIN sqlite_master m ON m.name = s.name GROUP BY 1"
+            )
+            for name, size in await cur.fetchall():
+                key = "notes_fts" if name.startswith("notes_fts") else name
+                tables[key] = tables.get(key, 0) + size
+        except aiosqlite.OperationalError:
+            pass   # SQLite без SQLITE_ENABLE_DBSTAT_VTAB
+        out["tables"] = sorted(tables.items(), key=lambda kv: kv[1], reverse=True)
+        out["notes"] = (await (await conn.execute("SELECT COUNT(*) FROM notes")).fetchone())[0]
+    return out
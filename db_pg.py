@@ -0,0 +1,178 @@
+"""
+Спільне сховище в PostgreSQL для кількох інстансів бота (DB_URL=postgresql://...).
+
+Інтерфейс той самий, що в db.NoteStore (open/close/execute_write/fetchall), запити — ті самі
+константи SQL_* з db.py: плейсхолдери ? переписуються в $1..$n, а SQLite-специфічні запити
+підміняються з PG_SQL. Груповий коміт не потрібен — паралельні записи розводить сам Postgres.
+asyncpg — опційна залежність: потрібна лише коли задано DB_URL.
+"""
+import os
+import re
+import time
+from functools import lru_cache
+from typing import Any, Optional, Sequence, Tuple
+
+try:
+    import asyncpg
+except ImportError:  # pragma: no cover — без DB_URL не потрібен
+    asyncpg = None
+
+import db
+from logs import log
+from metrics import DB_QUERY_SECONDS
+
+PG_POOL_MIN = int(os.getenv("PG_POOL_MIN", "1"))
+PG_POOL_MAX = int(os.getenv("PG_POOL_MAX", "10"))
+
+# Схема ідемпотентна (IF NOT EXISTS) і створюється під advisory lock, щоб інстанси не зіткнулися на старті.
+# Відповідає SQLite-схемі після db.MIGRATIONS; нові таблиці/колонки додаються сюди ж.
+PG_SCHEMA = [
+    """CREATE TABLE IF NOT EXISTS notes (
+      id BIGSERIAL PRIMARY KEY,
+      user_id BIGINT NOT NULL,
+      chat_id BIGINT NOT NULL,
+      text TEXT NOT NULL,
+      created_at_epoch BIGINT NOT NULL,
+      analysis TEXT
+    )""",
+    "CREATE INDEX IF NOT EXISTS idx_notes_chat_time ON notes(chat_id, created_at_epoch)",
+    "CREATE INDEX IF NOT EXISTS idx_notes_time ON notes(created_at_epoch)",
+    "CREATE INDEX IF NOT EXISTS idx_notes_user_time ON notes(user_id, created_at_epoch)",
+    """CREATE TABLE IF NOT EXISTS analysis_cache (
+      key TEXT PRIMARY KEY,
+      value TEXT NOT NULL,
+      created_at BIGINT NOT NULL,
+      last_used_at BIGINT NOT NULL
+    )""",
+    "CREATE INDEX IF NOT EXISTS idx_analysis_cache_used ON analysis_cache(last_used_at)",
+    """CREATE TABLE IF NOT EXISTS transcripts (
+      file_unique_id TEXT NOT NULL,
+      model TEXT NOT NULL,
+      text TEXT NOT NULL,
+      duration BIGINT NOT NULL DEFAULT 0,
+      file_size BIGINT NOT NULL DEFAULT 0,
+      created_at BIGINT NOT NULL,
+      last_used_at BIGINT NOT NULL,
+      hits BIGINT NOT NULL DEFAULT 0,
+      PRIMARY KEY (file_unique_id, model)
+    )""",
+    "CREATE INDEX IF NOT EXISTS idx_transcripts_used ON transcripts(last_used_at)",
+    """CREATE TABLE IF NOT EXISTS leases (
+      name TEXT PRIMARY KEY,
+      holder TEXT NOT NULL,
+      expires_at BIGINT NOT NULL
+    )""",
+    """CREATE TABLE IF NOT EXISTS report_log (
+      day TEXT NOT NULL,
+      chat_id BIGINT NOT NULL,
+      claim TEXT NOT NULL,
+      status TEXT NOT NULL,
+      claimed_at BIGINT NOT NULL,
+      sent_at BIGINT,
+      PRIMARY KEY (day, chat_id)
+    )""",
+    """CREATE TABLE IF NOT EXISTS updates_seen (
+      update_id BIGINT PRIMARY KEY,
+      claim TEXT NOT NULL,
+      seen_at BIGINT NOT NULL
+    )""",
+    "CREATE INDEX IF NOT EXISTS idx_updates_seen_at ON updates_seen(seen_at)",
+    """CREATE TABLE IF NOT EXISTS rollups (
+      day TEXT NOT NULL,
+      user_id BIGINT NOT NULL,
+      chat_id BIGINT NOT NULL,
+      analysis TEXT NOT NULL,
+      notes BIGINT NOT NULL,
+      updated_at BIGINT NOT NULL,
+      PRIMARY KEY (day, user_id, chat_id)
+    )""",
+    "CREATE INDEX IF NOT EXISTS idx_rollups_chat_day ON rollups(chat_id, day)",
+    "CREATE INDEX IF NOT EXISTS idx_rollups_user_day ON rollups(user_id, day)",
+    """CREATE TABLE IF NOT EXISTS rollup_days (
+      day TEXT PRIMARY KEY,
+      final INTEGER NOT NULL,
+      notes BIGINT NOT NULL,
+      built_at BIGINT NOT NULL
+    )""",
+]
+PG_SCHEMA_LOCK = 0x766F6963  # довільний ключ pg_advisory_xact_lock
+
+# Запити, що в SQLite і Postgres пишуться по-різному
+PG_SQL = {
+    db.SQL_INSERT_NOTE: db.SQL_INSERT_NOTE + " RETURNING id",
+    db.SQL_CACHE_TRIM: (
+        "DELETE FROM analysis_cache WHERE key IN "
+        "(SELECT key FROM analysis_cache ORDER BY last_used_at DESC OFFSET ?)"
+    ),
+    db.SQL_TRANSCRIPT_TRIM: (
+        "DELETE FROM transcripts WHERE (file_unique_id, model) IN "
+        "(SELECT file_unique_id, model FROM transcripts ORDER BY last_used_at DESC OFFSET ?)"
+    ),
+    db.SQL_TRANSCRIPT_STATS: (
+        "SELECT COUNT(*), COALESCE(SUM(hits), 0)::bigint, COALESCE(SUM(hits * duration), 0)::bigint, "
+        "COALESCE(SUM(hits * file_size), 0)::bigint FROM transcripts"
+    ),
+}
+
+@lru_cache(maxsize=1024)
+def to_pg(sql: str) -> str:
+    """SQLite-запит -> Postgres: підміна з PG_SQL і ? -> $1..$n."""
+    sql = PG_SQL.get(sql, sql)
+    counter = iter(range(1, sql.count("?") + 1))
+    return re.sub(r"\?", lambda _: f"${next(counter)}", sql)
+
+
+class PgStore:
+    def __init__(self, url: str, pool_min: int = PG_POOL_MIN, pool_max: int = PG_POOL_MAX):
+        if asyncpg is None:
+            raise RuntimeError("DB_URL задано, але asyncpg не встановлено: pip install asyncpg")
+        self.url = url
+        self._pool_min = pool_min
+        self._pool_max = pool_max
+        self._pool: Optional["asyncpg.Pool"] = None
+
+    async def open(self):
+        self._pool = await asyncpg.create_pool(self.url, min_size=self._pool_min, max_size=self._pool_max)
+        async with self._pool.acquire() as conn:
+            async with conn.transaction():
+                await conn.execute("SELECT pg_advisory_xact_lock($1)", PG_SCHEMA_LOCK)
+                for stmt in PG_SCHEMA:
+                    await conn.execute(stmt)
+        log("DB_OPEN", backend="postgres", pool_max=self._pool_max)
+
+    async def close(self):
+        if self._pool is not None:
+            await self._pool.close()
+            self._pool = None
+
+    async def execute_write(self, sql: str, params: Sequence[Any] = ()) -> int:
+        """Виконати запис; для INSERT ... RETURNING id повертає id (як lastrowid у SQLite), інакше 0."""
+        started = time.perf_counter()
+        q = to_pg(sql)
+        try:
+            async with self._pool.acquire() as conn:
+                if " RETURNING " in q:
+                    return await conn.fetchval(q, *params)
+                await conn.execute(q, *params)
+                return 0
+        finally:
+            DB_QUERY_SECONDS.labels(db._sql_name(sql)).observe(time.perf_counter() - started)
+
+    async def execute_batch(self, statements: Sequence[Tuple[str, Sequence[Any]]]) -> int:
+        """Кілька записів в одній транзакції (як NoteStore.execute_batch)."""
+        started = time.perf_counter()
+        try:
+            async with self._pool.acquire() as conn:
+                async with conn.transaction():
+                    for sql, params in statements:
+                        await conn.execute(to_pg(sql), *params)
+            return 0
+        finally:
+            DB_QUERY_SECONDS.labels(db._sql_name(statements[0][0])).observe(time.perf_counter() - started)
+
+    async def fetchall(self, sql: str, params: Sequence[Any] = ()) -> list:
+        started = time.perf_counter()
+        async with self._pool.acquire() as conn:
+            rows = await conn.fetch(to_pg(sql), *params)
+        DB_QUERY_SECONDS.labels(db._sql_name(sql)).observe(time.perf_counter() - started)
+        return [tuple(r) for r in rows]
@@ -0,0 +1,126 @@
+import asyncio
+import time
+from collections import OrderedDict, deque
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from logs import log, update_id_var
+from metrics import QUEUE_WAIT_SECONDS
+
+
+class QueueFull(Exception):
+    """Черга переповнена довше за put_timeout — вебхук має відповісти не-200, щоб Telegram повторив пізніше."""
+
+
+class UpdateQueue:
+    """
+    Обмежена черга апдейтів Telegram + пул воркерів.
+    Вебхук лише кладе апдейт у чергу й одразу відповідає 200; обробка (завантаження файлу,
+    Whisper, запис у БД) відбувається у воркерах.
+    Дедуп по update_id захищає від повторних доставок Telegram.
+    """
+
+    def __init__(
+        self,
+        handler: Callable[[Any], Awaitable[None]],
+        maxsize: int = 100,
+        workers: int = 4,
+        put_timeout: float = 2.0,
+        dedupe_size: int = 10000,
+    ):
+        self._handler = handler
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize=maxsize)
+        self._workers_n = workers
+        self._put_timeout = put_timeout
+        self._dedupe_size = dedupe_size
+        self._seen: "OrderedDict[int, None]" = OrderedDict()
+        self._tasks: list[asyncio.Task] = []
+        self._waits: deque = deque(maxlen=500)   # останні очікування в черзі, сек
+        self.processed = 0
+        self.failed = 0
+        self.duplicates = 0
+        self.rejected = 0
+
+    async def start(self):
+        for i in range(self._workers_n):
+            self._tasks.append(asyncio.create_task(self._worker(i)))
+
+    async def stop(self, drain_timeout: float = 10.0):
+        """Дочекатися обробки вже прийнятих апдейтів (з таймаутом) і зупинити воркери."""
+        try:
+            await asyncio.wait_for(self._queue.join(), timeout=drain_timeout)
+        except asyncio.TimeoutError:
+            log("INGEST_STOP", undrained=self._queue.qsize())
+        for t in self._tasks:
+            t.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks.clear()
+
+    def _is_duplicate(self, update_id: int) -> bool:
+        if update_id in self._seen:
+            self._seen.move_to_end(update_id)
+            return True
+        return False
+
+    def _remember(self, update_id: int):
+        self._seen[update_id] = None
+        while len(self._seen) > self._dedupe_size:
+            self._seen.popitem(last=False)
+
+    async def submit(self, update_id: int, item: Any) -> bool:
+        """
+        Поставити апдейт у чергу. False — дублікат (вже приймали).
+        Якщо черга повна довше за put_timeout — QueueFull (backpressure).
+        """
+        if self._is_duplicate(update_id):
+            self.duplicates += 1
+            return False
+        # Резервуємо update_id до await, щоб паралельний ретрай не пройшов повз дедуп
+        self._remember(update_id)
+        try:
+            await asyncio.wait_for(
+                self._queue.put((time.monotonic(), update_id, item)),
+                timeout=self._put_timeout,
+            )
+        except asyncio.TimeoutError:
+            self._seen.pop(update_id, None)
+            self.rejected += 1
+            raise QueueFull(f"queue full ({self._queue.maxsize})")
+        return True
+
+    async def _worker(self, n: int):
+        while True:
+            enqueued_at, update_id, item = await self._queue.get()
+            wait = time.monotonic() - enqueued_at
+            self._waits.append(wait)
+            QUEUE_WAIT_SECONDS.observe(wait)
+            # Усі логи обробки цього апдейту (і фонових тасок із нього) несуть update_id
+            token = update_id_var.set(update_id)
+            try:
+                await self._handler(item)
+                self.processed += 1
+            except Exception as e:
+                self.failed += 1
+                log("INGEST_ERROR", worker=n, error=str(e))
+            finally:
+                update_id_var.reset(token)
+                self._queue.task_done()
+
+    def depth(self) -> int:
+        return self._queue.qsize()
+
+    def stats(self) -> Dict[str, Optional[float]]:
+        waits = sorted(self._waits)
+        p50 = waits[len(waits) // 2] if waits else None
+        p99 = waits[min(len(waits) - 1, int(len(waits) * 0.99))] if waits else None
+        return {
+            "depth": self._queue.qsize(),
+            "maxsize": self._queue.maxsize,
+            "workers": self._workers_n,
+            "processed": self.processed,
+            "failed": self.failed,
+            "duplicates": self.duplicates,
+            "rejected": self.rejected,
+            "wait_p50_s": round(p50, 3) if p50 is not None else None,
+            "wait_p99_s": round(p99, 3) if p99 is not None else None,
+            "wait_max_s": round(waits[-1], 3) if waits else None,
+        }
@@ -0,0 +1,25 @@
+import os
+import sys
+import json
+import time
+import contextvars
+from typing import Optional
+
+# Кореляційний id: update_id апдейту Telegram, що зараз обробляється.
+# Воркер черги виставляє його перед feed_update; фонові таски, створені з обробника, успадковують контекст.
+update_id_var: contextvars.ContextVar[Optional[int]] = contextvars.ContextVar("update_id", default=None)
+
+# Події, які не писати (через кому; "*" — вимкнути все, напр. для bench/)
+LOG_SKIP_EVENTS = {e.strip() for e in os.getenv("LOG_SKIP_EVENTS", "").split(",") if e.strip()}
+
+def log(event: str, **fields):
+    """Один рядок JSON у stdout: {"ts", "event", "update_id", ...поля}."""
+    if event in LOG_SKIP_EVENTS or "*" in LOG_SKIP_EVENTS:
+        return
+    record = {"ts": round(time.time(), 3), "event": event}
+    update_id = update_id_var.get()
+    if update_id is not None:
+        record["update_id"] = update_id
+    record.update(fields)
+    sys.stdout.write(json.dumps(record, ensure_ascii=False, default=str) + "\n")
+    sys.stdout.flush()
@@ -1,21 +1,41 @@
 import os
 import os.path
+import re
 import time
 import asyncio
-import httpx
-import aiosqlite
 from collections import defaultdict
-from datetime import datetime, timezone
+from datetime import date, datetime, timedelta, timezone
+from typing import Optional
 
-from fastapi import FastAPI, Request, HTTPException
+from fastapi import FastAPI, Request, HTTPException, Response
 from aiogram import Bot, Dispatcher, Router, types, F
 from aiogram.enums import ParseMode
 from aiogram.types import Update, InlineKeyboardMarkup, InlineKeyboardButton
 from aiogram.client.default import DefaultBotProperties
-
-from util import now_tz, today_bounds_epoch, next_run_at, TZ
-from db import init_db, add_note, get_notes_between, get_last_n, DB_PATH
-from ai import whisper_transcribe, analyze_notes_text, render_daily_summary
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiogram.client.telegram import TelegramAPIServer
+from prometheus_client import generate_latest, CONTENT_TYPE_LATEST
+
+from util import now_tz, today_bounds_epoch, day_bounds_epoch, next_run_at, parse_day, TZ
+from db import (
+    init_db, close_db, add_note, get_notes_between, get_all_notes_between,
+    get_user_notes_between, get_last_n, transcript_get, transcript_put, transcript_evict,
+    transcript_stats, search_notes, lease_holder,
+)
+from ai import transcribe_segments, render_daily_summary, cache_stats, TRANSCRIBE_MODEL
+from summarize import summarize_notes, schedule_note_analysis
+from ingest import UpdateQueue, QueueFull
+from report import ReportStream, send_report
+from rollups import range_analyses, ensure_days, missing_days, backfill, RANGE_SYNC_DAYS
+from search import build_match, parse_find, render_snippet
+from retention import retention_loop, storage_report, RETENTION_DAYS, ARCHIVE_DIR
+from cluster import INSTANCE_ID, INGEST_SHARED_DEDUPE, Lease, claim_update, run_once
+import upstream
+from logs import log
+from metrics import stage, QUEUE_DEPTH, OPENAI_AUDIO_SECONDS
+from clients import start_clients, close_clients, telegram_client, TELEGRAM_API_URL
+from audio import download_audio, split_ogg_opus, AudioTooLarge, MAX_VOICE_BYTES, MAX_VOICE_SECONDS
 
 APP_URL        = os.getenv("APP_URL")             # https://<your-app>.fly.dev
 BOT_TOKEN      = os.getenv("TG_TOKEN")
@@ -23,17 +43,68 @@ OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 GROUP_ID       = int(os.getenv("GROUP_ID", "0"))  # -100123456789 (група/канал)
 WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "secret-path")
 RUN_DAILY      = os.getenv("RUN_DAILY", "1")
+RUN_RETENTION  = os.getenv("RUN_RETENTION", "1")  # архівація/ущільнення notes.db, див. retention.py
+
+# Черга вебхуків: розмір, кількість воркерів, скільки чекати місця перед 503
+INGEST_QUEUE_SIZE  = int(os.getenv("INGEST_QUEUE_SIZE", "100"))
+INGEST_WORKERS     = int(os.getenv("INGEST_WORKERS", "4"))
+INGEST_PUT_TIMEOUT = float(os.getenv("INGEST_PUT_TIMEOUT", "2"))
+
+# Скільки аналізів по користувачах у /summary_all виконувати одночасно
+SUMMARY_CONCURRENCY = int(os.getenv("SUMMARY_CONCURRENCY", "8"))
+
+# Скільки транскрипцій тримати в кеші (найдавніше використані витісняються)
+TRANSCRIPT_CACHE_MAX = int(os.getenv("TRANSCRIPT_CACHE_MAX", "5000"))
+_transcripts_since_evict = 0
+
+# Адміністратори бота (user_id через кому): службові команди на кшталт /backfill_rollups
+ADMIN_IDS = {int(x) for x in os.getenv("ADMIN_IDS", "").replace(" ", "").split(",") if x}
+_admin_tasks: set[asyncio.Task] = set()
+# Фонові звіти за великі діапазони (добудова rollup-ів не тримає воркер черги вебхуків)
+_report_tasks: set[asyncio.Task] = set()
+
+# /find: результатів на сторінку і довжина фрагмента (у токенах)
+FIND_PAGE_SIZE      = int(os.getenv("FIND_PAGE_SIZE", "5"))
+FIND_SNIPPET_TOKENS = int(os.getenv("FIND_SNIPPET_TOKENS", "16"))
 
 if not (APP_URL and BOT_TOKEN and OPENAI_API_KEY and GROUP_ID):
     raise RuntimeError("APP_URL, TG_TOKEN, OPENAI_API_KEY, GROUP_ID є обов'язковими env")
 
-bot = Bot(BOT_TOKEN, default=DefaultBotProperties(parse_mode=ParseMode.MARKDOWN))
+class BotApiMetrics(BaseRequestMiddleware):
+    """Кожен виклик Bot API — окремий етап у метриках: SendMessage -> send_message, GetFile -> get_file."""
+
+    async def __call__(self, make_request, bot, method):
+        name = re.sub(r"(?<!^)(?=[A-Z])", "_", type(method).__name__).lower()
+        with stage(name):
+            return await make_request(bot, method)
+
+bot = Bot(
+    BOT_TOKEN,
+    session=AiohttpSession(api=TelegramAPIServer.from_base(TELEGRAM_API_URL)),
+    default=DefaultBotProperties(parse_mode=ParseMode.MARKDOWN),
+)
+bot.session.middleware(BotApiMetrics())
 dp = Dispatcher()
 router = Router()
 dp.include_router(router)
 
 app = FastAPI()
 
+async def _process_update(update: Update):
+    # Кілька інстансів за балансувальником: ретрай Telegram міг прийти на інший інстанс
+    if INGEST_SHARED_DEDUPE and not await claim_update(update.update_id):
+        log("INGEST_DUP", update_id=update.update_id, shared=True)
+        return
+    await dp.feed_update(bot, update)
+
+ingest = UpdateQueue(
+    _process_update,
+    maxsize=INGEST_QUEUE_SIZE,
+    workers=INGEST_WORKERS,
+    put_timeout=INGEST_PUT_TIMEOUT,
+)
+QUEUE_DEPTH.set_function(ingest.depth)
+
 # ===== Допоміжне =====
 def ts_to_local_str(ts: int) -> str:
     dt_local = datetime.fromtimestamp(ts, tz=timezone.utc).astimezone(TZ)
@@ -42,9 +113,9 @@ def ts_to_local_str(ts: int) -> str:
 async def build_and_send_summary(chat_id: int):
     """Звіт за сьогодні по НОТАТКАХ САМЕ ЦЬОГО ЧАТУ (для кнопки/локальних перевірок)."""
     start_ep, end_ep = today_bounds_epoch()
-    print(f"DB_QUERY build_and_send_summary chat={chat_id} window=[{start_ep},{end_ep})")
-    rows = await get_notes_between(str(chat_id), start_ep, end_ep)
-    print(f"DB_QUERY rows_count={len(rows)}")
+    log("DB_QUERY", fn="build_and_send_summary", chat=chat_id, window=[start_ep, end_ep])
+    rows = await get_notes_between(chat_id, start_ep, end_ep)
+    log("DB_QUERY", rows_count=len(rows))
 
     today_str = now_tz().date().isoformat()
 
@@ -52,38 +123,29 @@ async def build_and_send_summary(chat_id: int):
         await bot.send_message(chat_id, f"**Звіт за {today_str}**: без нових нотаток.")
         return
 
-    texts, authors = [], set()
-    for _, user_id, _, text, ts in rows:
+    notes, texts, authors = [], [], set()
+    for note_id, user_id, _, text, ts in rows:
         authors.add(user_id)
+        notes.append((note_id, text))
         texts.append(text)
 
-    concat = "\n".join(texts)
-    author_str = "кілька учасників" if len(authors) > 1 else (next(iter(authors)) if authors else "—")
+    author_str = "кілька учасників" if len(authors) > 1 else (str(next(iter(authors))) if authors else "—")
     try:
-        analysis = await analyze_notes_text(concat)
+        analysis = await summarize_notes(notes)
         rendered = render_daily_summary(today_str, author_str, analysis)
-        await bot.send_message(chat_id, rendered)
+        await send_report(bot, chat_id, [rendered], filename=f"summary_{today_str}.md")
     except Exception as e:
-        print(f"ANALYZE_ERROR(chat): {e}")
+        log("ANALYZE_ERROR", scope="chat", chat=chat_id, error=str(e))
         bullet = "\n".join([f"- {t}" for t in texts])
-        await bot.send_message(
-            chat_id,
+        await send_report(bot, chat_id, [
             f"**Звіт за {today_str} ({author_str})**\n"
             f"_Аналіз тимчасово недоступний; нижче сирі нотатки:_\n{bullet}"
-        )
+        ], filename=f"notes_{today_str}.md")
 
 async def fetch_all_notes_today():
-    """Усі нотатки за сьогодні без фільтра по чату. Повертає список (user_id, chat_id, text, ts)."""
+    """Усі нотатки за сьогодні без фільтра по чату. Повертає список (id, user_id, chat_id, text, ts)."""
     start_ep, end_ep = today_bounds_epoch()
-    async with aiosqlite.connect(DB_PATH) as db:
-        cur = await db.execute(
-            "SELECT user_id, chat_id, text, created_at_epoch "
-            "FROM notes WHERE created_at_epoch >= ? AND created_at_epoch < ? "
-            "ORDER BY created_at_epoch ASC",
-            (start_ep, end_ep)
-        )
-        rows = await cur.fetchall()
-    return rows  # [(user_id, chat_id, text, ts), ...]
+    return await get_all_notes_between(start_ep, end_ep)  # [(id, user_id, chat_id, text, ts), ...]
 
 async def build_and_send_summary_all(target_chat_id: int):
     """
@@ -92,89 +154,237 @@ async def build_and_send_summary_all(target_chat_id: int):
     """
     today_str = now_tz().date().isoformat()
     rows = await fetch_all_notes_today()
-    print(f"DB_QUERY summary_all rows={len(rows)}")
+    log("DB_QUERY", fn="summary_all", rows=len(rows))
 
     if not rows:
         await bot.send_message(target_chat_id, f"**Зведений звіт за {today_str}**: сьогодні ще немає нотаток.")
         return
 
     # Групуємо по користувачу
-    by_user: dict[str, list[str]] = defaultdict(list)
-    for user_id, chat_id, text, ts in rows:
-        by_user[user_id].append(text)
-
-    sections = []
-    for user_id, texts in by_user.items():
-        concat = "\n".join(texts)
-        try:
-            analysis = await analyze_notes_text(concat)
-            sections.append(render_daily_summary(today_str, f"user:{user_id}", analysis))
-        except Exception as e:
-            print(f"ANALYZE_ERROR(user={user_id}): {e}")
-            bullet = "\n".join([f"- {t}" for t in texts])
-            sections.append(f"**Звіт за {today_str} (user:{user_id})**\n_Аналіз недоступний; сирі нотатки:_\n{bullet}")
+    by_user: dict[int, list[tuple[int, str]]] = defaultdict(list)
+    for note_id, user_id, chat_id, text, ts in rows:
+        by_user[user_id].append((note_id, text))
 
-    final = "🧾 *Зведений звіт за сьогодні (по користувачах):*\n\n" + "\n\n".join(sections)
-    await bot.send_message(target_chat_id, final)
+    # Аналізи по користувачах паралельно (під SUMMARY_CONCURRENCY і лімітами OpenAI);
+    # секції відправляються в порядку by_user, щойно готові вона і всі попередні.
+    sem = asyncio.Semaphore(SUMMARY_CONCURRENCY)
 
-async def build_and_send_summary_me(target_chat_id: int, user_id: str):
+    async def user_section(user_id: int, notes: list[tuple[int, str]]) -> str:
+        async with sem:
+            try:
+                analysis = await summarize_notes(notes)
+                return render_daily_summary(today_str, f"user:{user_id}", analysis)
+            except Exception as e:
+                log("ANALYZE_ERROR", scope="user", user=user_id, error=str(e))
+                bullet = "\n".join([f"- {t}" for _, t in notes])
+                return f"**Звіт за {today_str} (user:{user_id})**\n_Аналіз недоступний; сирі нотатки:_\n{bullet}"
+
+    tasks = [asyncio.create_task(user_section(u, t)) for u, t in by_user.items()]
+    try:
+        async with ReportStream(bot, target_chat_id, filename=f"summary_{today_str}.md") as rs:
+            header = "🧾 *Зведений звіт за сьогодні (по користувачах):*\n\n"
+            for i, task in enumerate(tasks):
+                section = await task
+                await rs.add(header + section if i == 0 else section)
+    finally:
+        for task in tasks:
+            task.cancel()
+
+async def build_and_send_summary_me(target_chat_id: int, user_id: int):
     """Звіт за сьогодні лише для конкретного користувача (з усіх чатів)."""
     today_str = now_tz().date().isoformat()
     start_ep, end_ep = today_bounds_epoch()
-    async with aiosqlite.connect(DB_PATH) as db:
-        cur = await db.execute(
-            "SELECT text, created_at_epoch FROM notes "
-            "WHERE user_id=? AND created_at_epoch >= ? AND created_at_epoch < ? "
-            "ORDER BY created_at_epoch ASC",
-            (user_id, start_ep, end_ep)
-        )
-        rows = await cur.fetchall()  # [(text, ts), ...]
+    rows = await get_user_notes_between(user_id, start_ep, end_ep)  # [(id, text, ts), ...]
 
     if not rows:
         await bot.send_message(target_chat_id, f"**Звіт за {today_str} (ви)**: без нових нотаток.")
         return
 
-    texts = [r[0] for r in rows]
-    concat = "\n".join(texts)
+    texts = [r[1] for r in rows]
     try:
-        analysis = await analyze_notes_text(concat)
+        analysis = await summarize_notes([(r[0], r[1]) for r in rows])
         rendered = render_daily_summary(today_str, "ви", analysis)
-        await bot.send_message(target_chat_id, rendered)
+        await send_report(bot, target_chat_id, [rendered], filename=f"summary_me_{today_str}.md")
     except Exception as e:
-        print(f"ANALYZE_ERROR(me): {e}")
+        log("ANALYZE_ERROR", scope="me", user=user_id, error=str(e))
         bullet = "\n".join([f"- {t}" for t in texts])
-        await bot.send_message(
-            target_chat_id,
+        await send_report(bot, target_chat_id, [
             f"**Звіт за {today_str} (ви)**\n_Аналіз недоступний; сирі нотатки:_\n{bullet}"
-        )
+        ], filename=f"notes_me_{today_str}.md")
 
-# ===== Хендлери =====
-@router.message(F.voice)
-async def handle_voice(message: types.Message):
-    # 1) забрати файл із Telegram
-    f = await bot.get_file(message.voice.file_id)
-    file_url = f"https://api.telegram.org/file/bot{BOT_TOKEN}/{f.file_path}"
-    async with httpx.AsyncClient(timeout=90) as client:
-        r = await client.get(file_url)
-        r.raise_for_status()
-        file_bytes = r.content
+async def build_and_send_range(target_chat_id: int, first: date, last: date, chat_id: int | None = None,
+                              user_id: int | None = None, reply_to: int | None = None, on_progress=None):
+    """
+    Звіт за діапазон днів із денних rollup-ів: по користувачах поточного чату (chat_id)
+    або для одного користувача з усіх чатів (user_id).
+    """
+    period = first.isoformat() if first == last else f"{first.isoformat()} — {last.isoformat()}"
+    analyses = await range_analyses(first, last, chat_id=chat_id, user_id=user_id, on_progress=on_progress)
+    log("RANGE_SUMMARY", first=first.isoformat(), last=last.isoformat(), chat=chat_id, user=user_id,
+        users=len(analyses))
+    if not analyses:
+        await send_report(bot, target_chat_id, [f"**Звіт за {period}**: без нотаток."], reply_to=reply_to)
+        return
+    if user_id is not None:
+        sections = [render_daily_summary(period, "ви", analyses[user_id])]
+    else:
+        sections = [f"🗓 *Звіт за {period} (по користувачах):*"] + [
+            render_daily_summary(period, f"user:{uid}", a) for uid, a in analyses.items()
+        ]
+    await send_report(bot, target_chat_id, sections, filename=f"summary_{first}_{last}.md", reply_to=reply_to)
+
+async def reply_range_report(message: types.Message, first: date, last: date, chat_id: int | None = None,
+                             user_id: int | None = None):
+    """
+    Звіт за діапазон у відповідь на команду. Якщо недобудованих днів більше за RANGE_SYNC_DAYS —
+    збирається у фоні з прогресом (як /backfill_rollups); будь-яка помилка — повідомлення користувачу.
+    """
+    async def build(on_progress=None):
+        await build_and_send_range(message.chat.id, first, last, chat_id=chat_id, user_id=user_id,
+                                   reply_to=message.message_id, on_progress=on_progress)
 
-    # 2) транскрипція через whisper-1
-    text = await whisper_transcribe(file_bytes, filename=os.path.basename(f.file_path), language="uk")
+    try:
+        missing = await missing_days(first, last)
+        if len(missing) <= RANGE_SYNC_DAYS:
+            await build()
+            return
+    except ValueError as e:
+        await message.reply(str(e))
+        return
+    except Exception as e:
+        log("RANGE_SUMMARY_ERROR", first=first.isoformat(), last=last.isoformat(), chat=chat_id, user=user_id,
+            error=str(e))
+        await message.reply("⚠️ Не вдалося зібрати звіт за період, спробуйте пізніше.")
+        return
 
+    progress = await message.reply(f"⏳ Збираю звіт: {len(missing)} днів без rollup-ів…")
+    on_progress = progress_editor(progress, 3, "⏳ Rollup-и: {done}/{total} днів")
+
+    async def run():
+        try:
+            await build(on_progress)
+            await progress.edit_text("✅ Звіт зібрано")
+        except Exception as e:
+            log("RANGE_SUMMARY_ERROR", first=first.isoformat(), last=last.isoformat(), chat=chat_id,
+                user=user_id, error=str(e))
+            await progress.edit_text("⚠️ Не вдалося зібрати звіт за період, спробуйте пізніше.")
+
+    task = asyncio.create_task(run())
+    _report_tasks.add(task)
+    task.add_done_callback(_report_tasks.discard)
+
+def parse_range_args(text: str) -> tuple[date, date]:
+    """'/summary_range 2024-05-01 2024-05-31' (або одна дата) -> (first, last)."""
+    args = text.split()[1:]
+    if not 1 <= len(args) <= 2:
+        raise ValueError("вкажіть одну або дві дати")
+    first = parse_day(args[0])
+    last = parse_day(args[-1])
+    if last < first:
+        first, last = last, first
+    return first, last
+
+async def maybe_evict_transcripts():
+    global _transcripts_since_evict
+    _transcripts_since_evict += 1
+    if _transcripts_since_evict >= 50:
+        _transcripts_since_evict = 0
+        await transcript_evict(TRANSCRIPT_CACHE_MAX)
+
+def progress_editor(progress_msg: types.Message, min_interval: float = 1.5,
+                    template: str = "⏳ Транскрибую… {done}/{total}"):
+    """
+    Колбек прогресу (сегментна транскрипція, rollup-и): редагує повідомлення за шаблоном template
+    не частіше за min_interval.
+    """
+    last = 0.0
+
+    async def on_progress(done: int, total: int):
+        nonlocal last
+        now = time.monotonic()
+        if done < total and now - last < min_interval:
+            return
+        last = now
+        await progress_msg.edit_text(template.format(done=done, total=total))
+
+    return on_progress
+
+async def save_and_confirm(message: types.Message, chat_id: int, user_id: int, text: str,
+                           progress_msg: types.Message | None = None):
+    """Зберегти транскрипцію як нотатку і відповісти прев'ю + кнопкою звіту (або відредагувати прогрес)."""
     # 3) зберегти як epoch UTC
     epoch_now = int(time.time())
-    chat_id_str = str(message.chat.id)
-    user_id_str = str(message.from_user.id)
-    await add_note(user_id_str, chat_id_str, text, epoch_now)
-    print(f"DB_SAVE chat={chat_id_str} user={user_id_str} ts={epoch_now}")
+    with stage("add_note"):
+        note_id = await add_note(user_id, chat_id, text, epoch_now)
+    log("DB_SAVE", chat=chat_id, user=user_id, ts=epoch_now, id=note_id)
+    schedule_note_analysis(note_id, text)
 
     # 4) підтвердження + кнопка «Сформувати звіт» (локальний для цього чату)
     preview = (text[:200] + "…") if len(text) > 200 else text
     kb = InlineKeyboardMarkup(inline_keyboard=[
         [InlineKeyboardButton(text="📝 Сформувати звіт", callback_data="make_summary")]
     ])
-    await message.reply(f"✅ Транскрибовано:\n_{preview}_", reply_markup=kb)
+    if progress_msg is not None:
+        await progress_msg.edit_text(f"✅ Транскрибовано:\n_{preview}_", reply_markup=kb)
+    else:
+        await message.reply(f"✅ Транскрибовано:\n_{preview}_", reply_markup=kb)
+
+# ===== Хендлери =====
+@router.message(F.voice)
+async def handle_voice(message: types.Message):
+    voice = message.voice
+    chat_id = message.chat.id
+    user_id = message.from_user.id
+
+    # 0) те саме голосове (переслане/повторне) вже транскрибували — без завантаження і Whisper
+    now = int(time.time())
+    text = await transcript_get(voice.file_unique_id, TRANSCRIBE_MODEL, now)
+    if text is not None:
+        log("TRANSCRIPT_HIT", file=voice.file_unique_id, duration=voice.duration)
+        await save_and_confirm(message, chat_id, user_id, text)
+        return
+
+    # 0.1) відсікти завеликі голосові ще до завантаження
+    if (voice.file_size or 0) > MAX_VOICE_BYTES or (voice.duration or 0) > MAX_VOICE_SECONDS:
+        await message.reply(
+            f"⚠️ Голосове завелике ({voice.duration} с, {(voice.file_size or 0) // 1024} КБ). "
+            f"Ліміт: {MAX_VOICE_SECONDS} с / {MAX_VOICE_BYTES // (1024 * 1024)} МБ."
+        )
+        return
+
+    # 1) забрати файл із Telegram (потоково: малі — у пам'ять, великі — у тимчасовий файл)
+    f = await bot.get_file(voice.file_id)
+    file_url = f"{TELEGRAM_API_URL}/file/bot{BOT_TOKEN}/{f.file_path}"
+    try:
+        with stage("download"):
+            audio = await download_audio(telegram_client(), file_url)
+    except AudioTooLarge:
+        await message.reply(f"⚠️ Голосове більше за {MAX_VOICE_BYTES // (1024 * 1024)} МБ — пропускаю.")
+        return
+
+    # 2) транскрипція через whisper-1 (multipart читає файл частинами, без копії в пам'яті).
+    #    Довгі голосові ріжемо на сегменти з перекриттям і транскрибуємо паралельно.
+    progress_msg = None
+    with audio:
+        file_size = audio.size
+        segments = await asyncio.to_thread(split_ogg_opus, audio)
+        try:
+            on_progress = None
+            if len(segments) > 1:
+                progress_msg = await message.reply(f"⏳ Транскрибую… 0/{len(segments)}")
+                on_progress = progress_editor(progress_msg)
+            text = await transcribe_segments(
+                segments, filename=os.path.basename(f.file_path), language="uk", on_progress=on_progress
+            )
+        finally:
+            for seg in segments:
+                if seg is not audio:
+                    seg.close()
+    OPENAI_AUDIO_SECONDS.inc(voice.duration or 0)
+    await transcript_put(voice.file_unique_id, TRANSCRIBE_MODEL, text, voice.duration or 0, file_size, now)
+    await maybe_evict_transcripts()
+
+    await save_and_confirm(message, chat_id, user_id, text, progress_msg)
 
 @router.message(F.text == "/summary")
 async def cmd_summary(message: types.Message):
@@ -188,13 +398,175 @@ async def cmd_summary_all(message: types.Message):
 
 @router.message(F.text == "/summary_me")
 async def cmd_summary_me(message: types.Message):
-    await build_and_send_summary_me(message.chat.id, str(message.from_user.id))
+    await build_and_send_summary_me(message.chat.id, message.from_user.id)
+
+@router.message(F.text == "/summary_week")
+async def cmd_summary_week(message: types.Message):
+    """Останні 7 днів (включно з сьогодні) по користувачах цього чату — з денних rollup-ів."""
+    last = now_tz().date()
+    await reply_range_report(message, last - timedelta(days=6), last, chat_id=message.chat.id)
+
+@router.message(F.text == "/summary_week_me")
+async def cmd_summary_week_me(message: types.Message):
+    last = now_tz().date()
+    await reply_range_report(message, last - timedelta(days=6), last, user_id=message.from_user.id)
+
+RANGE_USAGE = "Формат: `{cmd} YYYY-MM-DD YYYY-MM-DD` (або DD.MM.YYYY; одна дата — один день)"
+
+@router.message(F.text.regexp(r"^/summary_range(\s|$)"))
+async def cmd_summary_range(message: types.Message):
+    try:
+        first, last = parse_range_args(message.text)
+    except ValueError as e:
+        await message.reply(f"{e}\n{RANGE_USAGE.format(cmd='/summary_range')}")
+        return
+    await reply_range_report(message, first, last, chat_id=message.chat.id)
+
+@router.message(F.text.regexp(r"^/summary_range_me(\s|$)"))
+async def cmd_summary_range_me(message: types.Message):
+    try:
+        first, last = parse_range_args(message.text)
+    except ValueError as e:
+        await message.reply(f"{e}\n{RANGE_USAGE.format(cmd='/summary_range_me')}")
+        return
+    await reply_range_report(message, first, last, user_id=message.from_user.id)
+
+@router.message(F.text.regexp(r"^/backfill_rollups(\s|$)"))
+async def cmd_backfill_rollups(message: types.Message):
+    """Адмін: зібрати денні rollup-и для історії (/backfill_rollups [from] [to] [force])."""
+    if message.from_user.id not in ADMIN_IDS:
+        await message.reply("Команда доступна лише адміністраторам (ADMIN_IDS).")
+        return
+    args = message.text.split()[1:]
+    force = "force" in args
+    dates = [a for a in args if a != "force"]
+    try:
+        first = parse_day(dates[0]) if dates else None
+        last = parse_day(dates[1]) if len(dates) > 1 else None
+    except ValueError as e:
+        await message.reply(str(e))
+        return
+    progress = await message.reply("⏳ Збираю денні rollup-и…")
+    on_progress = progress_editor(progress, 3, "⏳ Rollup-и: {done}/{total} днів")
+
+    async def run():
+        try:
+            res = await backfill(first, last, force=force, on_progress=on_progress)
+            await progress.edit_text(
+                f"✅ Rollup-и: днів у діапазоні {res['days']}, зібрано {res['built']}, нотаток {res['notes']}"
+            )
+        except Exception as e:
+            log("ROLLUP_BACKFILL_ERROR", error=str(e))
+            await progress.edit_text(f"⚠️ Backfill не вдався: {e}")
+
+    # Довгий backfill не тримає воркер черги вебхуків
+    task = asyncio.create_task(run())
+    _admin_tasks.add(task)
+    task.add_done_callback(_admin_tasks.discard)
+
+def _mb(n: int) -> str:
+    return f"{n / (1024 * 1024):.1f} MB"
+
+@router.message(F.text == "/storage")
+async def cmd_storage(message: types.Message):
+    """Адмін: розміри таблиць і файлів БД, вільне місце, архів і останній прогін retention."""
+    if message.from_user.id not in ADMIN_IDS:
+        await message.reply("Команда доступна лише адміністраторам (ADMIN_IDS).")
+        return
+    try:
+        st = await storage_report()
+    except RuntimeError as e:
+        await message.reply(str(e))
+        return
+    page = st["page_size"]
+    lines = [
+        f"db={_mb(st['files']['db'])} wal={_mb(st['files']['wal'])} notes={st['notes']}",
+        f"pages={st['page_count']} free={st['freelist_count']} ({_mb(st['freelist_count'] * page)}) "
+        f"auto_vacuum={('none', 'full', 'incremental')[st['auto_vacuum']]}",
+    ]
+    lines += [f"  {name:<16} {_mb(size):>10}" for name, size in st["tables"][:8]]
+    arch = st["archive"]
+    lines.append(
+        f"archive: {arch['files']} днів, {_mb(arch['bytes'])}"
+        + (f" [{arch['first']} … {arch['last']}]" if arch["files"] else "")
+        + f" retention_days={RETENTION_DAYS or 'off'} dir={ARCHIVE_DIR}"
+    )
+    run = st["last_run"]
+    if run:
+        lines.append(
+            f"last run {ts_to_local_str(run['at'])}: archived {run['notes']} нотаток за {run['days']} днів, "
+            f"vacuum {_mb(run['vacuum_freed_bytes'])}, файли -{_mb(run['files_shrunk_bytes'])}, "
+            f"checkpoint busy={run['checkpoint_busy']} ({run['seconds']} c)"
+        )
+    else:
+        lines.append("last run: ще не було на цьому інстансі")
+    await message.reply("```\n" + "\n".join(lines) + "\n```", parse_mode="Markdown")
+
+FIND_USAGE = (
+    "Формат: `/find [me] [from:YYYY-MM-DD] [to:YYYY-MM-DD] слова \"фраза\"`\n"
+    "me — ваші нотатки з усіх чатів; без нього — нотатки цього чату."
+)
+
+async def render_find_page(command_text: str, chat_id: int, user_id: int, offset: int):
+    """Сторінка результатів /find -> (текст, клавіатура); запит щоразу береться з тексту команди."""
+    q = parse_find(command_text)
+    match = build_match(q.text)
+    if not match:
+        return FIND_USAGE, None
+    start_ep = day_bounds_epoch(q.first)[0] if q.first else 0
+    end_ep = day_bounds_epoch(q.last)[1] if q.last else 2 ** 62
+    with stage("search_notes"):
+        rows = await search_notes(
+            match, chat_id=None if q.mine else chat_id, user_id=user_id if q.mine else None,
+            start_epoch=start_ep, end_epoch=end_ep, limit=FIND_PAGE_SIZE + 1, offset=offset,
+            snippet_tokens=FIND_SNIPPET_TOKENS,
+        )
+    has_next = len(rows) > FIND_PAGE_SIZE
+    rows = rows[:FIND_PAGE_SIZE]
+    page = offset // FIND_PAGE_SIZE + 1
+    if not rows:
+        return ("🔎 Нічого не знайдено." if offset == 0 else "🔎 Більше результатів немає."), None
+    lines = [f"🔎 Результати (стор. {page}):"]
+    for note_id, uid, cid, ts, snippet in rows:
+        where = f" chat:{cid}" if q.mine else ""
+        lines.append(f"• {ts_to_local_str(ts)} user:{uid}{where} #{note_id}\n{render_snippet(snippet)}")
+    buttons = []
+    if offset > 0:
+        buttons.append(InlineKeyboardButton(text="◀️", callback_data=f"find:{max(0, offset - FIND_PAGE_SIZE)}"))
+    if has_next:
+        buttons.append(InlineKeyboardButton(text="▶️", callback_data=f"find:{offset + FIND_PAGE_SIZE}"))
+    kb = InlineKeyboardMarkup(inline_keyboard=[buttons]) if buttons else None
+    return "\n\n".join(lines), kb
+
+@router.message(F.text.regexp(r"^/find(\s|$)"))
+async def cmd_find(message: types.Message):
+    """Повнотекстовий пошук по нотатках (FTS5) з фрагментами й сторінками."""
+    try:
+        text, kb = await render_find_page(message.text, message.chat.id, message.from_user.id, 0)
+    except ValueError as e:
+        text, kb = f"{e}\n{FIND_USAGE}", None
+    except RuntimeError as e:
+        # Бекенд без повнотекстового пошуку (Postgres)
+        text, kb = str(e), None
+    await message.reply(text, reply_markup=kb)
+
+@router.callback_query(F.data.startswith("find:"))
+async def on_find_page(cb: types.CallbackQuery):
+    # Стан сторінок не зберігаємо: запит — у повідомленні з /find, на яке відповів бот
+    original = cb.message.reply_to_message if cb.message else None
+    if original is None or not original.text:
+        await cb.answer("Запит недоступний — повторіть /find", show_alert=True)
+        return
+    await cb.answer()
+    offset = int(cb.data.split(":", 1)[1])
+    text, kb = await render_find_page(original.text, cb.message.chat.id, cb.from_user.id, offset)
+    await cb.message.edit_text(text, reply_markup=kb)
 
 @router.message(F.text == "/summary_raw")
 async def cmd_summary_raw(message: types.Message):
     """Швидкий сирий звіт по поточному чату без GPT — для перевірки збереження нотаток."""
     start_ep, end_ep = today_bounds_epoch()
-    rows = await get_notes_between(str(message.chat.id), start_ep, end_ep)
+    rows = await get_notes_between(message.chat.id, start_ep, end_ep)
     today_str = now_tz().date().isoformat()
     if not rows:
         await message.reply(f"**Сирий звіт за {today_str}**: без нових нотаток.")
@@ -202,27 +574,34 @@ async def cmd_summary_raw(message: types.Message):
     lines = [f"**Сирий звіт за {today_str}:**"]
     for _, user_id, _, text, ts in rows:
         lines.append(f"- {ts_to_local_str(ts)}: {text}")
-    await message.reply("\n".join(lines))
+    await send_report(bot, message.chat.id, ["\n".join(lines)],
+                      filename=f"raw_{today_str}.md", reply_to=message.message_id)
 
 @router.message(F.text == "/today")
 async def cmd_today(message: types.Message):
     start_ep, end_ep = today_bounds_epoch()
-    rows = await get_notes_between(str(message.chat.id), start_ep, end_ep)
+    rows = await get_notes_between(message.chat.id, start_ep, end_ep)
     if not rows:
         await message.reply("Сьогодні ще нема нотаток.")
         return
-    formatted = "\n\n".join([f"🕘 {ts_to_local_str(r[4])}:\n{r[3]}" for r in rows])
-    await message.reply(f"Нотатки за сьогодні:\n\n{formatted}")
+    sections = ["Нотатки за сьогодні:"] + [f"🕘 {ts_to_local_str(r[4])}:\n{r[3]}" for r in rows]
+    await send_report(bot, message.chat.id, sections,
+                      filename=f"today_{now_tz().date().isoformat()}.md", reply_to=message.message_id)
 
 @router.message(F.text == "/diag")
 async def cmd_diag(message: types.Message):
     """Діагностика вікна доби + останні нотатки поточного чату."""
     start_ep, end_ep = today_bounds_epoch()
-    rows = await get_notes_between(str(message.chat.id), start_ep, end_ep)
+    rows = await get_notes_between(message.chat.id, start_ep, end_ep)
     sample = rows[-5:] if rows else []
     lines = [
         f"chat_id={message.chat.id}",
         f"window: [{start_ep}, {end_ep})  (count={len(rows)})",
+        "queue: " + " ".join(f"{k}={v}" for k, v in ingest.stats().items()),
+        "upstream: " + " ".join(f"{k}={v}" for k, v in upstream.stats().items()),
+        "analysis_cache: " + " ".join(f"{k}={v}" for k, v in cache_stats.items()),
+        "transcript_cache: " + " ".join(f"{k}={v}" for k, v in (await transcript_stats()).items()),
+        f"instance: {INSTANCE_ID} daily_leader={await lease_holder('daily_summary', int(time.time()))}",
     ]
     for _, user_id, _, text, ts in sample:
         short = text.replace("\n", " ")
@@ -254,19 +633,55 @@ async def on_make_summary(cb: types.CallbackQuery):
     await build_and_send_summary(chat_id)
 
 # ===== Вебхук / старт =====
+WEBHOOK_ALLOWED_UPDATES = ["message", "callback_query"]
+
 async def set_webhook():
-    url = f"https://api.telegram.org/bot{BOT_TOKEN}/setWebhook"
+    """
+    Встановити вебхук: лише власник оренди set_webhook і лише якщо він відрізняється від поточного
+    (getWebhookInfo) — кілька інстансів на старті не влаштовують гонку setWebhook.
+    """
+    base = f"{TELEGRAM_API_URL}/bot{BOT_TOKEN}"
     target = f"{APP_URL}/{WEBHOOK_SECRET}"
-    async with httpx.AsyncClient(timeout=30) as client:
-        r = await client.post(url, json={"url": target, "allowed_updates": ["message", "callback_query"]})
+    async with Lease("set_webhook", ttl=30).hold() as held:
+        if not held:
+            log("WEBHOOK_SKIP", reason="not_leader", instance=INSTANCE_ID)
+            return
+        r = await telegram_client().get(f"{base}/getWebhookInfo")
         r.raise_for_status()
+        info = r.json().get("result") or {}
+        if info.get("url") == target and sorted(info.get("allowed_updates") or []) == sorted(WEBHOOK_ALLOWED_UPDATES):
+            log("WEBHOOK_OK", instance=INSTANCE_ID)
+            return
+        r = await telegram_client().post(
+            f"{base}/setWebhook", json={"url": target, "allowed_updates": WEBHOOK_ALLOWED_UPDATES}
+        )
+        r.raise_for_status()
+        log("WEBHOOK_SET", instance=INSTANCE_ID)
 
 @app.on_event("startup")
 async def on_startup():
     await init_db()
+    await start_clients()
+    await ingest.start()
     await set_webhook()
     if RUN_DAILY == "1":
         asyncio.create_task(daily_summary_loop())
+    if RUN_RETENTION == "1":
+        asyncio.create_task(retention_loop())
+
+@app.on_event("shutdown")
+async def on_shutdown():
+    await ingest.stop()
+    await close_clients()
+    await close_db()
+
+@app.get("/metrics")
+async def metrics_endpoint():
+    return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
+
+@app.get("/healthz")
+async def healthz():
+    return {"ok": True, "queue": ingest.stats()}
 
 @app.post("/{token_path}")
 async def telegram_webhook(token_path: str, request: Request):
@@ -274,17 +689,48 @@ async def telegram_webhook(token_path: str, request: Request):
         raise HTTPException(status_code=404)
     data = await request.json()
     update = Update.model_validate(data)
-    await dp.feed_update(bot, update)
+    # Відповідаємо одразу; обробка — у воркерах черги.
+    # Повна черга -> 503, Telegram повторить доставку пізніше (backpressure).
+    try:
+        accepted = await ingest.submit(update.update_id, update)
+    except QueueFull:
+        log("INGEST_REJECT", update_id=update.update_id, depth=ingest.depth())
+        raise HTTPException(status_code=503, detail="busy")
+    if not accepted:
+        log("INGEST_DUP", update_id=update.update_id)
     return {"ok": True}
 
+async def run_daily_job(day: Optional[str] = None) -> bool:
+    """
+    Зведення дня в GROUP_ID рівно раз на всі інстанси: виконує лише власник оренди daily_summary,
+    а журнал report_log (day, chat) не дає повторити вже відправлений звіт (рестарт, втрата оренди).
+    """
+    day = day or now_tz().date().isoformat()
+    async with Lease("daily_summary").hold() as held:
+        if not held:
+            log("DAILY_SKIP", day=day, reason="not_leader", instance=INSTANCE_ID)
+            return False
+        sent = await run_once(day, GROUP_ID, lambda: build_and_send_summary_all(GROUP_ID))
+        if sent:
+            log("DAILY_SENT", day=day, instance=INSTANCE_ID)
+        else:
+            log("DAILY_SKIP", day=day, reason="already_sent", instance=INSTANCE_ID)
+        # Денні rollup-и для звітів за тиждень/діапазон: вчора — остаточно, сьогодні — попередньо
+        try:
+            d = date.fromisoformat(day)
+            await ensure_days(d - timedelta(days=1), d)
+        except Exception as e:
+            log("ROLLUP_ERROR", day=day, error=str(e))
+        return sent
+
 async def daily_summary_loop():
-    # Щодня о 20:00 Europe/Kyiv -> зведений звіт по всіх користувачах у GROUP_ID
+    # Щодня о 20:00 Europe/Kyiv -> зведений звіт по всіх користувачах у GROUP_ID (див. run_daily_job)
     while True:
         target = next_run_at(20, 0, 0)
         delay = (target - now_tz()).total_seconds()
         await asyncio.sleep(delay)
         try:
-            await build_and_send_summary_all(GROUP_ID)
+            await run_daily_job(target.date().isoformat())
         except Exception as e:
             try:
                 await bot.send_message(GROUP_ID, f"⚠️ Помилка генерації зведеного звіту: {e}")
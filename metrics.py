@@ -0,0 +1,69 @@
+import time
+import functools
+import asyncio
+from contextlib import contextmanager
+
+from prometheus_client import Counter, Gauge, Histogram
+
+from logs import log
+
+# Етапи голосового конвеєра і зведень: get_file, download, whisper_transcribe, add_note,
+# analyze_notes_text, render_daily_summary, send_message (+ інші виклики Bot API)
+STAGE_SECONDS = Histogram(
+    "voicebot_stage_seconds", "Тривалість етапу обробки", ["stage"],
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120),
+)
+STAGE_ERRORS = Counter("voicebot_stage_errors_total", "Помилки етапів", ["stage"])
+
+OPENAI_TOKENS = Counter("voicebot_openai_tokens_total", "Токени chat/completions", ["kind"])
+OPENAI_AUDIO_SECONDS = Counter("voicebot_openai_audio_seconds_total", "Секунди аудіо, відправлені у Whisper")
+
+DB_QUERY_SECONDS = Histogram(
+    "voicebot_db_query_seconds", "Тривалість запитів SQLite", ["query"],
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1),
+)
+
+# Retention (retention.py): архівовані нотатки, повернуте місце, розмір файлів БД після обслуговування
+RETENTION_ARCHIVED_NOTES = Counter("voicebot_retention_archived_notes_total", "Нотаток перенесено в архів")
+DB_RECLAIMED_BYTES = Counter("voicebot_db_reclaimed_bytes_total", "Байт повернуто incremental_vacuum")
+DB_FILE_BYTES = Gauge("voicebot_db_file_bytes", "Розмір файлів SQLite", ["file"])
+
+QUEUE_DEPTH = Gauge("voicebot_webhook_queue_depth", "Апдейтів у черзі вебхука")
+QUEUE_WAIT_SECONDS = Histogram(
+    "voicebot_webhook_queue_wait_seconds", "Час апдейту в черзі до початку обробки",
+    buckets=(0.001, 0.01, 0.05, 0.1, 0.5, 1, 2.5, 5, 10, 30, 60),
+)
+
+
+@contextmanager
+def stage(name: str, **fields):
+    """Заміряти етап: histogram + JSON-лог stage з тривалістю (update_id додає logs.log)."""
+    started = time.perf_counter()
+    ok = True
+    try:
+        yield
+    except BaseException:
+        ok = False
+        STAGE_ERRORS.labels(name).inc()
+        raise
+    finally:
+        elapsed = time.perf_counter() - started
+        STAGE_SECONDS.labels(name).observe(elapsed)
+        log("STAGE", stage=name, seconds=round(elapsed, 4), ok=ok, **fields)
+
+
+def timed(name: str):
+    """Декоратор-версія stage() для sync і async функцій."""
+    def wrap(fn):
+        if asyncio.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def inner(*args, **kwargs):
+                with stage(name):
+                    return await fn(*args, **kwargs)
+        else:
+            @functools.wraps(fn)
+            def inner(*args, **kwargs):
+                with stage(name):
+                    return fn(*args, **kwargs)
+        return inner
+    return wrap
@@ -0,0 +1,58 @@
+import asyncio
+import time
+
+
+class TokenBucket:
+    """Класичне відро: місткість capacity, поповнення rate_per_s одиниць за секунду."""
+
+    def __init__(self, capacity: float, rate_per_s: float):
+        self.capacity = capacity
+        self.rate = rate_per_s
+        self.level = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float):
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount: float, now: float) -> float:
+        """Скільки секунд чекати, доки в відрі стане amount (0 — можна одразу)."""
+        self._refill(now)
+        amount = min(amount, self.capacity)
+        if self.level >= amount:
+            return 0.0
+        return (amount - self.level) / self.rate if self.rate > 0 else float("inf")
+
+    def take(self, amount: float):
+        self.level -= min(amount, self.capacity)
+
+
+class RateLimiter:
+    """
+    Планувальник запитів до OpenAI з бюджетами requests-per-minute і tokens-per-minute.
+    Черговість — FIFO (через lock); pause() виставляє глобальну паузу після 429 Retry-After.
+    """
+
+    def __init__(self, rpm: int, tpm: int):
+        self.requests = TokenBucket(rpm, rpm / 60.0)
+        self.tokens = TokenBucket(tpm, tpm / 60.0)
+        self._lock = asyncio.Lock()
+        self._resume_at = 0.0
+
+    def pause(self, seconds: float):
+        self._resume_at = max(self._resume_at, time.monotonic() + seconds)
+
+    async def acquire(self, tokens: int = 0):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                wait = max(
+                    self._resume_at - now,
+                    self.requests.wait_time(1, now),
+                    self.tokens.wait_time(tokens, now),
+                )
+                if wait <= 0:
+                    self.requests.take(1)
+                    self.tokens.take(tokens)
+                    return
+                await asyncio.sleep(wait)
@@ -0,0 +1,200 @@
+import os
+import time
+import asyncio
+from typing import Iterable, List, Optional
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramBadRequest, TelegramRetryAfter
+from aiogram.types import BufferedInputFile
+
+from logs import log
+
+# Доставка звітів у Telegram: шматки ≤ 4096 символів, по межах секцій і рядків,
+# у порядку, з паузою між повідомленнями в один чат і повагою до 429 retry_after.
+TG_MESSAGE_LIMIT     = 4096
+REPORT_MIN_INTERVAL  = float(os.getenv("REPORT_MIN_INTERVAL", "1.1"))   # Telegram: ~1 повідомлення/с в один чат
+REPORT_MAX_MESSAGES  = int(os.getenv("REPORT_MAX_MESSAGES", "8"))       # далі — весь звіт одним файлом
+REPORT_SEND_RETRIES  = int(os.getenv("REPORT_SEND_RETRIES", "5"))
+
+SECTION_SEP = "\n\n"
+
+
+def split_message(text: str, limit: int = TG_MESSAGE_LIMIT) -> List[str]:
+    """
+    Розбити текст на повідомлення ≤ limit: спершу по порожніх рядках (секції), всередині
+    надто великої секції — по рядках, і лише надто довгий рядок — жорстко по limit.
+    """
+    if len(text) <= limit:
+        return [text] if text else []
+    blocks: List[str] = []
+    for block in text.split(SECTION_SEP):
+        if len(block) <= limit:
+            blocks.append(block)
+            continue
+        lines: List[str] = []
+        for line in block.split("\n"):
+            while len(line) > limit:
+                lines.append(line[:limit])
+                line = line[limit:]
+            lines.append(line)
+        blocks.extend(pack(lines, limit, sep="\n"))
+    return pack(blocks, limit)
+
+
+def pack(pieces: Iterable[str], limit: int = TG_MESSAGE_LIMIT, sep: str = SECTION_SEP) -> List[str]:
+    """Склеїти шматки (кожен ≤ limit) через sep у якомога менше повідомлень ≤ limit."""
+    out: List[str] = []
+    cur: Optional[str] = None
+    for p in pieces:
+        if cur is None:
+            cur = p
+        elif len(cur) + len(sep) + len(p) <= limit:
+            cur = cur + sep + p
+        else:
+            out.append(cur)
+            cur = p
+    if cur:
+        out.append(cur)
+    return out
+
+
+async def send_text(bot: Bot, chat_id: int, text: str, reply_to: Optional[int] = None):
+    """
+    Одне повідомлення з повторами: на 429 чекаємо retry_after, на «can't parse entities»
+    (Markdown зламався при розбитті або в тексті нотатки) — повтор без parse_mode.
+    """
+    kwargs = {"reply_to_message_id": reply_to} if reply_to else {}
+    for attempt in range(REPORT_SEND_RETRIES):
+        try:
+            return await bot.send_message(chat_id, text, **kwargs)
+        except TelegramRetryAfter as e:
+            log("TG_RETRY_AFTER", chat=chat_id, retry_after=e.retry_after, attempt=attempt + 1)
+            await asyncio.sleep(e.retry_after)
+        except TelegramBadRequest as e:
+            if "parse entities" in str(e).lower() and "parse_mode" not in kwargs:
+                kwargs["parse_mode"] = None
+                continue
+            raise
+    raise RuntimeError(f"send_message у {chat_id}: вичерпано {REPORT_SEND_RETRIES} спроб")
+
+
+async def send_document(bot: Bot, chat_id: int, text: str, filename: str, caption: str):
+    for attempt in range(REPORT_SEND_RETRIES):
+        try:
+            return await bot.send_document(
+                chat_id, BufferedInputFile(text.encode("utf-8"), filename=filename), caption=caption
+            )
+        except TelegramRetryAfter as e:
+            log("TG_RETRY_AFTER", chat=chat_id, retry_after=e.retry_after, attempt=attempt + 1)
+            await asyncio.sleep(e.retry_after)
+    raise RuntimeError(f"send_document у {chat_id}: вичерпано {REPORT_SEND_RETRIES} спроб")
+
+
+class ReportStream:
+    """
+    Потокова доставка звіту: секції додаються в порядку готовності (add), фоновий насос
+    пакує все, що накопичилося, у повідомлення ≤ 4096 і шле їх не частіше за min_interval.
+    Перша секція йде одразу, наступні, що встигли за паузу, склеюються в одне повідомлення.
+    Якщо звіт не влазить у max_messages, решта не шлеться частинами — у кінці (finish)
+    весь звіт іде одним документом (уже надіслані повідомлення лишаються як початок).
+
+        async with ReportStream(bot, chat_id, filename="report.md") as rs:
+            for task in tasks:          # у порядку секцій
+                await rs.add(await task)
+    """
+
+    def __init__(self, bot: Bot, chat_id: int, filename: str = "report.md",
+                 reply_to: Optional[int] = None, min_interval: float = REPORT_MIN_INTERVAL,
+                 max_messages: int = REPORT_MAX_MESSAGES):
+        self.bot = bot
+        self.chat_id = chat_id
+        self.filename = filename
+        self.reply_to = reply_to
+        self.min_interval = min_interval
+        self.max_messages = max_messages
+        self.sections: List[str] = []
+        self.messages_sent = 0
+        self.overflow = False
+        self._pending: List[str] = []
+        self._wakeup = asyncio.Event()
+        self._closed = False
+        self._last_sent = 0.0
+        self._pump_task: Optional[asyncio.Task] = None
+
+    async def __aenter__(self):
+        self._pump_task = asyncio.create_task(self._pump())
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            await self.finish()
+        else:
+            self._pump_task.cancel()
+            await asyncio.gather(self._pump_task, return_exceptions=True)
+
+    async def add(self, section: str):
+        if not section:
+            return
+        self.sections.append(section)
+        self._pending.extend(split_message(section))
+        self._wakeup.set()
+        # Помилка відправки не повинна тихо зникнути у фоні
+        if self._pump_task is not None and self._pump_task.done():
+            self._pump_task.result()
+
+    async def _pump(self):
+        while True:
+            if not self._pending:
+                if self._closed:
+                    return
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+            if self.messages_sent >= self.max_messages - 1:
+                # Останнє повідомлення в бюджеті: лише якщо звіт завершено і залишок влазить у нього,
+                # інакше весь звіт піде документом у finish()
+                if not self._closed:
+                    self._wakeup.clear()
+                    await self._wakeup.wait()
+                    continue
+                if len(pack(self._pending)) > 1:
+                    self.overflow = True
+                    self._pending.clear()
+                    return
+            wait = self._last_sent + self.min_interval - time.monotonic()
+            if wait > 0:
+                await asyncio.sleep(wait)
+            text = self._take_message()
+            await send_text(self.bot, self.chat_id, text,
+                            reply_to=self.reply_to if self.messages_sent == 0 else None)
+            self.messages_sent += 1
+            self._last_sent = time.monotonic()
+
+    def _take_message(self) -> str:
+        """Зняти з черги стільки шматків, скільки влазить в одне повідомлення."""
+        text = self._pending.pop(0)
+        while self._pending and len(text) + len(SECTION_SEP) + len(self._pending[0]) <= TG_MESSAGE_LIMIT:
+            text += SECTION_SEP + self._pending.pop(0)
+        return text
+
+    async def finish(self):
+        """Дочекатися відправки всього; при переповненні — весь звіт документом."""
+        self._closed = True
+        self._wakeup.set()
+        if self._pump_task is not None:
+            await self._pump_task
+        if self.overflow:
+            full = SECTION_SEP.join(self.sections)
+            log("REPORT_AS_DOCUMENT", chat=self.chat_id, chars=len(full), sections=len(self.sections))
+            await send_document(
+                self.bot, self.chat_id, full, self.filename,
+                caption=f"Звіт завеликий для повідомлень ({len(full)} символів) — повна версія у файлі.",
+            )
+
+
+async def send_report(bot: Bot, chat_id: int, sections: Iterable[str], filename: str = "report.md",
+                      reply_to: Optional[int] = None):
+    """Готовий звіт (список секцій) — тими ж правилами, що й потоковий."""
+    async with ReportStream(bot, chat_id, filename=filename, reply_to=reply_to) as rs:
+        for s in sections:
+            await rs.add(s)
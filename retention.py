@@ -0,0 +1,183 @@
+import os
+import gzip
+import json
+import time
+import asyncio
+from datetime import date, timedelta
+from typing import Any, Dict, List, Optional, Tuple
+
+import db
+from cluster import INSTANCE_ID, Lease
+from logs import log
+from metrics import DB_FILE_BYTES, DB_RECLAIMED_BYTES, RETENTION_ARCHIVED_NOTES
+from util import day_bounds_epoch, local_day, now_tz
+
+# Життєвий цикл notes.db: нотатки, старші за RETENTION_DAYS, переносяться в денні архіви
+# ARCHIVE_DIR/YYYY/MM/notes-YYYY-MM-DD.jsonl.gz (звіти за діапазон перебудовують з них rollup-и),
+# далі incremental_vacuum повертає звільнені сторінки і checkpoint(TRUNCATE) обрізає WAL.
+RETENTION_DAYS         = int(os.getenv("RETENTION_DAYS", "0"))             # 0 — нотатки не архівуються
+RETENTION_INTERVAL_S   = int(os.getenv("RETENTION_INTERVAL_S", "3600"))
+RETENTION_FIRST_RUN_S  = int(os.getenv("RETENTION_FIRST_RUN_S", "120"))    # перший прогін після старту
+RETENTION_DELETE_BATCH = int(os.getenv("RETENTION_DELETE_BATCH", "500"))
+VACUUM_STEP_PAGES      = int(os.getenv("VACUUM_STEP_PAGES", "1024"))
+FTS_MERGE_STEP_PAGES   = int(os.getenv("FTS_MERGE_STEP_PAGES", "500"))
+ARCHIVE_DIR            = os.getenv("ARCHIVE_DIR") or os.path.join(
+    os.path.dirname(os.path.abspath(db.DB_PATH)), "archive"
+)
+
+# Підсумок останнього обслуговування на цьому інстансі — для /storage
+last_run: Dict[str, Any] = {}
+
+
+def archive_path(day: date) -> str:
+    return os.path.join(ARCHIVE_DIR, f"{day:%Y}", f"{day:%m}", f"notes-{day.isoformat()}.jsonl.gz")
+
+
+def _read_day(day: date) -> List[Dict[str, Any]]:
+    path = archive_path(day)
+    if not os.path.exists(path):
+        return []
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def _write_day(day: date, records: List[Dict[str, Any]]) -> int:
+    """
+    Дописати нотатки в архів дня: злиття з наявним файлом по id (повтор після збою між записом
+    архіву і видаленням не дублює), запис у .tmp + fsync + os.replace — файл або старий, або новий.
+    """
+    path = archive_path(day)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    merged = {r["id"]: r for r in _read_day(day)}
+    for r in records:
+        merged[r["id"]] = r
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as raw:
+        with gzip.GzipFile(fileobj=raw, mode="wb", mtime=0) as gz:
+            for r in sorted(merged.values(), key=lambda r: (r["ts"], r["id"])):
+                gz.write((json.dumps(r, ensure_ascii=False) + "\n").encode("utf-8"))
+        raw.flush()
+        os.fsync(raw.fileno())
+    os.replace(tmp, path)
+    return len(merged)
+
+
+async def archived_notes(day: date) -> List[Tuple[int, int, int, str, int, Optional[str]]]:
+    """Нотатки дня з архіву у формі db.get_notes_for_archive: (id, user_id, chat_id, text, ts, analysis)."""
+    records = await asyncio.to_thread(_read_day, day)
+    return [(r["id"], r["user_id"], r["chat_id"], r["text"], r["ts"], r.get("analysis")) for r in records]
+
+
+async def archive_day(day: date) -> int:
+    """Перенести нотатки дня з БД в архів; повертає кількість перенесених."""
+    start_ep, end_ep = day_bounds_epoch(day)
+    rows = await db.get_notes_for_archive(start_ep, end_ep)
+    if not rows:
+        return 0
+    records = [
+        {"id": r[0], "user_id": r[1], "chat_id": r[2], "text": r[3], "ts": r[4], "analysis": r[5]}
+        for r in rows
+    ]
+    total = await asyncio.to_thread(_write_day, day, records)
+    # Видаляємо лише після того, як архів на диску; тригер notes_fts_ad прибирає нотатки і з /find
+    await db.delete_notes([r[0] for r in rows], batch=RETENTION_DELETE_BATCH)
+    RETENTION_ARCHIVED_NOTES.inc(len(rows))
+    log("RETENTION_ARCHIVE_DAY", day=day.isoformat(), notes=len(rows), in_file=total)
+    return len(rows)
+
+
+async def archive_older_than(cutoff: date) -> Dict[str, int]:
+    """Архівувати всі дні до cutoff (не включно), від найстаршого; порожні дні пропускаються."""
+    days = notes = 0
+    while True:
+        ts = await db.get_first_note_ts()
+        if ts is None or local_day(ts) >= cutoff:
+            break
+        moved = await archive_day(local_day(ts))
+        if moved == 0:
+            break
+        days += 1
+        notes += moved
+    return {"days": days, "notes": notes}
+
+
+async def compact(merge_fts: bool = False) -> Dict[str, int]:
+    """
+    Після видалень — злиття сегментів notes_fts; далі incremental_vacuum і checkpoint(TRUNCATE):
+    у WAL-режимі файл зменшується саме на checkpoint.
+    """
+    before = db.db_files_bytes(db.get_store().path)
+    fts_steps = await db.fts_merge(FTS_MERGE_STEP_PAGES) if merge_fts else 0
+    freed = await db.incremental_vacuum(VACUUM_STEP_PAGES)
+    busy, wal_frames, checkpointed = await db.wal_checkpoint()
+    after = db.db_files_bytes(db.get_store().path)
+    DB_RECLAIMED_BYTES.inc(freed)
+    for name, size in after.items():
+        DB_FILE_BYTES.labels(name).set(size)
+    return {
+        "fts_merge_steps": fts_steps,
+        "vacuum_freed_bytes": freed,
+        "files_shrunk_bytes": sum(before.values()) - sum(after.values()),
+        "checkpoint_busy": busy,
+        "wal_frames": wal_frames,
+        "checkpointed": checkpointed,
+    }
+
+
+async def run_maintenance(today: Optional[date] = None) -> Dict[str, Any]:
+    """Один прогін: архівація (якщо RETENTION_DAYS > 0) і ущільнення файлів БД."""
+    started = time.perf_counter()
+    today = today or now_tz().date()
+    res: Dict[str, Any] = {"days": 0, "notes": 0}
+    if RETENTION_DAYS > 0:
+        res = await archive_older_than(today - timedelta(days=RETENTION_DAYS))
+    res.update(await compact(merge_fts=res["notes"] > 0))
+    res["at"] = int(time.time())
+    res["seconds"] = round(time.perf_counter() - started, 2)
+    last_run.clear()
+    last_run.update(res)
+    log("RETENTION_RUN", instance=INSTANCE_ID, **res)
+    return res
+
+
+async def run_retention_job() -> bool:
+    """Обслуговування рівно одним інстансом (оренда retention); лише для SQLite-сховища."""
+    if not isinstance(db.get_store(), db.NoteStore):
+        log("RETENTION_SKIP", reason="not_sqlite")
+        return False
+    async with Lease("retention").hold() as held:
+        if not held:
+            log("RETENTION_SKIP", reason="not_leader", instance=INSTANCE_ID)
+            return False
+        await run_maintenance()
+        return True
+
+
+async def retention_loop():
+    # Перший прогін невдовзі після старту (деплої частіші за інтервал), далі — кожні RETENTION_INTERVAL_S
+    await asyncio.sleep(RETENTION_FIRST_RUN_S)
+    while True:
+        try:
+            await run_retention_job()
+        except Exception as e:
+            log("RETENTION_ERROR", error=str(e))
+        await asyncio.sleep(RETENTION_INTERVAL_S)
+
+
+def _archive_stats() -> Dict[str, Any]:
+    files, size, days = 0, 0, []
+    for root, _, names in os.walk(ARCHIVE_DIR):
+        for name in names:
+            if name.startswith("notes-") and name.endswith(".jsonl.gz"):
+                files += 1
+                size += os.path.getsize(os.path.join(root, name))
+                days.append(name[len("notes-"):-len(".jsonl.gz")])
+    return {"files": files, "bytes": size, "first": min(days, default=None), "last": max(days, default=None)}
+
+
+async def storage_report() -> Dict[str, Any]:
+    """Дані для /storage: БД (db.storage_stats), архів на диску, останній прогін на цьому інстансі."""
+    out = await db.storage_stats()
+    out["archive"] = await asyncio.to_thread(_archive_stats)
+    out["last_run"] = dict(last_run)
+    return out
@@ -0,0 +1,207 @@
+import os
+import json
+import time
+import asyncio
+from collections import defaultdict
+from datetime import date, timedelta
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+from ai import merge_analyses, consolidate_analysis, estimate_tokens
+from db import (
+    get_all_notes_between, get_first_note_ts, get_note_analyses, get_notes_between, get_rollups_between,
+    get_user_chat_notes_between, rollup_day_put, rollup_days_between,
+)
+from logs import log
+from retention import archived_notes
+from summarize import summarize_notes, ANALYZE_CONSOLIDATE, ANALYZE_CHUNK_TOKENS
+from util import day_bounds_epoch, iter_days, local_day, now_tz
+
+# Денні rollup-и: аналіз за (день, user_id, chat_id) зберігається раз, а звіти за тиждень/місяць/діапазон
+# зливають готові rollup-и (дні -> тижні -> місяці) замість повторного аналізу сирих нотаток.
+ROLLUP_CONCURRENCY = int(os.getenv("ROLLUP_CONCURRENCY", "4"))
+MAX_RANGE_DAYS     = int(os.getenv("MAX_RANGE_DAYS", "366"))
+# Скільки недобудованих днів звіт за діапазон збирає одразу; більше — у фоні з прогресом (main.py)
+RANGE_SYNC_DAYS    = int(os.getenv("RANGE_SYNC_DAYS", "7"))
+# Скільки символів сирої нотатки брати в запасний rollup, коли аналіз групи не вдався
+ROLLUP_FALLBACK_CHARS = int(os.getenv("ROLLUP_FALLBACK_CHARS", "300"))
+
+
+async def _fallback_analysis(notes: List[Tuple[int, str]], archived: Dict[int, Optional[str]]) -> Dict:
+    """
+    Запасний rollup групи, коли аналіз не вдався: злиття вже збережених аналізів нотаток (з БД або архіву),
+    а нотатки без аналізу — сирим текстом у подіях.
+    """
+    stored = await get_note_analyses([note_id for note_id, _ in notes if note_id not in archived])
+    stored.update(archived)
+    analyses, raw = [], []
+    for note_id, text in notes:
+        try:
+            analyses.append(json.loads(stored[note_id]))
+        except (KeyError, TypeError, ValueError):
+            raw.append(text if len(text) <= ROLLUP_FALLBACK_CHARS else text[:ROLLUP_FALLBACK_CHARS] + "…")
+    merged = merge_analyses(analyses)
+    merged["events"].extend(raw)
+    return merged
+
+
+async def materialize_day(day: date, final: Optional[bool] = None, chat_id: Optional[int] = None,
+                          user_id: Optional[int] = None) -> int:
+    """
+    Зібрати rollup-и дня по (user_id, chat_id) і зберегти. final — день уже закінчився
+    (за замовчуванням визначається за поточним часом); нефінальні дні перебудовуються при запиті.
+    chat_id/user_id — лише групи цього чату/користувача (день лишається нефінальним для решти).
+    Повертає кількість нотаток дня (у межах фільтра).
+    """
+    if final is None:
+        final = day < now_tz().date()
+    start_ep, end_ep = day_bounds_epoch(day)
+    if chat_id is not None:
+        rows = list(await get_notes_between(chat_id, start_ep, end_ep))
+    elif user_id is not None:
+        rows = list(await get_user_chat_notes_between(user_id, start_ep, end_ep))
+    else:
+        rows = list(await get_all_notes_between(start_ep, end_ep))
+    # Дні, перенесені retention.py в архів, перебудовуються з архіву — разом зі збереженими там аналізами
+    in_db = {r[0] for r in rows}
+    archived: Dict[int, Optional[str]] = {}
+    for note_id, note_user, note_chat, text, ts, analysis in await archived_notes(day):
+        if chat_id is not None and note_chat != chat_id or user_id is not None and note_user != user_id:
+            continue
+        if note_id not in in_db:
+            rows.append((note_id, note_user, note_chat, text, ts))
+            archived[note_id] = analysis
+    groups: Dict[Tuple[int, int], List[Tuple[int, str]]] = defaultdict(list)
+    for note_id, note_user, note_chat, text, ts in rows:
+        groups[(note_user, note_chat)].append((note_id, text))
+
+    sem = asyncio.Semaphore(ROLLUP_CONCURRENCY)
+    failed = 0
+
+    async def one(key: Tuple[int, int], notes: List[Tuple[int, str]]):
+        nonlocal failed
+        group_archived = {note_id: archived[note_id] for note_id, _ in notes if note_id in archived}
+        async with sem:
+            try:
+                analysis = await summarize_notes(notes, group_archived)
+            except Exception as e:
+                # Одна група (напр. відкритий breaker чи збій моделі) не валить увесь день
+                failed += 1
+                log("ROLLUP_GROUP_ERROR", day=day.isoformat(), user=key[0], chat=key[1], error=str(e))
+                analysis = await _fallback_analysis(notes, group_archived)
+            return key[0], key[1], json.dumps(analysis, ensure_ascii=False), len(notes)
+
+    results = await asyncio.gather(*(one(k, n) for k, n in groups.items()))
+    # День із запасними rollup-ами не фіналізуємо — наступний запит перебудує його
+    final = final and not failed
+    await rollup_day_put(day.isoformat(), results, final, int(time.time()), chat_id=chat_id, user_id=user_id)
+    log("ROLLUP_DAY", day=day.isoformat(), final=final, chat=chat_id, user=user_id, groups=len(results),
+        notes=len(rows), failed=failed)
+    return len(rows)
+
+
+async def missing_days(first: date, last: date) -> List[date]:
+    """Дні діапазону, для яких ще немає фінального rollup-у (сьогоднішній — завжди)."""
+    if (last - first).days + 1 > MAX_RANGE_DAYS:
+        raise ValueError(f"діапазон довший за {MAX_RANGE_DAYS} днів")
+    built = await rollup_days_between(first.isoformat(), last.isoformat())
+    return [d for d in iter_days(first, last) if not built.get(d.isoformat())]
+
+
+async def ensure_days(first: date, last: date,
+                      on_progress: Optional[Callable[[int, int], Awaitable[None]]] = None,
+                      chat_id: Optional[int] = None, user_id: Optional[int] = None):
+    """
+    Добудувати rollup-и для днів діапазону, що ще не фінальні (сьогоднішній — завжди наново).
+    Незакінчені дні перебудовуються лише для запитаного чату/користувача (chat_id/user_id) —
+    звіт одного чату не переаналізовує сьогодні всіх інших; минулі дні — повністю, щоб стати фінальними.
+    """
+    today = now_tz().date()
+    days = await missing_days(first, last)
+    for i, day in enumerate(days, 1):
+        if day >= today:
+            await materialize_day(day, chat_id=chat_id, user_id=user_id)
+        else:
+            await materialize_day(day)
+        if on_progress:
+            await on_progress(i, len(days))
+
+
+async def _merge_level(analyses: List[Dict]) -> Dict:
+    """Злиття одного рівня ієрархії; з ANALYZE_CONSOLIDATE=1 — ще й смисловий дедуп моделлю."""
+    merged = merge_analyses(analyses)
+    if ANALYZE_CONSOLIDATE == "1" and len(analyses) > 1 \
+            and estimate_tokens(json.dumps(merged, ensure_ascii=False)) <= ANALYZE_CHUNK_TOKENS:
+        try:
+            merged = await consolidate_analysis(merged)
+        except Exception as e:
+            log("CONSOLIDATE_ERROR", scope="rollup", error=str(e))
+    return merged
+
+
+async def merge_hierarchical(by_day: Dict[str, List[Dict]]) -> Dict:
+    """
+    Дні -> ISO-тижні -> місяці -> підсумок. Кожен рівень зливає невелику кількість
+    уже злитих аналізів, тож і локальне злиття, і опційна консолідація лишаються дешевими.
+    """
+    weeks: Dict[Tuple[int, int], List[Dict]] = defaultdict(list)
+    for day_str in sorted(by_day):
+        d = date.fromisoformat(day_str)
+        iso = d.isocalendar()
+        weeks[(iso[0], iso[1])].append(merge_analyses(by_day[day_str]))
+    if len(weeks) <= 1:
+        return await _merge_level([a for w in weeks.values() for a in w])
+
+    months: Dict[Tuple[int, int], List[Dict]] = defaultdict(list)
+    for (year, week), days in weeks.items():
+        monday = date.fromisocalendar(year, week, 1)
+        months[(monday.year, monday.month)].append(await _merge_level(days))
+    if len(months) <= 1:
+        return await _merge_level([a for m in months.values() for a in m])
+    return await _merge_level([await _merge_level(m) for m in months.values()])
+
+
+async def range_analyses(first: date, last: date, chat_id: Optional[int] = None,
+                         user_id: Optional[int] = None,
+                         on_progress: Optional[Callable[[int, int], Awaitable[None]]] = None) -> Dict[int, Dict]:
+    """
+    Аналізи за діапазон днів [first, last] по користувачах: {user_id: merged}.
+    Фільтр — чат (chat_id) або один користувач з усіх чатів (user_id).
+    """
+    await ensure_days(first, last, on_progress, chat_id=chat_id, user_id=user_id)
+    rows = await get_rollups_between(first.isoformat(), last.isoformat(), chat_id=chat_id, user_id=user_id)
+    per_user: Dict[int, Dict[str, List[Dict]]] = defaultdict(lambda: defaultdict(list))
+    for day, uid, _, raw in rows:
+        try:
+            per_user[uid][day].append(json.loads(raw))
+        except ValueError:
+            continue
+    out: Dict[int, Dict] = {}
+    for uid in sorted(per_user):
+        out[uid] = await merge_hierarchical(per_user[uid])
+    return out
+
+
+async def backfill(first: Optional[date] = None, last: Optional[date] = None, force: bool = False,
+                   on_progress: Optional[Callable[[int, int], Awaitable[None]]] = None) -> Dict[str, int]:
+    """
+    Зібрати rollup-и для наявної історії: за замовчуванням від першої нотатки до вчора.
+    Уже фінальні дні пропускаються (force=True — перебудувати).
+    """
+    today = now_tz().date()
+    if first is None:
+        ts = await get_first_note_ts()
+        if ts is None:
+            return {"days": 0, "built": 0, "notes": 0}
+        first = local_day(ts)
+    if last is None:
+        last = max(first, today - timedelta(days=1))
+    built_days = {} if force else await rollup_days_between(first.isoformat(), last.isoformat())
+    days = [d for d in iter_days(first, last) if not built_days.get(d.isoformat())]
+    notes = 0
+    for i, d in enumerate(days, 1):
+        notes += await materialize_day(d)
+        if on_progress:
+            await on_progress(i, len(days))
+    total = (last - first).days + 1
+    log("ROLLUP_BACKFILL", first=first.isoformat(), last=last.isoformat(), built=len(days), notes=notes)
+    return {"days": total, "built": len(days), "notes": notes}
@@ -0,0 +1,107 @@
+import re
+from datetime import date
+from typing import Collection, List, Optional
+
+from db import FTS_TOKENIZE, FTS_PREFIX, SNIPPET_OPEN, SNIPPET_CLOSE
+from util import parse_day
+
+# Український «стемінг» для запиту: відкидаємо типове закінчення і шукаємо за основою як префіксом
+# (звіти/звіту/звітом -> "звіт"*). Індекс лишається звичайним unicode61 — основа потрібна лише в запиті.
+UK_SUFFIXES = sorted([
+    "ами", "ями", "ові", "еві", "єві", "ого", "ому", "ими", "іми", "их", "іх", "ий", "ій", "ої", "ою", "ею",
+    "єю", "ам", "ям", "ах", "ях", "ів", "їв", "ом", "ем", "єм", "а", "я", "у", "ю", "і", "ї", "и", "е", "є",
+    "о", "ь",
+], key=len, reverse=True)
+MIN_STEM = 3
+# Довжини префіксних індексів notes_fts (FTS_PREFIX). "основа"* іншої довжини зливала б усі слова з цією основою
+# (десятки мс на 1M нотаток), тож така основа шукається як OR точних словоформ: основа + кожне закінчення
+# з UK_SUFFIXES. Ціна — словоформи поза цим списком (похідні слова, «звітність» для «звіт») не знаходяться;
+# для основ індексованих довжин пошук лишається префіксним, як раніше.
+PREFIX_LENGTHS = frozenset(int(n) for n in FTS_PREFIX.split())
+
+_WORD_RE = re.compile(r"\w+", re.UNICODE)
+_PHRASE_RE = re.compile(r'"([^"]+)"')
+
+
+def stem_uk(word: str) -> str:
+    w = word.casefold()
+    for suf in UK_SUFFIXES:
+        if w.endswith(suf) and len(w) - len(suf) >= MIN_STEM:
+            return w[: -len(suf)]
+    return w
+
+
+def build_match(query: str, tokenize: str = FTS_TOKENIZE,
+                prefix_lengths: Collection[int] = PREFIX_LENGTHS) -> str:
+    """
+    Запит користувача -> вираз FTS5 MATCH. Усі слова обов'язкові (AND), "фраза в лапках" — точна фраза.
+    unicode61: слово -> "основа"*, якщо для довжини основи є префіксний індекс (або індексів немає зовсім),
+    інакше -> ("основа" OR "основа+закінчення" ...);
+    trigram: слово -> "основа" як підрядок (коротші за 3 символи відкидаються).
+    Спецсимволи FTS5 у запиті ніколи не потрапляють у вираз — кожен термін у лапках.
+    """
+    trigram = tokenize.startswith("trigram")
+    terms: List[str] = []
+    for phrase in _PHRASE_RE.findall(query):
+        words = _WORD_RE.findall(phrase.casefold())
+        if words:
+            terms.append('"' + " ".join(words) + '"')
+    rest = _PHRASE_RE.sub(" ", query)
+    words = _WORD_RE.findall(rest.casefold())
+    # Службові 1–2-літерні слова (в, на, по) лише звужують пошук — відкидаємо, якщо є інші терміни
+    if terms or any(len(w) > 2 for w in words):
+        words = [w for w in words if len(w) > 2]
+    for word in words:
+        stem = stem_uk(word)
+        if trigram:
+            if len(stem) >= 3:
+                terms.append(f'"{stem}"')
+        elif len(stem) < MIN_STEM:
+            terms.append(f'"{word}"')
+        elif prefix_lengths and len(stem) not in prefix_lengths:
+            terms.append("(" + " OR ".join(f'"{stem}{suf}"' for suf in ("", *UK_SUFFIXES)) + ")")
+        else:
+            terms.append(f'"{stem}"*')
+    # Явний AND: FTS5 не приймає неявного AND поруч із дужками
+    return " AND ".join(terms)
+
+
+class FindQuery:
+    def __init__(self, text: str = "", mine: bool = False,
+                 first: Optional[date] = None, last: Optional[date] = None):
+        self.text = text
+        self.mine = mine
+        self.first = first
+        self.last = last
+
+
+def parse_find(command_text: str) -> FindQuery:
+    """
+    '/find [me] [from:YYYY-MM-DD] [to:YYYY-MM-DD] слова "фраза"' -> FindQuery.
+    me — мої нотатки з усіх чатів замість нотаток поточного чату.
+    """
+    parts = command_text.split(maxsplit=1)
+    rest = parts[1] if len(parts) > 1 else ""
+    q = FindQuery()
+    words = []
+    for token in rest.split():
+        low = token.casefold()
+        if low == "me":
+            q.mine = True
+        elif low.startswith(("from:", "від:")):
+            q.first = parse_day(token.split(":", 1)[1])
+        elif low.startswith(("to:", "до:")):
+            q.last = parse_day(token.split(":", 1)[1])
+        else:
+            words.append(token)
+    q.text = " ".join(words)
+    return q
+
+
+_MD_SPECIAL = re.compile(r"([_*`\[])")
+
+
+def render_snippet(snippet: str) -> str:
+    """Фрагмент із маркерами збігів -> Markdown: спецсимволи екрановані, збіги жирним."""
+    s = _MD_SPECIAL.sub(r"\\\1", snippet.replace("\n", " "))
+    return s.replace(SNIPPET_OPEN, "*").replace(SNIPPET_CLOSE, "*")
@@ -0,0 +1,159 @@
+import os
+import json
+import asyncio
+from typing import Dict, List, Optional, Sequence, Set, Tuple
+
+from ai import analyze_notes_text, consolidate_analysis, merge_analyses, estimate_tokens
+from db import get_note_analyses, set_note_analysis
+from logs import log
+
+# incremental — кожна нотатка аналізується один раз (одразу після збереження), зведення = локальне злиття;
+# full — як раніше, весь текст вікна однією completion.
+ANALYZE_MODE        = os.getenv("ANALYZE_MODE", "incremental")
+# 1 — після локального злиття ще один короткий виклик моделі, щоб прибрати смислові дублікати
+ANALYZE_CONSOLIDATE = os.getenv("ANALYZE_CONSOLIDATE", "0")
+
+# Map-reduce для великих входів: бюджет токенів тексту на один виклик, скільки останніх нотаток
+# попереднього шматка повторювати на початку наступного (контекст), і паралельність map-фази.
+ANALYZE_CHUNK_TOKENS      = int(os.getenv("ANALYZE_CHUNK_TOKENS", "6000"))
+ANALYZE_CHUNK_OVERLAP     = int(os.getenv("ANALYZE_CHUNK_OVERLAP", "1"))
+ANALYZE_MAP_CONCURRENCY   = int(os.getenv("ANALYZE_MAP_CONCURRENCY", "4"))
+
+_background: Set[asyncio.Task] = set()
+
+def _split_oversized(text: str, budget: int) -> List[str]:
+    """Одна нотатка, більша за бюджет: ріжемо по рядках, а довгі рядки — по символах."""
+    max_chars = max(1, budget * 3)
+    parts, cur = [], ""
+    for line in text.splitlines() or [text]:
+        while len(line) > max_chars:
+            if cur:
+                parts.append(cur)
+                cur = ""
+            parts.append(line[:max_chars])
+            line = line[max_chars:]
+        if cur and len(cur) + 1 + len(line) > max_chars:
+            parts.append(cur)
+            cur = line
+        else:
+            cur = f"{cur}\n{line}" if cur else line
+    if cur:
+        parts.append(cur)
+    return parts
+
+def chunk_notes(texts: Sequence[str], budget: int = ANALYZE_CHUNK_TOKENS,
+                overlap: int = ANALYZE_CHUNK_OVERLAP) -> List[List[str]]:
+    """
+    Розбиває нотатки на шматки по межах нотаток так, щоб текст кожного шматка вкладався в budget токенів.
+    Останні overlap нотаток шматка повторюються на початку наступного (якщо влазять у бюджет).
+    """
+    pieces: List[str] = []
+    for t in texts:
+        pieces.extend(_split_oversized(t, budget) if estimate_tokens(t) > budget else [t])
+
+    chunks: List[List[str]] = []
+    cur: List[str] = []
+    cur_tokens = 0
+    for p in pieces:
+        need = estimate_tokens(p)
+        if cur and cur_tokens + need > budget:
+            chunks.append(cur)
+            carry = cur[-overlap:] if overlap > 0 else []
+            while carry and sum(estimate_tokens(c) for c in carry) + need > budget:
+                carry = carry[1:]
+            cur = list(carry)
+            cur_tokens = sum(estimate_tokens(c) for c in cur)
+        cur.append(p)
+        cur_tokens += need
+    if cur:
+        chunks.append(cur)
+    return chunks
+
+async def analyze_texts(texts: Sequence[str]) -> Dict:
+    """
+    Аналіз довільного обсягу нотаток: якщо влазить у бюджет — один виклик,
+    інакше map (паралельно по шматках) + reduce (локальне злиття з дедупом задач/ризиків).
+    """
+    chunks = chunk_notes(texts)
+    if len(chunks) == 1:
+        return await analyze_notes_text("\n".join(chunks[0]))
+
+    sem = asyncio.Semaphore(ANALYZE_MAP_CONCURRENCY)
+
+    async def map_one(chunk: List[str]) -> Dict:
+        async with sem:
+            return await analyze_notes_text("\n".join(chunk))
+
+    log("ANALYZE_MAP", chunks=len(chunks), notes=len(texts))
+    results = await asyncio.gather(*(map_one(c) for c in chunks))
+    return merge_analyses(results)
+
+async def analyze_note(note_id: int, text: str) -> Dict:
+    """Аналіз однієї нотатки + збереження поруч із нею в notes.analysis."""
+    analysis = await analyze_texts([text])
+    await set_note_analysis(note_id, json.dumps(analysis, ensure_ascii=False))
+    return analysis
+
+def schedule_note_analysis(note_id: int, text: str):
+    """Фоновий аналіз щойно збереженої нотатки, щоб зведення потім лише зливало готові результати."""
+    if ANALYZE_MODE != "incremental":
+        return
+
+    async def run():
+        try:
+            await analyze_note(note_id, text)
+        except Exception as e:
+            # Не страшно: summarize_notes доаналізує нотатку під час зведення
+            log("NOTE_ANALYZE_ERROR", note=note_id, error=str(e))
+
+    task = asyncio.create_task(run())
+    _background.add(task)
+    task.add_done_callback(_background.discard)
+
+async def summarize_notes(notes: Sequence[Tuple[int, str]],
+                          archived: Optional[Dict[int, Optional[str]]] = None) -> Dict:
+    """
+    Аналіз набору нотаток [(note_id, text), ...] згідно з ANALYZE_MODE.
+    archived — нотатки, уже перенесені retention.py в архів: {note_id: analysis_json або None}.
+    Їхні аналізи беруться з архіву, а відсутні рахуються без запису (рядків у notes уже немає).
+    """
+    if ANALYZE_MODE != "incremental":
+        return await analyze_texts([t for _, t in notes])
+
+    archived = archived or {}
+    stored = await get_note_analyses([note_id for note_id, _ in notes if note_id not in archived])
+    stored.update((note_id, raw) for note_id, raw in archived.items() if raw)
+    analyses: Dict[int, Dict] = {}
+    missing = []
+    for note_id, text in notes:
+        raw = stored.get(note_id)
+        if raw:
+            try:
+                analyses[note_id] = json.loads(raw)
+                continue
+            except ValueError:
+                pass
+        missing.append((note_id, text))
+
+    # Доаналізувати лише нові нотатки — вартість зведення росте з кількістю нових, а не всіх
+    # (обмежено ANALYZE_MAP_CONCURRENCY: історія до інкрементального режиму не має аналізів зовсім)
+    if missing:
+        sem = asyncio.Semaphore(ANALYZE_MAP_CONCURRENCY)
+
+        async def one(note_id: int, text: str) -> Dict:
+            async with sem:
+                if note_id in archived:
+                    return await analyze_texts([text])
+                return await analyze_note(note_id, text)
+
+        results = await asyncio.gather(*(one(i, t) for i, t in missing))
+        analyses.update(zip((i for i, _ in missing), results))
+
+    merged = merge_analyses(analyses[note_id] for note_id, _ in notes)
+    draft_tokens = estimate_tokens(json.dumps(merged, ensure_ascii=False))
+    if ANALYZE_CONSOLIDATE == "1" and len(notes) > 1 and draft_tokens <= ANALYZE_CHUNK_TOKENS:
+        try:
+            merged = await consolidate_analysis(merged)
+        except Exception as e:
+            log("CONSOLIDATE_ERROR", error=str(e))
+    return merged
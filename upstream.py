@@ -0,0 +1,232 @@
+import os
+import time
+import random
+import asyncio
+from collections import deque
+from typing import Awaitable, Callable, Dict, Optional
+
+import httpx
+
+from logs import log
+from ratelimit import RateLimiter
+
+# Повтори з експоненційним backoff (full jitter), з урахуванням Retry-After
+UPSTREAM_RETRIES      = int(os.getenv("UPSTREAM_RETRIES", "3"))
+UPSTREAM_BACKOFF_BASE = float(os.getenv("UPSTREAM_BACKOFF_BASE", "0.5"))
+UPSTREAM_BACKOFF_CAP  = float(os.getenv("UPSTREAM_BACKOFF_CAP", "20"))
+# Circuit breaker: після N поспіль невдач ендпоінт «відкривається» на BREAKER_RESET_S секунд
+BREAKER_FAILURES = int(os.getenv("BREAKER_FAILURES", "5"))
+BREAKER_RESET_S  = float(os.getenv("BREAKER_RESET_S", "30"))
+# Хеджування: другий паралельний запит, якщо перший довший за p95 (мінімум HEDGE_MIN_DELAY).
+# p95 рахується на одиницю «вартості» запиту (cost, напр. байти аудіо) — довгі запити не хеджуються лише через довжину.
+HEDGE_MIN_SAMPLES = int(os.getenv("HEDGE_MIN_SAMPLES", "20"))
+HEDGE_MIN_DELAY   = float(os.getenv("HEDGE_MIN_DELAY", "2"))
+
+RETRYABLE_STATUS = {408, 409, 429, 500, 502, 503, 504}
+
+
+class CircuitOpen(Exception):
+    """Ендпоінт тимчасово вимкнений breaker-ом — падаємо одразу, без очікування таймаутів."""
+
+
+class CircuitBreaker:
+    def __init__(self, failures: int = BREAKER_FAILURES, reset_s: float = BREAKER_RESET_S):
+        self.threshold = failures
+        self.reset_s = reset_s
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self._probe = False   # у half-open пропускаємо рівно один пробний запит
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.reset_s:
+            return "half_open"
+        return "open"
+
+    def allow(self) -> bool:
+        state = self.state
+        if state == "closed":
+            return True
+        if state == "half_open" and not self._probe:
+            self._probe = True
+            return True
+        return False
+
+    def record_success(self):
+        self.failures = 0
+        self.opened_at = None
+        self._probe = False
+
+    def release(self):
+        """
+        Проба без результату — 429, PoolTimeout, скасування, інша помилка: звільнити її,
+        щоб наступний виклик міг пробувати знову (інакше breaker лишився б відкритим назавжди).
+        """
+        self._probe = False
+
+    def record_failure(self):
+        self.failures += 1
+        if self._probe or self.failures >= self.threshold:
+            self.opened_at = time.monotonic()
+        self._probe = False
+
+
+class LatencyTracker:
+    def __init__(self, size: int = 200):
+        self._values: deque = deque(maxlen=size)
+
+    def add(self, seconds: float):
+        self._values.append(seconds)
+
+    def p95(self) -> Optional[float]:
+        if len(self._values) < HEDGE_MIN_SAMPLES:
+            return None
+        values = sorted(self._values)
+        return values[int(len(values) * 0.95) - 1]
+
+
+_breakers: Dict[str, CircuitBreaker] = {}
+_latency: Dict[str, LatencyTracker] = {}
+hedge_stats = {"hedged": 0, "hedge_won": 0}
+
+def breaker(endpoint: str) -> CircuitBreaker:
+    if endpoint not in _breakers:
+        _breakers[endpoint] = CircuitBreaker()
+    return _breakers[endpoint]
+
+def latency(endpoint: str) -> LatencyTracker:
+    if endpoint not in _latency:
+        _latency[endpoint] = LatencyTracker()
+    return _latency[endpoint]
+
+def stats() -> Dict[str, str]:
+    out = {name: f"{b.state}/{b.failures}" for name, b in _breakers.items()}
+    out.update(hedge_stats)
+    return out
+
+def retry_after_seconds(r: httpx.Response) -> Optional[float]:
+    value = r.headers.get("retry-after")
+    if value is None:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        return None
+
+def backoff_delay(attempt: int) -> float:
+    return random.uniform(0, min(UPSTREAM_BACKOFF_CAP, UPSTREAM_BACKOFF_BASE * (2 ** attempt)))
+
+async def _hedged(endpoint: str, send: Callable[[], Awaitable[httpx.Response]], cost: float = 1.0) -> httpx.Response:
+    """Перший запит; якщо він довший за p95 (на одиницю cost) — другий паралельно. Перемагає перша успішна відповідь."""
+    p95 = latency(endpoint).p95()
+    first = asyncio.ensure_future(send())
+    if p95 is None:
+        return await first
+    try:
+        done, _ = await asyncio.wait({first}, timeout=max(p95 * cost, HEDGE_MIN_DELAY))
+    except BaseException:
+        first.cancel()
+        raise
+    if done:
+        return first.result()
+
+    hedge_stats["hedged"] += 1
+    second = asyncio.ensure_future(send())
+    pending = {first, second}
+    last_exc: Optional[BaseException] = None
+    result: Optional[httpx.Response] = None
+    try:
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is not None:
+                    last_exc = task.exception()
+                    continue
+                r = task.result()
+                if r.status_code < 500 or result is None:
+                    result = r
+                if r.status_code < 500:
+                    if task is second:
+                        hedge_stats["hedge_won"] += 1
+                    return r
+        if result is not None:
+            return result
+        raise last_exc
+    finally:
+        for task in pending:
+            task.cancel()
+
+async def call(
+    endpoint: str,
+    send: Callable[[], Awaitable[httpx.Response]],
+    *,
+    retries: int = UPSTREAM_RETRIES,
+    hedge: bool = False,
+    limiter: Optional[RateLimiter] = None,
+    tokens: int = 0,
+    cost: float = 1.0,
+) -> httpx.Response:
+    """
+    Виклик апстріму з повторами, circuit breaker-ом і (опційно) хеджуванням.
+    send() має щоразу будувати новий запит (новий потік тіла). Повертає останню відповідь —
+    raise_for_status() лишається на викликачеві; мережеві помилки після всіх спроб пробрасуються.
+    cost — відносна «вартість» запиту для порогу хеджування (латентність нормується на неї).
+    """
+    br = breaker(endpoint)
+    last_exc: Optional[BaseException] = None
+    r: Optional[httpx.Response] = None
+    for attempt in range(retries + 1):
+        probe = br.state == "half_open"
+        if not br.allow():
+            raise CircuitOpen(f"{endpoint}: circuit open ({br.failures} failures)")
+        recorded = False
+        try:
+            if limiter is not None:
+                await limiter.acquire(tokens)
+            started = time.monotonic()
+            try:
+                r = await (_hedged(endpoint, send, cost) if hedge else send())
+            except httpx.PoolTimeout as e:
+                # Зайнятий локальний пул з'єднань — черга в нас, а не збій апстріму: breaker не чіпаємо
+                last_exc, r = e, None
+                log("UPSTREAM_POOL_TIMEOUT", endpoint=endpoint, attempt=attempt)
+            except (httpx.TimeoutException, httpx.TransportError) as e:
+                br.record_failure()
+                recorded = True
+                last_exc, r = e, None
+                log("UPSTREAM_ERROR", endpoint=endpoint, attempt=attempt, error=repr(e))
+            else:
+                if r.status_code not in RETRYABLE_STATUS:
+                    br.record_success()
+                    recorded = True
+                    latency(endpoint).add((time.monotonic() - started) / max(cost, 1e-9))
+                # 429 — це ліміт, а не збій апстріму: breaker не чіпаємо
+                elif r.status_code != 429:
+                    br.record_failure()
+                    recorded = True
+        finally:
+            # Будь-який вихід без результату для breaker-а (429, PoolTimeout, скасування, інший виняток)
+            if probe and not recorded:
+                br.release()
+
+        if r is None:
+            if attempt < retries:
+                await asyncio.sleep(backoff_delay(attempt))
+            continue
+        if r.status_code not in RETRYABLE_STATUS:
+            return r
+        log("UPSTREAM_RETRY", endpoint=endpoint, attempt=attempt, status=r.status_code)
+        if attempt >= retries:
+            break
+        wait = retry_after_seconds(r)
+        if wait is not None and limiter is not None and r.status_code == 429:
+            # Пауза для всіх паралельних викликів цього ліміту, а не лише для цього
+            limiter.pause(wait)
+            continue
+        await asyncio.sleep(wait if wait is not None else backoff_delay(attempt))
+
+    if r is not None:
+        return r
+    raise last_exc
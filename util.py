@@ -1,6 +1,6 @@
 import os
 import pytz
-from datetime import datetime, timedelta
+from datetime import date, datetime, timedelta
 
 # Локальна TZ (можна передати через env TZ=Europe/Kyiv)
 TZ = pytz.timezone(os.getenv("TZ", "Europe/Kyiv"))
@@ -12,14 +12,44 @@ def now_tz() -> datetime:
 def today_bounds_epoch():
     """
     Межі 'сьогодні' у ЛОКАЛЬНІЙ TZ -> (start_utc_epoch, end_utc_epoch), де end НЕ включно.
-    Важливо: використовуємо replace(...) на вже таймзонованому now_tz().
     """
-    n = now_tz()
-    start_local = n.replace(hour=0, minute=0, second=0, microsecond=0)
-    end_local = start_local + timedelta(days=1)  # [start, end)
-    start_utc = start_local.astimezone(pytz.UTC)
-    end_utc = end_local.astimezone(pytz.UTC)
-    return int(start_utc.timestamp()), int(end_utc.timestamp())
+    return day_bounds_epoch(now_tz().date())
+
+def day_bounds_epoch(day: date):
+    """
+    Межі локального дня day -> (start_utc_epoch, end_utc_epoch), end НЕ включно.
+    Через TZ.localize, а не replace(tzinfo=...): pytz інакше дає LMT-зсув, а в дні переходу
+    на літній/зимовий час доба має 23/25 годин.
+    """
+    start_local = TZ.localize(datetime(day.year, day.month, day.day))
+    nxt = day + timedelta(days=1)
+    end_local = TZ.localize(datetime(nxt.year, nxt.month, nxt.day))  # [start, end)
+    return int(start_local.timestamp()), int(end_local.timestamp())
+
+def range_bounds_epoch(first: date, last: date):
+    """Межі діапазону днів [first, last] включно -> (start_utc_epoch, end_utc_epoch)."""
+    return day_bounds_epoch(first)[0], day_bounds_epoch(last)[1]
+
+def local_day(ts: int) -> date:
+    """Локальний день для UTC epoch."""
+    return datetime.fromtimestamp(ts, tz=pytz.UTC).astimezone(TZ).date()
+
+def parse_day(s: str) -> date:
+    """'2024-05-31' або '31.05.2024' -> date; ValueError для іншого."""
+    s = s.strip()
+    for fmt in ("%Y-%m-%d", "%d.%m.%Y"):
+        try:
+            return datetime.strptime(s, fmt).date()
+        except ValueError:
+            pass
+    raise ValueError(f"невідомий формат дати: {s!r} (очікується YYYY-MM-DD або DD.MM.YYYY)")
+
+def iter_days(first: date, last: date):
+    """Дні від first до last включно."""
+    d = first
+    while d <= last:
+        yield d
+        d += timedelta(days=1)
 
 def next_run_at(hour=20, minute=0, second=0) -> datetime:
     """Повертає локальний datetime наступного запуску (за замовчуванням 20:00)."""